@@ -0,0 +1,174 @@
+"""
+Application settings.
+
+Tunables for the matching and ingestion pipelines, read once from the environment
+(and .env) at import time so services and routes share the same values.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _csv(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# Blocking keys used to build candidate sets for fuzzy matching.
+# Set to "none" to score every stored patient (full scan).
+MATCH_BLOCKING_KEYS = _csv(os.getenv(
+    "MATCH_BLOCKING_KEYS",
+    "dob,name_soundex,name_prefix,phone_last4,email_local"
+))
+
+# On-disk IVF vector index over Patient.embedding (see app.services.embedding_service)
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "data/vector_index")
+# Number of inverted lists; 0 picks ~sqrt(rows) at build time
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))
+# Lists scanned per query: higher is better recall, lower is faster
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# Below this many indexed rows the exact in-memory store is used instead
+EXACT_SEARCH_MAX_ROWS = int(os.getenv("EXACT_SEARCH_MAX_ROWS", "20000"))
+
+# Batched OpenAI embedding requests (see app.utils.embeddings_utils)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+# Approximate token budget per request (estimated at ~4 characters per token)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+# Base delay in seconds for exponential backoff between retries
+EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", "1.0"))
+
+# Embedding cache: in-process LRU tier plus a persistent SQLite tier ("" disables it)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+
+# Threads used by the batch fuzzy scorer for large matrices (-1 = all cores)
+FUZZY_SCORER_WORKERS = int(os.getenv("FUZZY_SCORER_WORKERS", "-1"))
+
+# Background fuzzy-match jobs (see app.services.match_jobs)
+MATCH_JOB_WORKERS = int(os.getenv("MATCH_JOB_WORKERS", "2"))
+MATCH_JOB_CHUNK_SIZE = int(os.getenv("MATCH_JOB_CHUNK_SIZE", "100"))
+# Finished jobs are forgotten after this many seconds
+MATCH_JOB_TTL_SECONDS = int(os.getenv("MATCH_JOB_TTL_SECONDS", "3600"))
+
+# Multi-process fuzzy matching (see app.services.parallel_matcher); < 2 workers disables it
+MATCH_PARALLEL_WORKERS = int(os.getenv("MATCH_PARALLEL_WORKERS", str(os.cpu_count() or 1)))
+# Batches with at least this many fuzzy-stage records use the process pool
+MATCH_PARALLEL_MIN_BATCH = int(os.getenv("MATCH_PARALLEL_MIN_BATCH", "2000"))
+
+# In-memory patient snapshot (see database.patient_snapshot)
+# Reads older than this re-check the table for changed rows (0 = every read)
+PATIENT_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("PATIENT_SNAPSHOT_MAX_AGE_SECONDS", "0"))
+# Incremental refreshes look back this far to catch rows committed with an older updated_at
+PATIENT_SNAPSHOT_OVERLAP_SECONDS = float(os.getenv("PATIENT_SNAPSHOT_OVERLAP_SECONDS", "5"))
+# Full reloads drop rows deleted by other processes
+PATIENT_SNAPSHOT_FULL_RELOAD_SECONDS = float(os.getenv("PATIENT_SNAPSHOT_FULL_RELOAD_SECONDS", "900"))
+
+# Where fuzzy-match candidates come from: "memory" (blocking index over the patient
+# snapshot) or "sql" (pg_trgm/B-tree indexed query, see find_similar_patient_ids)
+MATCH_CANDIDATE_SOURCE = os.getenv("MATCH_CANDIDATE_SOURCE", "memory")
+# Candidates returned per incoming record by the SQL query
+SQL_CANDIDATE_LIMIT = int(os.getenv("SQL_CANDIDATE_LIMIT", "50"))
+
+# Registry-wide duplicate linking (see app.services.patient_linker)
+# Blocks with more patients than this are skipped when generating candidate pairs
+LINK_MAX_BLOCK_SIZE = int(os.getenv("LINK_MAX_BLOCK_SIZE", "1000"))
+# Stored embeddings at least this similar link two patients on their own
+LINK_EMBEDDING_THRESHOLD = float(os.getenv("LINK_EMBEDDING_THRESHOLD", "0.97"))
+LINK_EMBEDDING_NEIGHBOURS = int(os.getenv("LINK_EMBEDDING_NEIGHBOURS", "5"))
+LINK_WORKERS = int(os.getenv("LINK_WORKERS", str(MATCH_PARALLEL_WORKERS)))
+
+# Document ingestion (see app.routes.ingestion)
+# Files of one upload processed at the same time
+INGESTION_MAX_CONCURRENCY = int(os.getenv("INGESTION_MAX_CONCURRENCY", "8"))
+# Threads for blocking S3/Textract/image calls, shared by all uploads
+INGESTION_EXECUTOR_WORKERS = int(os.getenv("INGESTION_EXECUTOR_WORKERS", "32"))
+
+# Async Textract polling (see app.services.textract_poller)
+# First delay between status checks, grown by TEXTRACT_POLL_BACKOFF up to the max
+TEXTRACT_POLL_INITIAL_DELAY = float(os.getenv("TEXTRACT_POLL_INITIAL_DELAY", "1.0"))
+TEXTRACT_POLL_MAX_DELAY = float(os.getenv("TEXTRACT_POLL_MAX_DELAY", "10.0"))
+TEXTRACT_POLL_BACKOFF = float(os.getenv("TEXTRACT_POLL_BACKOFF", "1.5"))
+# Overall limit per job, polling and result paging included
+TEXTRACT_JOB_TIMEOUT = float(os.getenv("TEXTRACT_JOB_TIMEOUT", "600"))
+# Textract API calls in flight at once across all jobs
+TEXTRACT_MAX_CONCURRENT_CALLS = int(os.getenv("TEXTRACT_MAX_CONCURRENT_CALLS", "10"))
+
+# Shared AWS/OpenAI clients (see app.services.client_registry)
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+# Connections kept per boto3 client; at least the ingestion threads that share it
+AWS_CLIENT_POOL_SIZE = int(os.getenv("AWS_CLIENT_POOL_SIZE", str(max(10, INGESTION_EXECUTOR_WORKERS))))
+# Attempts per AWS call, first try included (adaptive retry mode)
+AWS_CLIENT_MAX_ATTEMPTS = int(os.getenv("AWS_CLIENT_MAX_ATTEMPTS", "5"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "5"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "60"))
+# Keep-alive connections to the OpenAI API and connection-level retries
+OPENAI_HTTP_POOL_SIZE = int(os.getenv("OPENAI_HTTP_POOL_SIZE", "16"))
+OPENAI_HTTP_MAX_RETRIES = int(os.getenv("OPENAI_HTTP_MAX_RETRIES", "2"))
+# Part size for streamed S3 uploads; one part per upload is held in memory (S3 minimum 5 MB)
+S3_UPLOAD_PART_SIZE = max(5 * 2 ** 20, int(os.getenv("S3_UPLOAD_PART_SIZE", str(8 * 2 ** 20))))
+# Reuse OCR results of previously uploaded identical documents (by SHA-256 of content)
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# OCR engines (see app.services.ocr_engines)
+# Engines the router may use, in tie-break order: tesseract, aws_textract, openai_vision
+OCR_ENGINES = _csv(os.getenv("OCR_ENGINES", "tesseract,aws_textract"))
+# Largest image sent to local Tesseract / OpenAI vision; bigger ones go to Textract
+OCR_LOCAL_MAX_BYTES = int(os.getenv("OCR_LOCAL_MAX_BYTES", str(5 * 2 ** 20)))
+OCR_OPENAI_MAX_BYTES = int(os.getenv("OCR_OPENAI_MAX_BYTES", str(20 * 2 ** 20)))
+OCR_OPENAI_MODEL = os.getenv("OCR_OPENAI_MODEL", "gpt-4o")
+# Processes for local Tesseract OCR
+OCR_LOCAL_WORKERS = int(os.getenv("OCR_LOCAL_WORKERS", str(os.cpu_count() or 1)))
+# Latency samples per engine and file type before the router trusts the estimate
+OCR_ROUTER_MIN_SAMPLES = int(os.getenv("OCR_ROUTER_MIN_SAMPLES", "3"))
+# Every Nth document re-measures the least recently used engine (0 disables)
+OCR_ROUTER_EXPLORE_EVERY = int(os.getenv("OCR_ROUTER_EXPLORE_EVERY", "50"))
+# Seconds a failed engine is tried only after the others; doubles per consecutive failure
+OCR_ROUTER_FAILURE_COOLDOWN = float(os.getenv("OCR_ROUTER_FAILURE_COOLDOWN", "60"))
+
+# Page-parallel OCR of PDFs (see app.services.pdf_page_ocr)
+# Default for uploads; the page_parallel query parameter overrides it per request
+OCR_PDF_PAGE_PARALLEL = os.getenv("OCR_PDF_PAGE_PARALLEL", "false").lower() in ("1", "true", "yes")
+OCR_PDF_PAGES_PER_RANGE = int(os.getenv("OCR_PDF_PAGES_PER_RANGE", "10"))
+# Page ranges of one document OCR'd at the same time
+OCR_PDF_MAX_CONCURRENT_RANGES = int(os.getenv("OCR_PDF_MAX_CONCURRENT_RANGES", "4"))
+
+# Image preprocessing before upload and OCR (see app.services.image_preprocessing)
+OCR_IMAGE_PREPROCESS = os.getenv("OCR_IMAGE_PREPROCESS", "true").lower() in ("1", "true", "yes")
+# Images declaring a higher DPI are scaled down to this
+OCR_IMAGE_TARGET_DPI = int(os.getenv("OCR_IMAGE_TARGET_DPI", "300"))
+# Long-side cap in pixels (about a letter page at 300 DPI)
+OCR_IMAGE_MAX_DIMENSION = int(os.getenv("OCR_IMAGE_MAX_DIMENSION", "3300"))
+OCR_IMAGE_JPEG_QUALITY = int(os.getenv("OCR_IMAGE_JPEG_QUALITY", "85"))
+# Larger images skip preprocessing and are streamed as uploaded
+OCR_IMAGE_MAX_INPUT_BYTES = int(os.getenv("OCR_IMAGE_MAX_INPUT_BYTES", str(50 * 2 ** 20)))
+OCR_IMAGE_WORKERS = int(os.getenv("OCR_IMAGE_WORKERS", str(os.cpu_count() or 1)))
+
+# Staged document pipeline: upload -> OCR -> NER -> patient -> match (see app.services.pipeline)
+# Items waiting between two stages; a full queue holds back the stage before it
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# Documents each stage works on at once
+PIPELINE_UPLOAD_CONCURRENCY = int(os.getenv("PIPELINE_UPLOAD_CONCURRENCY", "4"))
+PIPELINE_OCR_CONCURRENCY = int(os.getenv("PIPELINE_OCR_CONCURRENCY", "4"))
+PIPELINE_NER_CONCURRENCY = int(os.getenv("PIPELINE_NER_CONCURRENCY", "4"))
+PIPELINE_STRUCTURE_CONCURRENCY = int(os.getenv("PIPELINE_STRUCTURE_CONCURRENCY", "1"))
+# Patients matched per process_fuzzy_match call, and how long to wait to fill a batch
+PIPELINE_MATCH_BATCH_SIZE = int(os.getenv("PIPELINE_MATCH_BATCH_SIZE", "16"))
+PIPELINE_MATCH_BATCH_WAIT = float(os.getenv("PIPELINE_MATCH_BATCH_WAIT", "0.5"))
+
+# Durable background jobs (see app.services.job_queue)
+# Seconds a claimed job stays hidden from other workers; running jobs renew it
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Retry delay doubles after each failed attempt, up to the max
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "600"))
+# Seconds an idle worker waits before looking for jobs again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Worker processes started by scripts/run_job_workers.py
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", str(os.cpu_count() or 1)))
@@ -9,6 +9,8 @@ Run this file to start the API server.
 
 Routes:
     /api/ingestion - Document ingestion endpoints
+    /api/pipeline - End-to-end document pipeline (OCR -> NER -> match)
+    /api/jobs - Background jobs run by separate worker processes
 
 Startup:
     - Initializes database connection
@@ -35,9 +37,17 @@ from app.routes.patient import patient_router
 from app.routes.chat import chat_router
 from app.routes.ner_routes import ner_router as ner_router
 from app.routes.review import review_router as review_router
+from app.routes.health import health_router
+from app.routes.pipeline import pipeline_router
+from app.routes.jobs import jobs_router
 # Optional: Setup logs, database, vector DB, etc.
 # from app.database.db import init_db
-# from app.services.embedding_service import load_vector_index
+from app.services.client_registry import client_registry
+from app.services.embedding_service import load_vector_index
+from app.services.image_preprocessing import image_preprocessor
+from app.services.ocr_engines import ocr_router
+from app.services.parallel_matcher import match_pool
+from database.database import SessionLocal
 
 # Load environment variables from .env
 load_dotenv()
@@ -66,22 +76,34 @@ app.include_router(review_router, prefix="/api/patients", tags=["Review"])
 # app.include_router(extraction_router, prefix="/api/extraction", tags=["Extraction"])
 # app.include_router(matching_router, prefix="/api/matching", tags=["Matching"])
 # app.include_router(feedback_router, prefix="/api/feedback", tags=["Human Feedback"])
-# app.include_router(health_router, prefix="/api", tags=["Health Check"])
+app.include_router(health_router, prefix="/api", tags=["Health Check"])
 app.include_router(patient_router, prefix="/api", tags=["Patients"])
 
 app.include_router(matching_router, prefix="/api/matching", tags=["Matching"])
 app.include_router(chat_router, prefix="/api", tags=["Chat"])
+app.include_router(pipeline_router, prefix="/api", tags=["Pipeline"])
+app.include_router(jobs_router, prefix="/api", tags=["Jobs"])
 # Startup and shutdown events
-# @app.on_event("startup")
-# async def startup_event():
-#     print("🔧 Initializing database and vector index...")
-#     await init_db()
-#     await load_vector_index()
-#     print("✅ System ready to process documents.")
-
-# @app.on_event("shutdown")
-# async def shutdown_event():
-#     print("🚪 Shutting down...")
+@app.on_event("startup")
+def startup_event():
+    print("🔧 Creating shared AWS/OpenAI clients...")
+    client_registry.start()
+    print("🔧 Loading vector index...")
+    # await init_db()
+    db = SessionLocal()
+    try:
+        load_vector_index(db)
+    finally:
+        db.close()
+    print("✅ System ready to process documents.")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    print("🚪 Shutting down...")
+    ocr_router.close()
+    image_preprocessor.close()
+    match_pool.close()
+    client_registry.close()
 
 # Run the app via: `python main.py`
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+"""
+Health and stats routes.
+
+Endpoints:
+- GET /health: Liveness check.
+- GET /stats/embedding-cache: Embedding cache hit/miss/eviction counters and estimated savings.
+- GET /stats/patient-snapshot: Size, estimated memory and refresh latency of the patient snapshot.
+- GET /stats/clients: Shared AWS/OpenAI clients created, requests sent and connections reused.
+- GET /stats/ocr-engines: Per-engine OCR requests, failures and measured latency.
+- GET /stats/image-preprocessing: Images preprocessed before OCR, bytes saved and latency.
+- GET /stats/jobs: Background jobs by kind and status, and how long the oldest queued job has waited.
+"""
+
+from datetime import datetime
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from app.services.client_registry import client_registry
+from app.services.image_preprocessing import image_preprocessor
+from app.services.ocr_engines import ocr_router
+from app.utils.embedding_cache import embedding_cache
+from database.database import get_db
+from database.job_repository import job_counts, oldest_queued_at
+from database.patient_snapshot import patient_snapshot
+
+health_router = APIRouter()
+
+
+@health_router.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@health_router.get("/stats/embedding-cache")
+def embedding_cache_stats():
+    return embedding_cache.stats()
+
+
+@health_router.get("/stats/patient-snapshot")
+def patient_snapshot_stats():
+    return patient_snapshot.stats()
+
+
+@health_router.get("/stats/clients")
+def client_stats():
+    return client_registry.stats()
+
+
+@health_router.get("/stats/ocr-engines")
+def ocr_engine_stats():
+    return ocr_router.stats()
+
+
+@health_router.get("/stats/image-preprocessing")
+def image_preprocessing_stats():
+    return image_preprocessor.stats()
+
+
+@health_router.get("/stats/jobs")
+def job_stats(db: Session = Depends(get_db)):
+    oldest = oldest_queued_at(db)
+    return {
+        "jobs": job_counts(db),
+        # Due jobs waiting this long mean the workers are not keeping up
+        "oldest_queued_seconds": round(max(0.0, (datetime.utcnow() - oldest).total_seconds()), 1) if oldest else None,
+    }
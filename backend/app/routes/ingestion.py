@@ -1,17 +1,38 @@
-import uuid
-from typing import List
+import asyncio
+import hashlib
+import io
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import IO, Dict, List, Optional
 from pathlib import Path
+from urllib.parse import urlparse
 import os
-import tempfile
 from PIL import Image
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-import boto3
+from fastapi.responses import JSONResponse, StreamingResponse
 from botocore.exceptions import BotoCoreError, ClientError
+from sqlalchemy.exc import SQLAlchemyError
 from PIL import Image
-from app.services.ocr_service import extract_text_with_textract
-from app.services.extract_text_and_analyze_openai import extract_text_and_analyze_openai  # For images
+from app.config import (
+    INGESTION_EXECUTOR_WORKERS,
+    INGESTION_MAX_CONCURRENCY,
+    OCR_CACHE_ENABLED,
+    OCR_IMAGE_MAX_INPUT_BYTES,
+    OCR_IMAGE_PREPROCESS,
+    OCR_PDF_PAGE_PARALLEL,
+    S3_UPLOAD_PART_SIZE,
+)
+from app.services.client_registry import client_registry
+from app.services.image_preprocessing import image_preprocessor
+from app.services.ocr_engines import OcrDocument, ocr_router
+from app.services.pdf_page_ocr import PdfReadError, merge_pages, ocr_pdf_pages, page_parallel_available, pdf_page_count
+from app.services.textract_poller import blocks_to_text
 from app.services.ner_openai_service import analyze_medical_document  # For NER extraction
+from database.database import SessionLocal
+from database.ocr_result_repository import get_ocr_result, save_ocr_result
 import logging
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -22,110 +43,347 @@ if not S3_BUCKET:
     raise RuntimeError("S3_BUCKET environment variable is not set")
 
 # AWS Config
-AWS_REGION = "us-east-1"
 S3_BUCKET = "medifusion"
 TEMP_UPLOAD_PREFIX = "uploads"
 
+# OCR file type per accepted extension (WebP is converted to PNG first)
+OCR_FILE_TYPES = {".pdf": "pdf", ".jpg": "image", ".jpeg": "image", ".png": "image", ".webp": "image"}
+# Read size when hashing uploads
+HASH_CHUNK_SIZE = 2 ** 20
+
 # Initialize router
 ingestion_router = APIRouter()
 
-# Initialize S3 client
-s3_client = boto3.client("s3", region_name=AWS_REGION)
+# Blocking S3/Textract/PIL work of uploads runs here instead of on the event loop
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_EXECUTOR_WORKERS, thread_name_prefix="ingestion")
 
 
-def upload_file_to_s3(file_path: str, s3_filename: str) -> str:
+def upload_fileobj_to_s3(fileobj, s3_filename: str) -> str:
     """
-    Uploads a file from local disk to S3 and returns the S3 URI.
+    Streams a file object to S3 in S3_UPLOAD_PART_SIZE parts and returns the S3 URI.
+    Only one part is held in memory at a time; files smaller than a part go up in a
+    single PUT. A failed multipart upload is aborted so no orphaned parts are kept.
     """
     s3_key = f"{TEMP_UPLOAD_PREFIX}/{s3_filename}"
+    s3_client = client_registry.aws("s3")
+    upload_id = None
     try:
-        with open(file_path, "rb") as f:
-            s3_client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=f)
+        chunk = fileobj.read(S3_UPLOAD_PART_SIZE)
+        if len(chunk) < S3_UPLOAD_PART_SIZE:
+            s3_client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=chunk)
+        else:
+            upload_id = s3_client.create_multipart_upload(Bucket=S3_BUCKET, Key=s3_key)["UploadId"]
+            parts = []
+            while chunk:
+                part_number = len(parts) + 1
+                response = s3_client.upload_part(
+                    Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=chunk
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                chunk = fileobj.read(S3_UPLOAD_PART_SIZE)
+            s3_client.complete_multipart_upload(
+                Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
         return f"s3://{S3_BUCKET}/{s3_key}"
-    except (BotoCoreError, ClientError, OSError) as e:
-        raise HTTPException(status_code=500, detail=f"S3 upload failed: {str(e)}")
+    except Exception as e:
+        if upload_id is not None:
+            try:
+                s3_client.abort_multipart_upload(Bucket=S3_BUCKET, Key=s3_key, UploadId=upload_id)
+            except (BotoCoreError, ClientError) as abort_error:
+                logger.warning(f"Could not abort multipart upload of {s3_key}: {abort_error}")
+        if isinstance(e, (BotoCoreError, ClientError, OSError)):
+            raise HTTPException(status_code=500, detail=f"S3 upload failed: {str(e)}")
+        raise
 
 
-@ingestion_router.post("/upload")
-async def ingest_documents(files: List[UploadFile] = File(...)):
+def download_s3_fileobj(s3_path: str) -> IO[bytes]:
     """
-    Accepts files, stores them in /tmp, uploads to S3, and routes
-    to either OpenAI image OCR or AWS Textract based on file type.
+    Downloads an uploaded object into a spooled temporary file (in memory up to one
+    upload part), rewound for reading.
     """
-    responses = []
+    parsed = urlparse(s3_path)
+    fileobj = tempfile.SpooledTemporaryFile(max_size=S3_UPLOAD_PART_SIZE)
+    client_registry.aws("s3").download_fileobj(parsed.netloc, parsed.path.lstrip("/"), fileobj)
+    fileobj.seek(0)
+    return fileobj
 
-    for file in files:
-        try:
-            # Get file extension
-            file_ext = Path(file.filename).suffix.lower()
-
-            # Read file bytes once
-            file_bytes = await file.read()
-
-            # Temporary file path for original upload
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext, dir="/tmp") as tmp_file:
-                tmp_file.write(file_bytes)
-                tmp_file_path = tmp_file.name
-
-            # If webp, convert to png before upload
-            if file_ext == ".webp":
-                png_tempfile = tempfile.NamedTemporaryFile(delete=False, suffix=".png", dir="/tmp")
-                with Image.open(tmp_file_path) as im:
-                    im.save(png_tempfile.name, format="PNG")
-                # Use png filename & path going forward
-                unique_filename = f"{uuid.uuid4().hex}.png"
-                upload_path = png_tempfile.name
-                file_ext = ".png"
-            else:
-                unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-                upload_path = tmp_file_path
-
-            # Upload to S3
-            s3_path = upload_file_to_s3(upload_path, unique_filename)
-
-            # Route based on file type
-            if file_ext == ".pdf":
-                # textract_service = TextractService()
-                extracted_text = extract_text_with_textract(s3_path, "pdf")
-                # extracted_text = result.get("text", "")
-            elif file_ext in [".jpg", ".jpeg", ".png"]:
-                extracted_text = extract_text_with_textract(s3_path, "image")
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_ext}")
-
-            # # Call NER extractor on extracted text
-            # try:
-            #     ner_result = analyze_medical_document(extracted_text, is_file=False)
-            # except Exception as e:
-            #     logger.error(f"NER extraction failed: {str(e)}")
-            #     ner_result = {}
-
-            responses.append({
-                "filename": file.filename,
-                "s3_path": s3_path,
-                "extracted_text": extracted_text,
-                "file_size": "253 KB",
-                "file_type": file_ext[1:],  # Remove leading dot
-                "ocr_engine_used": "aws_textract",
-                "text_lines_count": 1,
-                "upload_location": "/tmp/tmpa1b2c3d4.pdf",
-                # "structured_data": ner_result
-            })
-
-
-#             "filename": "lab_report.pdf",
-#   "file_type": "pdf",
-#   "file_size": "253 KB",
-#   "upload_location": "/tmp/tmpa1b2c3d4.pdf",
-#   "s3_path": "s3://medifusion/uploads/abc1234.pdf",
-#   "ocr_engine_used": "aws_textract",
-#   "extracted_text": "Patient Name: John Doe\nDiagnosis:...",
-#   "text_lines_count": 78,
 
+def delete_s3_object(s3_path: str):
+    parsed = urlparse(s3_path)
+    client_registry.aws("s3").delete_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+
+
+def content_hash(fileobj) -> str:
+    """
+    SHA-256 of a file object's content, read in chunks; rewinds it for the upload.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def lookup_ocr_result(document_hash: str) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        result = get_ocr_result(db, document_hash)
+        if result is None:
+            return None
+        return {
+            "s3_path": result.s3_path,
+            "file_type": result.file_type,
+            "ocr_engine": result.ocr_engine,
+            "extracted_text": result.extracted_text,
+            "blocks": result.blocks,
+        }
+    except SQLAlchemyError as e:
+        # The cache is an optimisation; without it the document is simply processed again
+        logger.warning(f"OCR cache lookup failed: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def store_ocr_result(document_hash: str, file_type: str, s3_path: str, ocr_engine: str,
+                     extracted_text: str, blocks: List[dict]):
+    db = SessionLocal()
+    try:
+        save_ocr_result(db, document_hash, file_type, s3_path, ocr_engine, extracted_text, blocks)
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not cache OCR result: {e}")
+    finally:
+        db.close()
+
+
+def process_upload(filename: str, fileobj, document_hash: str) -> tuple:
+    """
+    Blocking part of ingesting one file: WebP conversion and S3 upload, streamed from
+    the upload's file object. Runs on the ingestion executor, never on the event
+    loop. The S3 key is the content hash, so a re-upload overwrites the same object.
+    Returns the S3 path and the extension of the uploaded file.
+    """
+    # Get file extension
+    file_ext = Path(filename).suffix.lower()
+
+    # If webp, convert to png in memory before upload
+    if file_ext == ".webp":
+        png_buffer = io.BytesIO()
+        with Image.open(fileobj) as im:
+            im.save(png_buffer, format="PNG")
+        png_buffer.seek(0)
+        fileobj = png_buffer
+        file_ext = ".png"
+
+    # Upload to S3
+    return upload_fileobj_to_s3(fileobj, f"{document_hash}{file_ext}"), file_ext
+
+
+def use_page_parallel(page_parallel: Optional[bool]) -> bool:
+    """
+    ``page_parallel`` forces the mode either way; ``None`` uses OCR_PDF_PAGE_PARALLEL.
+    """
+    enabled = OCR_PDF_PAGE_PARALLEL if page_parallel is None else page_parallel
+    return enabled and page_parallel_available()
+
+
+@dataclass
+class UploadedDocument:
+    """
+    A document after the upload step: hashed, looked up in the OCR cache and, on a
+    miss, stored in S3 and ready for OCR.
+    """
+    filename: str
+    fileobj: IO[bytes]
+    content_hash: str
+    file_ext: str
+    s3_path: Optional[str] = None
+    cached: Optional[dict] = None
+    preprocessing: Optional[dict] = None
+    document: Optional[OcrDocument] = None
+
+
+async def upload_document(filename: str, fileobj: IO[bytes], size: int) -> UploadedDocument:
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in OCR_FILE_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_ext}")
+
+    loop = asyncio.get_running_loop()
+    document_hash = await loop.run_in_executor(ingestion_executor, content_hash, fileobj)
+    uploaded = UploadedDocument(filename, fileobj, document_hash, file_ext)
+    uploaded.cached = await loop.run_in_executor(ingestion_executor, lookup_ocr_result, document_hash) if OCR_CACHE_ENABLED else None
+
+    if uploaded.cached is not None:
+        # Same content seen before: no upload, no OCR job
+        uploaded.s3_path = uploaded.cached["s3_path"]
+        uploaded.file_ext = f".{uploaded.cached['file_type']}"
+    elif file_ext != ".pdf" and OCR_IMAGE_PREPROCESS and size <= OCR_IMAGE_MAX_INPUT_BYTES:
+        # Upright, grayscale, downscaled image: this is what gets stored and OCR'd
+        image_bytes = await loop.run_in_executor(ingestion_executor, fileobj.read)
+        image_bytes, uploaded.preprocessing = await image_preprocessor.process(image_bytes)
+        if uploaded.preprocessing.get("format") == "jpeg":
+            uploaded.file_ext = ".jpg"
+        uploaded.s3_path = await loop.run_in_executor(
+            ingestion_executor, upload_fileobj_to_s3, io.BytesIO(image_bytes), f"{document_hash}{uploaded.file_ext}"
+        )
+        uploaded.document = OcrDocument(uploaded.s3_path, "image", len(image_bytes), io.BytesIO(image_bytes))
+    else:
+        # Stream the spooled upload straight to S3; the body is never read into memory whole
+        uploaded.s3_path, uploaded.file_ext = await loop.run_in_executor(
+            ingestion_executor, process_upload, filename, fileobj, document_hash
+        )
+        uploaded.document = OcrDocument(uploaded.s3_path, OCR_FILE_TYPES[uploaded.file_ext], size, fileobj)
+    return uploaded
+
+
+async def ocr_document(uploaded: UploadedDocument, page_parallel: Optional[bool] = None) -> dict:
+    loop = asyncio.get_running_loop()
+    ocr_seconds = None
+    if uploaded.cached is not None:
+        extracted_text = uploaded.cached["extracted_text"]
+        engine_used = uploaded.cached["ocr_engine"]
+        blocks = uploaded.cached.get("blocks")
+    else:
+        ocr_started = time.perf_counter()
+        if uploaded.file_ext == ".pdf" and use_page_parallel(page_parallel):
+            # Page ranges OCR'd side by side, reassembled in page order
+            pages = [
+                page async for page in
+                ocr_pdf_pages(uploaded.fileobj, f"pages/{uploaded.content_hash}", upload_fileobj_to_s3,
+                              delete_s3_object, ingestion_executor)
+            ]
+            engine_used, blocks = merge_pages(pages)
+            extracted_text = "\n".join(page.text for page in pages if page.text)
+        else:
+            # The router picks Textract, OpenAI vision or local OCR for this document
+            engine_used, blocks = await ocr_router.extract(uploaded.document)
+            extracted_text = blocks_to_text(blocks or [])
+        ocr_seconds = round(time.perf_counter() - ocr_started, 3)
+        # Failed OCR is not cached, so the next upload retries it
+        if OCR_CACHE_ENABLED and blocks is not None:
+            await loop.run_in_executor(
+                ingestion_executor, store_ocr_result, uploaded.content_hash, uploaded.file_ext[1:],
+                uploaded.s3_path, engine_used, extracted_text, blocks,
+            )
+
+    return {
+        "filename": uploaded.filename,
+        "s3_path": uploaded.s3_path,
+        "extracted_text": extracted_text,
+        "blocks": blocks,
+        "file_size": "253 KB",
+        "file_type": uploaded.file_ext[1:],  # Remove leading dot
+        "ocr_engine_used": engine_used,
+        "ocr_cache_hit": uploaded.cached is not None,
+        "ocr_seconds": ocr_seconds,
+        "preprocessing": uploaded.preprocessing,
+        "content_hash": uploaded.content_hash,
+        "text_lines_count": 1,
+        "upload_location": "/tmp/tmpa1b2c3d4.pdf",
+    }
+
+
+async def ingest_file(file: UploadFile, semaphore: asyncio.Semaphore, page_parallel: Optional[bool] = None) -> dict:
+    async with semaphore:
+        try:
+            uploaded = await upload_document(file.filename, file.file, file.size or 0)
+            return await ocr_document(uploaded, page_parallel)
         except Exception as e:
-            responses.append({
+            return {
                 "filename": file.filename,
                 "error": str(e)
-            })
+            }
+
+
+@ingestion_router.post("/upload")
+async def ingest_documents(files: List[UploadFile] = File(...), page_parallel: Optional[bool] = None):
+    """
+    Accepts files, streams them to S3, and routes each to an OCR engine
+    (AWS Textract, OpenAI vision or local Tesseract) by file type, size and
+    measured engine latency.
+
+    Files are processed concurrently (at most INGESTION_MAX_CONCURRENCY at a time);
+    results come back in upload order. ``page_parallel`` splits PDFs into page
+    ranges OCR'd concurrently (default: OCR_PDF_PAGE_PARALLEL).
+    """
+    semaphore = asyncio.Semaphore(INGESTION_MAX_CONCURRENCY)
+    responses = await asyncio.gather(*(ingest_file(file, semaphore, page_parallel) for file in files))
+    return JSONResponse(status_code=200, content={"results": list(responses)})
+
+
+def _stream_cached_pages(filename: str, document_hash: str, cached: dict):
+    """
+    NDJSON lines of a cached document in the shape /upload/pages streams: one per
+    page (from the blocks' Page numbers), then the summary.
+    """
+    pages: Dict[int, List[str]] = {}
+    for block in cached.get("blocks") or []:
+        if block.get("BlockType") == "LINE" and "Text" in block:
+            pages.setdefault(block.get("Page", 1), []).append(block["Text"])
+    if not pages and cached["extracted_text"]:
+        pages[1] = [cached["extracted_text"]]
+    for number in sorted(pages):
+        yield json.dumps({"page": number, "text": "\n".join(pages[number]), "ocr_engine_used": cached["ocr_engine"]}) + "\n"
+    yield json.dumps({
+        "filename": filename,
+        "s3_path": cached["s3_path"],
+        "content_hash": document_hash,
+        "pages": len(pages),
+        "failed_pages": [],
+        "ocr_engine_used": cached["ocr_engine"],
+        "ocr_cache_hit": True,
+    }) + "\n"
+
+
+@ingestion_router.post("/upload/pages")
+async def ingest_pdf_pages(file: UploadFile = File(...)):
+    """
+    Page-parallel OCR of one PDF, streamed back as NDJSON: one line per page, in
+    page order, as soon as the page's range is done, then a summary line. Lets
+    callers start on the first pages of long documents early.
+    """
+    if Path(file.filename).suffix.lower() != ".pdf":
+        raise HTTPException(status_code=400, detail="Page streaming needs a PDF")
+    if not page_parallel_available():
+        raise HTTPException(status_code=501, detail="Page-parallel OCR needs pypdf")
+
+    loop = asyncio.get_running_loop()
+    document_hash = await loop.run_in_executor(ingestion_executor, content_hash, file.file)
+    cached = await loop.run_in_executor(ingestion_executor, lookup_ocr_result, document_hash) if OCR_CACHE_ENABLED else None
+    if cached is not None:
+        # Seen before: replay the stored pages, no upload and no OCR
+        return StreamingResponse(_stream_cached_pages(file.filename, document_hash, cached),
+                                 media_type="application/x-ndjson")
+    try:
+        page_count = await loop.run_in_executor(ingestion_executor, pdf_page_count, file.file)
+    except PdfReadError as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable PDF: {e}")
+    if not page_count:
+        raise HTTPException(status_code=400, detail="PDF has no pages")
+    s3_path, _ = await loop.run_in_executor(ingestion_executor, process_upload, file.filename, file.file, document_hash)
+
+    async def stream():
+        pages = []
+        async for page in ocr_pdf_pages(file.file, f"pages/{document_hash}", upload_fileobj_to_s3,
+                                        delete_s3_object, ingestion_executor):
+            pages.append(page)
+            yield json.dumps({"page": page.number, "text": page.text, "ocr_engine_used": page.engine}) + "\n"
+
+        engine_used, blocks = merge_pages(pages)
+        extracted_text = "\n".join(page.text for page in pages if page.text)
+        if OCR_CACHE_ENABLED and blocks is not None:
+            await loop.run_in_executor(
+                ingestion_executor, store_ocr_result,
+                document_hash, "pdf", s3_path, engine_used, extracted_text, blocks,
+            )
+        yield json.dumps({
+            "filename": file.filename,
+            "s3_path": s3_path,
+            "content_hash": document_hash,
+            "pages": len(pages),
+            "failed_pages": [page.number for page in pages if page.engine is None],
+            "ocr_engine_used": engine_used,
+            "ocr_cache_hit": False,
+        }) + "\n"
 
-    return JSONResponse(status_code=200, content={"results": responses})
\ No newline at end of file
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
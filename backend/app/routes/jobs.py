@@ -0,0 +1,102 @@
+"""
+Background job routes. Heavy work is enqueued here and run by job workers
+(scripts/run_job_workers.py); each endpoint returns job ids at once (202).
+
+Endpoints:
+- POST /jobs/documents: Uploads documents to S3 and enqueues one OCR -> NER -> match job each.
+- POST /jobs/ner: Enqueues NER on extracted text.
+- POST /jobs/fuzzy-match: Enqueues fuzzy matching of a batch of patients.
+- GET /jobs: Recent jobs, optionally by status and kind.
+- GET /jobs/{job_id}: Status, attempts, result and error of a job.
+"""
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Body, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from app.routes.ingestion import upload_document
+from app.services.job_queue import enqueue
+from database.database import get_db
+from database.job_repository import get_job, list_jobs
+from database.models import Job
+from database.schemas import FuzzyMatchRequest
+
+jobs_router = APIRouter()
+
+
+def job_view(job: Job, with_result: bool = True) -> dict:
+    view = {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "run_after": job.run_after,
+    }
+    if with_result:
+        view["result"] = job.result
+    return view
+
+
+@jobs_router.post("/jobs/documents", status_code=202)
+async def enqueue_documents(files: List[UploadFile] = File(...), match: bool = True,
+                            page_parallel: Optional[bool] = None):
+    jobs = []
+    for file in files:
+        try:
+            # Only hashing and the S3 upload happen in the request; OCR onwards is the job's
+            uploaded = await upload_document(file.filename, file.file, file.size or 0)
+            cached = None
+            if uploaded.cached is not None:
+                cached = {key: value for key, value in uploaded.cached.items() if key != "blocks"}
+            job_id = await run_in_threadpool(enqueue, "document", {
+                "filename": uploaded.filename,
+                "s3_path": uploaded.s3_path,
+                "file_ext": uploaded.file_ext,
+                "content_hash": uploaded.content_hash,
+                "size": uploaded.document.size if uploaded.document else 0,
+                "cached": cached,
+                "preprocessing": uploaded.preprocessing,
+                "match": match,
+                "page_parallel": page_parallel,
+            })
+            jobs.append({"filename": file.filename, "job_id": job_id, "status": "queued"})
+        except Exception as e:
+            jobs.append({"filename": file.filename, "error": str(e)})
+    return {"jobs": jobs}
+
+
+@jobs_router.post("/jobs/ner", status_code=202)
+def enqueue_ner(extracted_text: str = Body(..., embed=True)):
+    return {"job_id": enqueue("ner", {"text": extracted_text}), "status": "queued"}
+
+
+@jobs_router.post("/jobs/fuzzy-match", status_code=202)
+def enqueue_fuzzy_match(request: FuzzyMatchRequest):
+    payload = {
+        "patients": jsonable_encoder(request.patients),
+        "blocking_keys": request.blocking_keys,
+        "parallel": request.parallel,
+    }
+    return {"job_id": enqueue("fuzzy_match", payload), "status": "queued"}
+
+
+@jobs_router.get("/jobs")
+def get_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50,
+             db: Session = Depends(get_db)):
+    return {"jobs": [job_view(job, with_result=False) for job in list_jobs(db, status, kind, min(limit, 500))]}
+
+
+@jobs_router.get("/jobs/{job_id}")
+def get_job_status(job_id: str, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
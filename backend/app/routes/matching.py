@@ -7,21 +7,71 @@ matching and embedding similarity.
 
 Endpoints:
 - POST /fuzzy-match/: Accepts a list of patients and returns a summary of matched and unmatched records.
+  An optional `blocking_keys` list overrides the configured candidate blocking strategy;
+  `parallel` forces or disables the multi-process fuzzy stage.
+- POST /fuzzy-match/jobs: Starts a background match job and returns its id immediately.
+- GET /fuzzy-match/jobs/{job_id}: Progress and running summary of a job.
+- GET /fuzzy-match/jobs/{job_id}/results: Streams matched/unmatched/new records as NDJSON
+  while the job runs, ending with a summary line.
 
 Dependencies:
 - Requires database access and patient matching services.
 """
 
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from database.schemas import FuzzyMatchRequest
-from database.database import get_db
+from database.schemas import FuzzyMatchRequest, FuzzyMatchJobRequest
+from database.database import get_db, SessionLocal
 from app.services.patient_matcher import process_fuzzy_match
+from app.services.match_jobs import MatchJobManager
+from app.utils.blocking import resolve_blocking_keys
 
 matching_router = APIRouter()
+match_jobs = MatchJobManager(SessionLocal)
 null = None  # Placeholder for null values in JSON responses
 @matching_router.post("/fuzzy-match")
 def fuzzy_match(request: FuzzyMatchRequest, db: Session = Depends(get_db)):
-    result = process_fuzzy_match(request.patients, db)
+    try:
+        result = process_fuzzy_match(request.patients, db, blocking_keys=request.blocking_keys,
+                                     parallel=request.parallel)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return result
-    
\ No newline at end of file
+    
+
+@matching_router.post("/fuzzy-match/jobs", status_code=202)
+def submit_fuzzy_match_job(request: FuzzyMatchJobRequest):
+    try:
+        resolve_blocking_keys(request.blocking_keys)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = match_jobs.submit(request.patients, request.blocking_keys, request.chunk_size, request.parallel)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": len(request.patients),
+        "status_url": f"/api/matching/fuzzy-match/jobs/{job.id}",
+        "results_url": f"/api/matching/fuzzy-match/jobs/{job.id}/results"
+    }
+
+@matching_router.get("/fuzzy-match/jobs/{job_id}")
+def get_fuzzy_match_job(job_id: str):
+    job = match_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.progress()
+
+@matching_router.get("/fuzzy-match/jobs/{job_id}/results")
+def stream_fuzzy_match_results(job_id: str, offset: int = 0):
+    job = match_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    def ndjson():
+        for line in job.follow(offset):
+            yield json.dumps(jsonable_encoder(line)) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
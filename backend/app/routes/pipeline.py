@@ -0,0 +1,33 @@
+"""
+Pipeline routes.
+
+Endpoints:
+- POST /pipeline/run: Runs uploaded documents through upload -> OCR -> NER -> patient ->
+  match and streams NDJSON: one line per document as it finishes, then a final line
+  with per-stage throughput and queue depth.
+"""
+
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, File, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from app.services.document_pipeline import SourceDocument, build_document_pipeline, run_documents
+
+pipeline_router = APIRouter()
+
+
+@pipeline_router.post("/pipeline/run")
+async def run_pipeline(files: List[UploadFile] = File(...), match: bool = True,
+                       page_parallel: Optional[bool] = None):
+    pipeline = build_document_pipeline(match=match, page_parallel=page_parallel)
+    documents = [SourceDocument(file.filename, fileobj=file.file, size=file.size or 0) for file in files]
+
+    async def stream():
+        async for summary in run_documents(pipeline, documents):
+            yield json.dumps(jsonable_encoder(summary)) + "\n"
+        yield json.dumps({"stats": pipeline.stats()}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
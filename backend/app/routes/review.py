@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database.schemas import PatientData
 from database.database import get_db
-from database.patient_repository import get_all_patients, update_patient
+from database.patient_repository import get_patient_by_name, update_patient
 from typing import List
 from datetime import datetime
 
@@ -10,9 +10,7 @@ review_router = APIRouter()
 
 @review_router.post("/review")
 def human_review_update(incoming: PatientData, db: Session = Depends(get_db)):
-    existing_patients = get_all_patients(db)
-
-    matched = next((p for p in existing_patients if p.name == incoming.name), None)
+    matched = get_patient_by_name(db, incoming.name)
     if matched:
         patient_data = incoming.dict()
 
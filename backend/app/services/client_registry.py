@@ -0,0 +1,236 @@
+"""
+Client Registry
+
+One shared set of network clients for the whole process. boto3 clients are created
+once per service from a single boto3 Session (credential resolution happens once)
+with a botocore Config sized for the ingestion thread pool: a connection pool per
+client, TCP keep-alive and adaptive retries. They are thread-safe once built, so every
+service and worker thread uses the same instances.
+
+OpenAI calls (openai 0.28, requests-based) go through one pooled HTTPAdapter:
+importing this module installs the registry as ``openai.requestssession``. The SDK
+keeps a session per thread and closes it every few minutes, so each thread gets its
+own requests.Session that mounts the shared adapter and ignores ``close()``; chat,
+NER and embedding requests from every thread reuse the same keep-alive connections.
+
+The app lifespan builds the clients at startup and closes them on shutdown; services
+that run outside the app (scripts, tests) get them lazily on first use.
+
+Functions:
+- ClientRegistry.aws: The shared boto3 client for a service ("s3", "textract", ...).
+- ClientRegistry.openai_session: The calling thread's requests.Session for the openai SDK.
+- ClientRegistry.start: Builds the configured clients up front.
+- ClientRegistry.close: Closes every client and its connection pool.
+- ClientRegistry.stats: Clients created, requests sent and connections opened/reused.
+"""
+
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+import boto3
+import openai
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from app.config import (
+    AWS_ACCESS_KEY_ID,
+    AWS_CLIENT_MAX_ATTEMPTS,
+    AWS_CLIENT_POOL_SIZE,
+    AWS_CONNECT_TIMEOUT,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+    AWS_SECRET_ACCESS_KEY,
+    OPENAI_HTTP_MAX_RETRIES,
+    OPENAI_HTTP_POOL_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Clients built by start()
+_STARTUP_SERVICES = ("s3", "textract")
+
+
+def _aws_pool_manager(client):
+    """
+    The urllib3 PoolManager behind a boto3 client, or None. botocore keeps it in
+    private attributes, so a botocore release may move it; stats then report zeros.
+    """
+    try:
+        return client._endpoint.http_session._manager
+    except AttributeError:
+        return None
+
+
+def _pool_usage(manager) -> Dict[str, int]:
+    """
+    Connections opened and requests sent by the urllib3 pools of ``manager``.
+    """
+    connections = sent = 0
+    pools = getattr(manager, "pools", None)
+    if pools is None:
+        return {"connections": 0, "requests": 0}
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+            connections += getattr(pool, "num_connections", 0)
+            sent += getattr(pool, "num_requests", 0)
+    return {"connections": connections, "requests": sent}
+
+
+class _CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts requests sent and connections opened into ``usage``.
+    """
+
+    def __init__(self, usage: Counter, usage_lock: threading.Lock, **kwargs):
+        self.usage = usage
+        self.usage_lock = usage_lock
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        usage, usage_lock = self.usage, self.usage_lock
+
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    with usage_lock:
+                        usage["connections"] += 1
+                    return super()._new_conn()
+
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting(HTTPConnectionPool),
+            "https": counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        with self.usage_lock:
+            self.usage["requests"] += 1
+        return super().send(request, **kwargs)
+
+
+class _ThreadSession(requests.Session):
+    """
+    One thread's session over the registry's shared adapter. The openai SDK closes
+    its session every MAX_SESSION_LIFETIME_SECS; that must not close the pool every
+    other thread is using, so ``close()`` does nothing and the registry closes the
+    adapter itself.
+    """
+
+    def __init__(self, adapter: HTTPAdapter):
+        super().__init__()
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def close(self):
+        pass
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session: Optional[boto3.session.Session] = None
+        self._clients: Dict[str, object] = {}
+        self._openai_adapter: Optional[HTTPAdapter] = None
+        self._openai_sessions = threading.local()
+        self._openai_usage = Counter()
+        self._usage_lock = threading.Lock()
+        self._created = Counter()
+        self._lookups = Counter()
+
+    def _config(self) -> Config:
+        return Config(
+            max_pool_connections=AWS_CLIENT_POOL_SIZE,
+            tcp_keepalive=True,
+            connect_timeout=AWS_CONNECT_TIMEOUT,
+            read_timeout=AWS_READ_TIMEOUT,
+            retries={"max_attempts": AWS_CLIENT_MAX_ATTEMPTS, "mode": "adaptive"},
+        )
+
+    def aws(self, service: str):
+        self._lookups[service] += 1
+        client = self._clients.get(service)
+        if client is not None:
+            return client
+        # boto3 Sessions are not thread-safe; build clients one at a time
+        with self._lock:
+            client = self._clients.get(service)
+            if client is None:
+                if self._session is None:
+                    self._session = boto3.session.Session(
+                        aws_access_key_id=AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                        region_name=AWS_REGION,
+                    )
+                logger.info(f"Creating shared {service} client")
+                client = self._session.client(service, config=self._config())
+                self._clients[service] = client
+                self._created[service] += 1
+        return client
+
+    def _openai_pool(self) -> HTTPAdapter:
+        adapter = self._openai_adapter
+        if adapter is not None:
+            return adapter
+        with self._lock:
+            if self._openai_adapter is None:
+                self._openai_adapter = _CountingAdapter(
+                    self._openai_usage, self._usage_lock, pool_connections=1,
+                    pool_maxsize=OPENAI_HTTP_POOL_SIZE, max_retries=OPENAI_HTTP_MAX_RETRIES,
+                )
+                self._created["openai"] += 1
+            return self._openai_adapter
+
+    def openai_session(self) -> requests.Session:
+        self._lookups["openai"] += 1
+        adapter = self._openai_pool()
+        session = getattr(self._openai_sessions, "session", None)
+        if session is None or session.get_adapter("https://") is not adapter:
+            session = self._openai_sessions.session = _ThreadSession(adapter)
+        return session
+
+    def start(self):
+        for service in _STARTUP_SERVICES:
+            self.aws(service)
+        self.openai_session()
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients = {}
+            if self._openai_adapter is not None:
+                self._openai_adapter.close()
+                self._openai_adapter = None
+
+    def stats(self) -> dict:
+        services = {}
+        for service, client in list(self._clients.items()):
+            services[service] = _pool_usage(_aws_pool_manager(client))
+        with self._usage_lock:
+            services["openai"] = {"connections": self._openai_usage["connections"],
+                                  "requests": self._openai_usage["requests"]}
+
+        result = {}
+        for service in sorted(set(services) | set(self._created)):
+            usage = services.get(service, {"connections": 0, "requests": 0})
+            result[service] = {
+                "clients_created": self._created[service],
+                "client_lookups": self._lookups[service],
+                "requests_sent": usage["requests"],
+                "connections_opened": usage["connections"],
+                "connections_reused": max(0, usage["requests"] - usage["connections"]),
+            }
+        return result
+
+
+client_registry = ClientRegistry()
+
+# openai 0.28 asks this hook for a session instead of building one per thread
+openai.requestssession = client_registry.openai_session
@@ -0,0 +1,244 @@
+"""
+Document Pipeline
+
+The end-to-end flow the frontend used to chain over HTTP, as one staged pipeline
+(see app.services.pipeline):
+
+1. upload: hash the document, check the OCR cache, preprocess images, store in S3
+2. ocr: OCR through the engine router (or page-parallel for long PDFs)
+3. ner: OpenAI NER on the extracted text
+4. structure: NER output -> PatientData, as the review screen builds it
+5. match: fuzzy/embedding matching against stored patients, in batches
+
+Each stage has its own concurrency (PIPELINE_*_CONCURRENCY) and a bounded queue in
+front of it (PIPELINE_QUEUE_SIZE). Matching updates matched patients like
+/api/matching/fuzzy-match does; new and unmatched patients are reported for human
+review, not inserted.
+
+Functions:
+- patient_from_ner: PatientData from an NER result.
+- build_document_pipeline: The stages above as a Pipeline.
+- document_summary: JSON-ready result of one document.
+- run_documents: Runs documents through a pipeline, yielding one summary per document.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import IO, Any, AsyncIterator, Iterable, List, Optional, Union
+
+from app.config import (
+    PIPELINE_MATCH_BATCH_SIZE,
+    PIPELINE_MATCH_BATCH_WAIT,
+    PIPELINE_NER_CONCURRENCY,
+    PIPELINE_OCR_CONCURRENCY,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_STRUCTURE_CONCURRENCY,
+    PIPELINE_UPLOAD_CONCURRENCY,
+)
+from app.routes.ingestion import UploadedDocument, ocr_document, upload_document
+from app.services.ner_openai_service import analyze_medical_document
+from app.services.patient_matcher import process_fuzzy_match
+from app.services.pipeline import Pipeline, PipelineItem, Stage
+from database.database import SessionLocal
+from database.schemas import PatientData
+
+# NER and matching block on OpenAI and the database
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_NER_CONCURRENCY + 1, thread_name_prefix="pipeline")
+
+
+@dataclass
+class SourceDocument:
+    """
+    A document to run. Either an open ``fileobj`` (an upload) or a ``path`` that is
+    opened when the upload stage gets to it and closed after OCR.
+    """
+    filename: str
+    path: Optional[str] = None
+    fileobj: Optional[IO[bytes]] = None
+    size: Optional[int] = None
+
+    def open(self) -> IO[bytes]:
+        if self.fileobj is None:
+            self.fileobj = open(self.path, "rb")
+            self.size = os.fstat(self.fileobj.fileno()).st_size
+        return self.fileobj
+
+    def close(self):
+        # Only files the pipeline opened itself
+        if self.path is not None and self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+
+@dataclass
+class DocumentRun:
+    source: SourceDocument
+    uploaded: Optional[UploadedDocument] = None
+    ocr: Optional[dict] = None
+    ner: Optional[dict] = None
+    patient: Optional[PatientData] = None
+    match: Optional[dict] = None
+
+
+def _value(data: dict, key: str) -> Optional[Any]:
+    value = data.get(key)
+    return None if value in (None, "", "N/A") else value
+
+
+def _date(value: Any) -> Optional[date]:
+    if not isinstance(value, str) or value in ("", "N/A"):
+        return None
+    try:
+        return datetime.fromisoformat(value[:10]).date()
+    except ValueError:
+        return None
+
+
+def patient_from_ner(ner: dict) -> PatientData:
+    """
+    Maps the NER JSON (structured_data.ExtractedData) to PatientData. "N/A" and
+    unparseable dates become None; a document without a patient name is an error.
+    """
+    structured = ner.get("structured_data") or {}
+    if isinstance(structured, list):
+        structured = structured[0] if structured else {}
+    extracted = structured.get("ExtractedData") or {}
+
+    name = _value(extracted, "PatientName")
+    if not name:
+        raise ValueError("No patient name in the document")
+
+    medical_conditions = []
+    if isinstance(_value(extracted, "Diagnosis"), str):
+        medical_conditions = [extracted["Diagnosis"]]
+    elif isinstance(extracted.get("MedicalConditions"), list) and extracted["MedicalConditions"][:1] != ["N/A"]:
+        medical_conditions = [str(condition) for condition in extracted["MedicalConditions"]]
+
+    return PatientData(
+        name=name,
+        dob=_date(extracted.get("DateOfBirth")),
+        gender=_value(extracted, "Gender"),
+        address=_value(extracted, "Address"),
+        phone=_value(extracted, "ContactNumber"),
+        email=_value(extracted, "Email"),
+        medical_record_number=_value(extracted, "MRN"),
+        medical_conditions=medical_conditions,
+        diagnosis=_value(extracted, "Diagnosis"),
+        doctor_name=_value(extracted, "DoctorName"),
+        department=_value(extracted, "Department"),
+        hospital_name=_value(extracted, "HospitalName") or _value(extracted, "Department"),
+        visit_date=_date(extracted.get("VisitDate")),
+    )
+
+
+async def _upload(run: DocumentRun) -> DocumentRun:
+    if run.uploaded is not None:
+        # Already in S3 (background jobs upload before enqueueing)
+        return run
+    try:
+        fileobj = await asyncio.get_running_loop().run_in_executor(pipeline_executor, run.source.open)
+        run.uploaded = await upload_document(run.source.filename, fileobj, run.source.size or 0)
+    except BaseException:
+        run.source.close()
+        raise
+    return run
+
+
+def _ocr_stage(page_parallel: Optional[bool]):
+    async def ocr(run: DocumentRun) -> DocumentRun:
+        try:
+            run.ocr = await ocr_document(run.uploaded, page_parallel)
+        finally:
+            run.source.close()
+        if not run.ocr["extracted_text"].strip():
+            raise ValueError("No text extracted")
+        return run
+
+    return ocr
+
+
+async def _ner(run: DocumentRun) -> DocumentRun:
+    loop = asyncio.get_running_loop()
+    run.ner = await loop.run_in_executor(
+        pipeline_executor, analyze_medical_document, run.ocr["extracted_text"], False
+    )
+    if "error" in run.ner:
+        raise ValueError(run.ner["error"])
+    return run
+
+
+async def _structure(run: DocumentRun) -> DocumentRun:
+    run.patient = patient_from_ner(run.ner)
+    return run
+
+
+def _match_batch(patients: List[PatientData]) -> List[dict]:
+    db = SessionLocal()
+    try:
+        return process_fuzzy_match(patients, db, with_outcomes=True)["outcomes"]
+    finally:
+        db.close()
+
+
+async def _match(runs: List[DocumentRun]) -> List[DocumentRun]:
+    loop = asyncio.get_running_loop()
+    outcomes = await loop.run_in_executor(pipeline_executor, _match_batch, [run.patient for run in runs])
+    for run, outcome in zip(runs, outcomes):
+        run.match = outcome
+    return runs
+
+
+def build_document_pipeline(match: bool = True, page_parallel: Optional[bool] = None,
+                            queue_size: int = PIPELINE_QUEUE_SIZE) -> Pipeline:
+    stages = [
+        Stage("upload", _upload, PIPELINE_UPLOAD_CONCURRENCY),
+        Stage("ocr", _ocr_stage(page_parallel), PIPELINE_OCR_CONCURRENCY),
+        Stage("ner", _ner, PIPELINE_NER_CONCURRENCY),
+        Stage("structure", _structure, PIPELINE_STRUCTURE_CONCURRENCY),
+    ]
+    if match:
+        # One matcher at a time: batches write patient updates in one transaction each
+        stages.append(Stage("match", _match, 1, batch=True, batch_size=PIPELINE_MATCH_BATCH_SIZE,
+                            batch_wait=PIPELINE_MATCH_BATCH_WAIT))
+    return Pipeline(stages, queue_size)
+
+
+def document_summary(item: PipelineItem) -> dict:
+    run: DocumentRun = item.value
+    summary = {
+        "index": item.index,
+        "filename": run.source.filename,
+        "status": "failed" if item.error else "done",
+        "error": item.error,
+        "failed_stage": item.failed_stage,
+        "stage_seconds": item.seconds,
+    }
+    if run.ocr is not None:
+        summary.update({
+            "s3_path": run.ocr["s3_path"],
+            "content_hash": run.ocr["content_hash"],
+            "ocr_engine_used": run.ocr["ocr_engine_used"],
+            "ocr_cache_hit": run.ocr["ocr_cache_hit"],
+        })
+    if run.ner is not None and "error" not in run.ner:
+        summary["structured_data"] = run.ner.get("structured_data")
+    if run.patient is not None:
+        summary["patient"] = run.patient.dict()
+    if run.match is not None:
+        summary["match_status"] = run.match["status"]
+        summary["match"] = run.match["record"]
+    return summary
+
+
+async def run_documents(pipeline: Pipeline,
+                        documents: Iterable[Union[SourceDocument, DocumentRun]]) -> AsyncIterator[dict]:
+    """
+    Runs ``documents`` through ``pipeline``, yielding each document's summary as it
+    finishes. Documents are read from ``documents`` only as the upload queue has room.
+    """
+    runs = (document if isinstance(document, DocumentRun) else DocumentRun(document) for document in documents)
+    async for item in pipeline.run(runs):
+        yield document_summary(item)
@@ -0,0 +1,284 @@
+"""
+Embedding Service
+
+Approximate nearest-neighbour search over ``Patient.embedding`` backed by an on-disk
+IVF (inverted file) index.
+
+The index is built offline from the ``patients`` table (see scripts/build_vector_index.py):
+vectors are L2-normalized, clustered with spherical k-means, and written grouped by
+cluster so each inverted list is one contiguous slice. At startup the arrays are
+memory-mapped, so only the lists a query probes are paged in.
+
+Writes after the build land in an in-memory delta (an EmbeddingStore) and the stale
+indexed copy is tombstoned, so results stay current until the next rebuild. Tables
+smaller than EXACT_SEARCH_MAX_ROWS skip the index and use the exact store.
+
+Functions:
+- rebuild_vector_index: Builds and saves the index from the patients table.
+- load_vector_index: Memory-maps the saved index and replays writes made since the build.
+- search_similar: Top-k cosine search, ANN or exact depending on table size.
+- sync_patient_embedding: Keeps the exact store and the index delta in step with writes.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.config import EXACT_SEARCH_MAX_ROWS, VECTOR_INDEX_DIR, VECTOR_INDEX_NLIST, VECTOR_INDEX_NPROBE
+from app.utils import embedding_store
+from app.utils.embedding_store import EmbeddingStore, get_embedding_store, parse_embedding
+from database.models import Patient
+
+logger = logging.getLogger(__name__)
+
+KMEANS_ITERATIONS = 10
+KMEANS_TRAINING_SAMPLE = 50000
+_ASSIGN_CHUNK = 8192
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], _ASSIGN_CHUNK):
+        chunk = vectors[start:start + _ASSIGN_CHUNK]
+        labels[start:start + _ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if vectors.shape[0] > KMEANS_TRAINING_SAMPLE:
+        vectors = vectors[rng.choice(vectors.shape[0], KMEANS_TRAINING_SAMPLE, replace=False)]
+
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random training vectors
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index. ``vectors``/``ids`` are sorted by list and
+    ``offsets[i]:offsets[i + 1]`` is the slice belonging to list ``i``.
+    """
+
+    FILES = ("centroids", "vectors", "ids", "offsets")
+
+    def __init__(self, centroids, vectors, ids, offsets, built_at: datetime):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.built_at = built_at
+        self.id_set = set(int(i) for i in ids)
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, nlist: int = 0, built_at: Optional[datetime] = None):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if not nlist:
+            nlist = int(np.sqrt(vectors.shape[0]))
+        nlist = max(1, min(nlist, vectors.shape[0]))
+
+        centroids = _spherical_kmeans(vectors, nlist)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=nlist))
+        return cls(
+            centroids,
+            np.ascontiguousarray(vectors[order]),
+            np.asarray(ids, dtype=np.int64)[order],
+            offsets,
+            built_at or datetime.utcnow(),
+        )
+
+    def save(self, directory: str):
+        # Write next to the target and swap, so a running server never maps a half-written index
+        staging = f"{directory.rstrip(os.sep)}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name in self.FILES:
+            np.save(os.path.join(staging, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({"built_at": self.built_at.isoformat(), "rows": len(self), "nlist": self.nlist}, f)
+
+        previous = f"{directory.rstrip(os.sep)}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, previous)
+        os.replace(staging, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str):
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in cls.FILES
+        }
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        # Offsets and centroids are small and read on every query
+        arrays["offsets"] = np.array(arrays["offsets"])
+        arrays["centroids"] = np.array(arrays["centroids"])
+        return cls(built_at=datetime.fromisoformat(meta["built_at"]), **arrays)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int, exclude=()) -> Tuple[np.ndarray, np.ndarray]:
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        out_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        out_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            slices = [slice(self.offsets[i], self.offsets[i + 1]) for i in lists]
+            ids = np.concatenate([self.ids[s] for s in slices])
+            scores = np.concatenate([self.vectors[s] @ query for s in slices])
+            if exclude:
+                keep = ~np.isin(ids, list(exclude))
+                ids, scores = ids[keep], scores[keep]
+            top = np.argsort(-scores, kind="stable")[:k]
+            out_ids[row, :top.size] = ids[top]
+            out_scores[row, :top.size] = scores[top]
+        return out_ids, out_scores
+
+
+class VectorIndex:
+    """
+    A loaded IVF index plus the writes made since it was built.
+    """
+
+    def __init__(self, ivf: IVFIndex):
+        self.ivf = ivf
+        self.delta = EmbeddingStore()
+        self.tombstones = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ivf) - len(self.tombstones) + len(self.delta)
+
+    def upsert(self, patient_id: int, embedding):
+        with self._lock:
+            if patient_id in self.ivf.id_set:
+                self.tombstones.add(patient_id)
+            self.delta.upsert(patient_id, embedding)
+
+    def delete(self, patient_id: int):
+        with self._lock:
+            if patient_id in self.ivf.id_set:
+                self.tombstones.add(patient_id)
+            self.delta.delete(patient_id)
+
+    def search(self, queries, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        with self._lock:
+            tombstones = set(self.tombstones)
+        ids, scores = self.ivf.search(queries, k, nprobe, exclude=tombstones)
+        if not len(self.delta):
+            return ids, scores
+
+        delta_ids, delta_scores = self.delta.top_k(queries, k)
+        ids = np.concatenate([ids, delta_ids], axis=1)
+        scores = np.concatenate([scores, delta_scores], axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+_vector_index: Optional[VectorIndex] = None
+
+
+def rebuild_vector_index(db, directory: str = VECTOR_INDEX_DIR, nlist: int = VECTOR_INDEX_NLIST) -> Optional[IVFIndex]:
+    """
+    Builds the IVF index from every embedded patient row and saves it to ``directory``.
+    """
+    built_at = datetime.utcnow()
+    ids, vectors = [], []
+    rows = db.query(Patient.id, Patient.embedding).filter(Patient.embedding.isnot(None)).yield_per(1000)
+    for patient_id, embedding in rows:
+        vector = parse_embedding(embedding)
+        if vector is not None:
+            ids.append(patient_id)
+            vectors.append(vector)
+
+    if not vectors:
+        logger.warning("No patient embeddings found, vector index not built")
+        return None
+
+    started = time.perf_counter()
+    ivf = IVFIndex.build(np.asarray(ids), np.vstack(vectors), nlist=nlist, built_at=built_at)
+    ivf.save(directory)
+    logger.info(
+        f"Built vector index with {len(ivf)} rows in {ivf.nlist} lists "
+        f"in {time.perf_counter() - started:.1f}s -> {directory}"
+    )
+    return ivf
+
+
+def load_vector_index(db, directory: str = VECTOR_INDEX_DIR) -> Optional[VectorIndex]:
+    """
+    Memory-maps the saved index and replays rows written since it was built.
+    """
+    global _vector_index
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        logger.info(f"No vector index at {directory}, using exact embedding search")
+        return None
+
+    index = VectorIndex(IVFIndex.load(directory))
+    changed = (
+        db.query(Patient.id, Patient.embedding)
+        .filter(Patient.updated_at >= index.ivf.built_at)
+        .yield_per(1000)
+    )
+    for patient_id, embedding in changed:
+        index.upsert(patient_id, embedding)
+
+    _vector_index = index
+    logger.info(f"Loaded vector index with {len(index.ivf)} rows, {len(index.delta)} pending updates")
+    return index
+
+
+def search_similar(db, vectors, k: int = 1, nprobe: int = VECTOR_INDEX_NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k cosine search for one or many vectors.
+
+    Returns ``(ids, scores)`` of shape ``(n_queries, k')``; missing slots hold id -1.
+    Uses the ANN index when one is loaded and large enough, the exact store otherwise.
+    """
+    index = _vector_index
+    if index is not None and len(index.ivf) >= EXACT_SEARCH_MAX_ROWS:
+        return index.search(vectors, k, nprobe)
+    return get_embedding_store(db).top_k(vectors, k)
+
+
+def sync_patient_embedding(patient: Patient):
+    embedding_store.sync_patient_embedding(patient)
+    if _vector_index is not None:
+        try:
+            _vector_index.upsert(patient.id, patient.embedding)
+        except ValueError as e:
+            logger.warning(f"Skipping index update for patient {patient.id}: {e}")
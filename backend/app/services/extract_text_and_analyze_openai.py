@@ -1,11 +1,11 @@
 # app/services/extract_text_and_analyze_openai.py
 
 import openai
-import boto3
 from urllib.parse import urlparse
 import os
 
 from dotenv import load_dotenv
+from app.services.client_registry import client_registry
 load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -15,8 +15,7 @@ def generate_presigned_url(s3_url: str, expiration: int = 300) -> str:
     bucket = parsed.netloc
     key = parsed.path.lstrip("/")
 
-    s3 = boto3.client("s3")
-    return s3.generate_presigned_url(
+    return client_registry.aws("s3").generate_presigned_url(
         "get_object",
         Params={"Bucket": bucket, "Key": key},
         ExpiresIn=expiration
@@ -47,4 +46,37 @@ def extract_text_and_analyze_openai(s3_url: str) -> str:
         ],
         max_tokens=2000
     )
-    return response.choices[0].message.content
\ No newline at end of file
+    return response.choices[0].message.content
+
+
+def extract_text_openai_vision(s3_url: str, model: str = "gpt-4o") -> str:
+    """
+    Plain OCR with GPT-4o vision: the document's text, line by line, without any
+    structuring (used as an OCR engine, see app.services.ocr_engines).
+    """
+    image_url = generate_presigned_url(s3_url)
+
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Transcribe all text in this medical document exactly as written, one line of the document per line. Return only the transcribed text."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                            "detail": "high"
+                        }
+                    }
+                ]
+            }
+        ],
+        max_tokens=4000,
+        temperature=0
+    )
+    return response.choices[0].message.content or ""
@@ -0,0 +1,148 @@
+"""
+Image Preprocessing
+
+Shrinks uploaded images before they are stored and OCR'd. Phone photos arrive at
+12 MP in colour, often rotated only through EXIF; OCR needs none of that. Each
+image is, in a worker process:
+
+1. rotated upright from its EXIF orientation,
+2. converted to grayscale,
+3. downscaled: to OCR_IMAGE_TARGET_DPI when the image declares a higher DPI, and in
+   any case to at most OCR_IMAGE_MAX_DIMENSION pixels on the long side,
+4. recompressed as JPEG (OCR_IMAGE_JPEG_QUALITY).
+
+If the result is not smaller than the upload and the image needed no rotation or
+scaling, the original bytes are kept (JPEG and PNG only). The processed bytes are
+what gets uploaded and what the OCR engines receive directly, so images make no S3
+round trip before OCR.
+
+Functions:
+- ImagePreprocessor.process: Preprocesses one image in the worker pool.
+- ImagePreprocessor.stats: Images processed, bytes saved and processing latency.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.config import (
+    OCR_IMAGE_JPEG_QUALITY,
+    OCR_IMAGE_MAX_DIMENSION,
+    OCR_IMAGE_TARGET_DPI,
+    OCR_IMAGE_WORKERS,
+)
+
+
+def preprocess_image(data: bytes, target_dpi: int = OCR_IMAGE_TARGET_DPI,
+                     max_dimension: int = OCR_IMAGE_MAX_DIMENSION,
+                     quality: int = OCR_IMAGE_JPEG_QUALITY) -> Tuple[bytes, dict]:
+    """
+    Returns the processed image bytes and a report of what was done.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        original_size = source.size
+        # Formats every OCR engine takes as they are
+        ocr_ready = source.format in ("JPEG", "PNG")
+        dpi = source.info.get("dpi")
+        rotated = source.getexif().get(0x0112, 1) not in (None, 1)
+        image = ImageOps.exif_transpose(source)
+
+        image = image.convert("L")
+
+        scale = 1.0
+        if dpi and dpi[0] and dpi[0] > target_dpi:
+            scale = target_dpi / float(dpi[0])
+        longest = max(image.size)
+        if longest * scale > max_dimension:
+            scale = max_dimension / float(longest)
+        if scale < 1.0:
+            image = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                Image.LANCZOS,
+            )
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True,
+                   dpi=(min(dpi[0], target_dpi),) * 2 if dpi and dpi[0] else (target_dpi, target_dpi))
+        processed = buffer.getvalue()
+
+    kept_original = ocr_ready and len(processed) >= len(data) and not rotated and scale >= 1.0
+    report = {
+        "original_bytes": len(data),
+        "processed_bytes": len(data) if kept_original else len(processed),
+        "original_size": list(original_size),
+        "processed_size": list(original_size if kept_original else image.size),
+        "rotated": rotated,
+        "scale": round(scale, 4),
+        "format": "original" if kept_original else "jpeg",
+    }
+    return (data if kept_original else processed), report
+
+
+class ImagePreprocessor:
+    def __init__(self, workers: int = OCR_IMAGE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters = {
+            "images": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "seconds": 0.0,
+            "kept_original": 0,
+            "failures": 0,
+        }
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a threaded server process is not safe
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    async def process(self, data: bytes) -> Tuple[bytes, dict]:
+        """
+        Preprocesses ``data`` in the worker pool. Images Pillow cannot read are
+        returned unchanged (the OCR engine reports the real error).
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            processed, report = await loop.run_in_executor(self._executor(), preprocess_image, data)
+        except Exception as e:
+            self._counters["failures"] += 1
+            return data, {"original_bytes": len(data), "processed_bytes": len(data), "error": str(e)}
+        seconds = time.perf_counter() - started
+
+        report["seconds"] = round(seconds, 4)
+        self._counters["images"] += 1
+        self._counters["bytes_in"] += report["original_bytes"]
+        self._counters["bytes_out"] += report["processed_bytes"]
+        self._counters["seconds"] += seconds
+        self._counters["kept_original"] += report["format"] == "original"
+        return processed, report
+
+    def stats(self) -> dict:
+        counters = self._counters
+        images = counters["images"]
+        return {
+            **counters,
+            "seconds": round(counters["seconds"], 3),
+            "bytes_saved": counters["bytes_in"] - counters["bytes_out"],
+            "size_ratio": round(counters["bytes_out"] / counters["bytes_in"], 4) if counters["bytes_in"] else None,
+            "avg_ms": round(counters["seconds"] / images * 1000, 2) if images else 0.0,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,97 @@
+"""
+Job Handlers
+
+The background job kinds run by job queue workers (see app.services.job_queue):
+
+- document: an uploaded document (already in S3) through OCR -> NER -> patient ->
+  match, as one run of the document pipeline. Retries reuse the OCR result cache, so
+  a failed NER call does not pay for OCR again.
+- ner: OpenAI NER on extracted text.
+- fuzzy_match: process_fuzzy_match on a batch of patients.
+
+Functions:
+- prepare_worker: One-time setup of a worker process.
+- run_document_job, run_ner_job, run_fuzzy_match_job: The handlers.
+"""
+
+import asyncio
+
+from fastapi.encoders import jsonable_encoder
+
+from app.routes.ingestion import OCR_FILE_TYPES, UploadedDocument, download_s3_fileobj
+from app.services.document_pipeline import DocumentRun, SourceDocument, build_document_pipeline, run_documents
+from app.services.embedding_service import load_vector_index
+from app.services.job_queue import PermanentJobError, job_handler
+from app.services.ner_openai_service import analyze_medical_document
+from app.services.ocr_engines import OcrDocument
+from app.services.patient_matcher import process_fuzzy_match
+from database.database import SessionLocal
+from database.schemas import PatientData
+
+# Pipeline stages whose failures are worth retrying (network, rate limits, OpenAI)
+_RETRYABLE_STAGES = ("upload", "ocr", "ner", "match")
+
+
+def prepare_worker():
+    # Embedding matches search the in-memory vector index, as in the API process
+    db = SessionLocal()
+    try:
+        load_vector_index(db)
+    finally:
+        db.close()
+
+
+async def _run_document(payload: dict) -> dict:
+    uploaded = UploadedDocument(
+        payload["filename"], None, payload["content_hash"], payload["file_ext"], payload["s3_path"],
+        cached=payload.get("cached"), preprocessing=payload.get("preprocessing"),
+    )
+    if uploaded.cached is None:
+        loop = asyncio.get_running_loop()
+        uploaded.fileobj = await loop.run_in_executor(None, download_s3_fileobj, uploaded.s3_path)
+        uploaded.document = OcrDocument(
+            uploaded.s3_path, OCR_FILE_TYPES[uploaded.file_ext], payload["size"], uploaded.fileobj
+        )
+    pipeline = build_document_pipeline(match=payload.get("match", True), page_parallel=payload.get("page_parallel"))
+    try:
+        summaries = [
+            summary async for summary in
+            run_documents(pipeline, [DocumentRun(SourceDocument(payload["filename"]), uploaded=uploaded)])
+        ]
+    finally:
+        if uploaded.fileobj is not None:
+            uploaded.fileobj.close()
+    return {**summaries[0], "stats": pipeline.stats()}
+
+
+@job_handler("document")
+def run_document_job(payload: dict) -> dict:
+    summary = jsonable_encoder(asyncio.run(_run_document(payload)))
+    if summary["error"]:
+        message = f"{summary['failed_stage']}: {summary['error']}"
+        if summary["failed_stage"] in _RETRYABLE_STAGES:
+            raise RuntimeError(message)
+        raise PermanentJobError(message)
+    return summary
+
+
+@job_handler("ner")
+def run_ner_job(payload: dict) -> dict:
+    result = analyze_medical_document(payload["text"], is_file=False)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+@job_handler("fuzzy_match")
+def run_fuzzy_match_job(payload: dict) -> dict:
+    try:
+        patients = [PatientData(**patient) for patient in payload["patients"]]
+    except (KeyError, TypeError, ValueError) as e:
+        raise PermanentJobError(f"Invalid patients: {e}")
+    db = SessionLocal()
+    try:
+        result = process_fuzzy_match(patients, db, payload.get("blocking_keys"), payload.get("parallel"))
+    finally:
+        db.close()
+    return jsonable_encoder(result)
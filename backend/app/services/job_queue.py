@@ -0,0 +1,201 @@
+"""
+Job Queue
+
+Durable background jobs in the ``jobs`` table, so OCR, NER, embeddings and matching
+run in worker processes instead of API request handlers. An endpoint enqueues a job
+and returns its id at once; workers (scripts/run_job_workers.py) claim due jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of them, on any number of hosts, can
+poll the same table without handing one job to two workers.
+
+- Visibility timeout: a claimed job is hidden for JOB_VISIBILITY_TIMEOUT seconds. The
+  worker renews the claim while the handler runs; if the worker dies, the claim lapses
+  and another worker picks the job up.
+- Retries: a handler that raises has its job queued again after JOB_RETRY_DELAY
+  seconds, doubling per attempt up to JOB_RETRY_MAX_DELAY, until JOB_MAX_ATTEMPTS.
+  PermanentJobError fails the job without retrying.
+- A worker that lost its claim cannot complete or fail the job any more, so a job
+  taken over by another worker is not recorded twice.
+
+Handlers are plain functions payload -> result (JSON), registered per job kind with
+@job_handler (see app.services.job_handlers).
+
+Functions:
+- enqueue: Adds a job and returns its id.
+- job_handler: Registers the handler of a job kind.
+- JobWorker.run_once: Claims and runs one job.
+- JobWorker.run: Runs jobs until stopped.
+- start_workers: Starts worker processes.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app.config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETRY_DELAY,
+    JOB_RETRY_MAX_DELAY,
+    JOB_VISIBILITY_TIMEOUT,
+)
+from database.database import SessionLocal
+from database.job_repository import claim_jobs, complete_job, enqueue_job, extend_job, fail_job
+
+logger = logging.getLogger(__name__)
+
+job_handlers: Dict[str, Callable[[dict], Optional[dict]]] = {}
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a handler when retrying cannot help (bad payload, document without a
+    patient, ...).
+    """
+
+
+def job_handler(kind: str):
+    def register(handler: Callable[[dict], Optional[dict]]):
+        job_handlers[kind] = handler
+        return handler
+
+    return register
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS, delay: float = 0,
+            session_factory=None) -> str:
+    db = (session_factory or SessionLocal)()
+    try:
+        return enqueue_job(db, kind, payload, max_attempts=max_attempts, delay=delay).id
+    finally:
+        db.close()
+
+
+def retry_delay(attempts: int, base: float = JOB_RETRY_DELAY, cap: float = JOB_RETRY_MAX_DELAY) -> float:
+    return min(base * 2 ** max(0, attempts - 1), cap)
+
+
+class JobWorker:
+    def __init__(self, worker_id: Optional[str] = None, kinds: Optional[Sequence[str]] = None,
+                 handlers: Optional[Dict[str, Callable]] = None, session_factory=SessionLocal,
+                 visibility_timeout: float = JOB_VISIBILITY_TIMEOUT, poll_interval: float = JOB_POLL_INTERVAL):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.handlers = job_handlers if handlers is None else handlers
+        self.kinds = list(kinds) if kinds else None
+        self.session_factory = session_factory
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.counters = {"completed": 0, "retried": 0, "failed": 0, "lost": 0}
+
+    def _claim(self):
+        db = self.session_factory()
+        try:
+            jobs = claim_jobs(db, self.worker_id, self.visibility_timeout, self.kinds or list(self.handlers))
+            if not jobs:
+                return None
+            job = jobs[0]
+            return job.id, job.kind, job.payload, job.attempts, job.max_attempts
+        finally:
+            db.close()
+
+    def _renew(self, job_id: str, done: threading.Event):
+        # Keeps the claim alive while the handler runs
+        while not done.wait(self.visibility_timeout / 3):
+            db = self.session_factory()
+            try:
+                if not extend_job(db, job_id, self.worker_id, self.visibility_timeout):
+                    logger.warning(f"Worker {self.worker_id} lost its claim on job {job_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew claim on job {job_id}: {e}")
+            finally:
+                db.close()
+
+    def _record(self, update, *args) -> bool:
+        db = self.session_factory()
+        try:
+            return update(db, *args)
+        finally:
+            db.close()
+
+    def run_once(self) -> bool:
+        """
+        Claims one due job and runs it. Returns False when there was nothing to do.
+        """
+        claimed = self._claim()
+        if claimed is None:
+            return False
+        job_id, kind, payload, attempts, max_attempts = claimed
+
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(job_id, done), daemon=True)
+        renewer.start()
+        started = time.perf_counter()
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise PermanentJobError(f"No handler for job kind {kind}")
+            result = handler(payload)
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError)
+            delay = None if permanent else retry_delay(attempts)
+            recorded = self._record(fail_job, job_id, self.worker_id, f"{type(e).__name__}: {e}", delay)
+            outcome = "failed" if permanent or attempts >= max_attempts else "retried"
+            logger.warning(f"Job {job_id} ({kind}) attempt {attempts} failed: {e}")
+        else:
+            recorded = self._record(complete_job, job_id, self.worker_id, result)
+            outcome = "completed"
+            logger.info(f"Job {job_id} ({kind}) completed in {time.perf_counter() - started:.2f}s")
+        finally:
+            done.set()
+            renewer.join()
+
+        if not recorded:
+            # The claim lapsed and another worker owns the job now
+            outcome = "lost"
+        self.counters[outcome] += 1
+        return True
+
+    def run(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        logger.info(f"Job worker {self.worker_id} started for {self.kinds or sorted(self.handlers)}")
+        while not stop.is_set():
+            try:
+                busy = self.run_once()
+            except Exception as e:
+                # Database unavailable and the like: wait and poll again
+                logger.error(f"Job worker {self.worker_id} could not claim jobs: {e}")
+                busy = False
+            if not busy:
+                stop.wait(self.poll_interval)
+        logger.info(f"Job worker {self.worker_id} stopped: {self.counters}")
+
+
+def _worker_main(kinds: Optional[List[str]]):
+    # Runs in a worker process; importing the handlers registers them
+    from app.services.job_handlers import prepare_worker
+
+    logging.basicConfig(level=logging.INFO)
+    prepare_worker()
+    stop = threading.Event()
+    # Finish the current job on SIGTERM/SIGINT, then exit
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    JobWorker(kinds=kinds).run(stop)
+
+
+def start_workers(count: int, kinds: Optional[Sequence[str]] = None) -> List[multiprocessing.Process]:
+    # spawn: each worker starts with its own database connections and clients
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_main, args=(list(kinds) if kinds else None,), name=f"job-worker-{i}")
+        for i in range(max(1, count))
+    ]
+    for process in processes:
+        process.start()
+    return processes
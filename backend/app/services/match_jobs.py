@@ -0,0 +1,159 @@
+"""
+Fuzzy Match Jobs
+
+Runs process_fuzzy_match in the background for large registry imports. Submitting a
+job returns immediately; a worker thread processes the records chunk by chunk (each
+chunk in its own session and transaction) and appends every matched, unmatched and
+new record to the job's result log as soon as its chunk finishes. Readers can follow
+the log while the job runs, which is what the NDJSON results endpoint streams.
+
+Chunks of one job run in order, so later chunks see the updates of earlier ones,
+exactly as a single synchronous call would. Separate jobs run concurrently.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from app.config import MATCH_JOB_CHUNK_SIZE, MATCH_JOB_TTL_SECONDS, MATCH_JOB_WORKERS
+from app.services.patient_matcher import process_fuzzy_match
+
+logger = logging.getLogger(__name__)
+
+# Summary fields that are added up across chunks
+_SUMMED_FIELDS = (
+    "total", "matched", "unmatched", "new", "review_required", "confirmed",
+    "identifier_matches", "identifier_conflicts", "comparisons", "comparisons_pruned",
+)
+
+_RESULT_TYPES = (
+    ("matched_patients", "matched"),
+    ("unmatched_patients", "unmatched"),
+    ("new_patients", "new"),
+)
+
+
+class MatchJob:
+    def __init__(self, patients: List, blocking_keys: Optional[List[str]], chunk_size: int,
+                 parallel: Optional[bool] = None):
+        self.id = uuid.uuid4().hex
+        self.patients = patients
+        self.blocking_keys = blocking_keys
+        self.parallel = parallel
+        self.chunk_size = max(1, chunk_size)
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.processed = 0
+        self.summary: Dict = {field: 0 for field in _SUMMED_FIELDS}
+        self.results: List[dict] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._changed = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def _add_chunk(self, result: Dict, size: int):
+        lines = [
+            {"type": kind, "record": record}
+            for key, kind in _RESULT_TYPES
+            for record in result[key]
+        ]
+        with self._changed:
+            self.results.extend(lines)
+            self.processed += size
+            for field in _SUMMED_FIELDS:
+                self.summary[field] += result["summary"].get(field, 0)
+            self.summary["blocking_keys"] = result["summary"].get("blocking_keys")
+            self.summary["candidate_source"] = result["summary"].get("candidate_source")
+            self._changed.notify_all()
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    def follow(self, offset: int = 0, poll_timeout: float = 1.0) -> Iterator[dict]:
+        """
+        Yields result lines from ``offset`` as they are produced, then a final
+        summary line once the job has finished.
+        """
+        while True:
+            with self._changed:
+                if offset >= len(self.results) and not self.done:
+                    self._changed.wait(timeout=poll_timeout)
+                lines = self.results[offset:]
+                finished = self.done and offset + len(lines) >= len(self.results)
+            for line in lines:
+                yield line
+            offset += len(lines)
+            if finished:
+                yield {"type": "summary", **self.progress()}
+                return
+
+    def progress(self) -> dict:
+        elapsed_until = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "total": len(self.patients),
+            "processed": self.processed,
+            "progress": round(self.processed / len(self.patients), 4) if self.patients else 1.0,
+            "results_available": len(self.results),
+            "elapsed_seconds": round(elapsed_until - self.started_at, 3) if self.started_at else 0.0,
+            "summary": dict(self.summary),
+        }
+
+
+class MatchJobManager:
+    def __init__(self, session_factory: Callable, max_workers: int = MATCH_JOB_WORKERS):
+        self.session_factory = session_factory
+        self.jobs: Dict[str, MatchJob] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="match-job")
+
+    def submit(self, patients: List, blocking_keys: Optional[List[str]] = None,
+               chunk_size: Optional[int] = None, parallel: Optional[bool] = None) -> MatchJob:
+        job = MatchJob(patients, blocking_keys, chunk_size or MATCH_JOB_CHUNK_SIZE, parallel)
+        with self._lock:
+            self._expire()
+            self.jobs[job.id] = job
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[MatchJob]:
+        return self.jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - MATCH_JOB_TTL_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _run(self, job: MatchJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            for start in range(0, len(job.patients), job.chunk_size):
+                chunk = job.patients[start:start + job.chunk_size]
+                db = self.session_factory()
+                try:
+                    result = process_fuzzy_match(chunk, db, blocking_keys=job.blocking_keys, parallel=job.parallel)
+                finally:
+                    db.close()
+                job._add_chunk(result, len(chunk))
+        except Exception as e:
+            logger.exception(f"Fuzzy match job {job.id} failed")
+            job._finish("failed", str(e))
+        else:
+            job._finish("completed")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
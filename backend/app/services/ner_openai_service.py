@@ -3,6 +3,7 @@ from database.schemas import StructuredPatientInput
 from database.patient_context_repository import PatientContextRepository
 import openai
 import os
+from app.services.client_registry import client_registry  # noqa: F401  (pooled OpenAI session)
 from dotenv import load_dotenv
 from typing import Union
 import json
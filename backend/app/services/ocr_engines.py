@@ -0,0 +1,301 @@
+"""
+OCR Engines
+
+Interchangeable OCR backends behind one router:
+
+- aws_textract: Textract (async jobs for PDFs, sync API for images). Images are
+  sent as bytes when the upload is at hand, otherwise read from S3 by Textract.
+- openai_vision: GPT-4o transcription of an image through a presigned S3 URL.
+- tesseract: local Tesseract (pytesseract) on the upload's own bytes, in a process
+  pool, so clean typed images need no network round trip. Optional; unavailable
+  when pytesseract/tesseract are not installed.
+
+Every engine returns Textract-shaped blocks (at least LINE blocks with Text), so
+blocks_to_text, the OCR result cache and downstream consumers do not care which
+engine ran.
+
+OcrRouter picks the engine per document: engines that are available, enabled
+(OCR_ENGINES), accept the file type and the document size are candidates, and the
+one with the lowest measured latency for that file type wins. Engines without
+enough measurements are tried first so every candidate gets measured, and every
+OCR_ROUTER_EXPLORE_EVERY-th document goes to the least recently measured candidate
+so estimates stay current. A failing engine falls through to the next candidate and
+is tried last for OCR_ROUTER_FAILURE_COOLDOWN seconds (doubling with each further
+consecutive failure), so an outage or a bad key does not add a timeout to every
+document.
+
+Functions:
+- OcrRouter.extract: Runs the best engine for a document, returning (engine name, blocks).
+- OcrRouter.candidates: Engines eligible for a file type and size, best first.
+- OcrRouter.stats: Per-engine request, failure and latency figures.
+"""
+
+import abc
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import IO, Dict, List, Optional, Sequence, Tuple
+
+from app.config import (
+    OCR_ENGINES,
+    OCR_LOCAL_MAX_BYTES,
+    OCR_LOCAL_WORKERS,
+    OCR_OPENAI_MAX_BYTES,
+    OCR_OPENAI_MODEL,
+    OCR_ROUTER_EXPLORE_EVERY,
+    OCR_ROUTER_FAILURE_COOLDOWN,
+    OCR_ROUTER_MIN_SAMPLES,
+)
+from app.services.extract_text_and_analyze_openai import extract_text_openai_vision
+from app.services.ocr_service import extract_blocks_with_textract_async
+
+try:
+    import pytesseract
+except ImportError:  # pragma: no cover - exercised only with pytesseract installed
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the latency moving average
+_LATENCY_ALPHA = 0.2
+# Longest cooldown of a repeatedly failing engine
+_MAX_COOLDOWN = 3600.0
+# Textract's limit for images sent as bytes
+TEXTRACT_MAX_IMAGE_BYTES = 10 * 2 ** 20
+
+
+class OcrEngineError(Exception):
+    pass
+
+
+@dataclass
+class OcrDocument:
+    """
+    One uploaded document as the engines see it. ``fileobj`` is the local, seekable
+    upload; ``s3_path`` the uploaded object.
+    """
+    s3_path: str
+    file_type: str  # "pdf" or "image"
+    size: int
+    fileobj: Optional[IO[bytes]] = None
+
+
+def lines_to_blocks(lines: Sequence[str]) -> List[dict]:
+    return [{"BlockType": "LINE", "Text": line} for line in lines if line.strip()]
+
+
+class OcrEngine(abc.ABC):
+    name = ""
+    file_types: Tuple[str, ...] = ()
+    # Largest document the engine accepts, None for no limit
+    max_bytes: Optional[int] = None
+
+    def available(self) -> bool:
+        return True
+
+    def accepts(self, file_type: str, size: int) -> bool:
+        return file_type in self.file_types and (self.max_bytes is None or size <= self.max_bytes)
+
+    @abc.abstractmethod
+    async def extract(self, document: OcrDocument) -> List[dict]:
+        """
+        Textract-shaped blocks of ``document``; raises on failure.
+        """
+
+
+def _read_document(document: OcrDocument) -> bytes:
+    document.fileobj.seek(0)
+    data = document.fileobj.read()
+    document.fileobj.seek(0)
+    return data
+
+
+class TextractEngine(OcrEngine):
+    name = "aws_textract"
+    file_types = ("pdf", "image")
+
+    async def extract(self, document: OcrDocument) -> List[dict]:
+        document_bytes = None
+        if document.file_type == "image" and document.fileobj is not None and document.size <= TEXTRACT_MAX_IMAGE_BYTES:
+            # Send the (preprocessed) image as is rather than having Textract fetch it
+            document_bytes = await asyncio.get_running_loop().run_in_executor(None, _read_document, document)
+        blocks = await extract_blocks_with_textract_async(document.s3_path, document.file_type, document_bytes)
+        if blocks is None:
+            raise OcrEngineError(f"Textract could not process {document.s3_path}")
+        return blocks
+
+
+class OpenAIVisionEngine(OcrEngine):
+    name = "openai_vision"
+    file_types = ("image",)
+    max_bytes = OCR_OPENAI_MAX_BYTES
+
+    async def extract(self, document: OcrDocument) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(None, extract_text_openai_vision, document.s3_path, OCR_OPENAI_MODEL)
+        return lines_to_blocks(text.splitlines())
+
+
+def _tesseract_lines(image_bytes: bytes) -> List[str]:
+    # Runs in a pool process
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return pytesseract.image_to_string(image).splitlines()
+
+
+class TesseractEngine(OcrEngine):
+    name = "tesseract"
+    file_types = ("image",)
+    max_bytes = OCR_LOCAL_MAX_BYTES
+
+    def __init__(self, workers: int = OCR_LOCAL_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._available: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            try:
+                self._available = pytesseract is not None and bool(pytesseract.get_tesseract_version())
+            except Exception:
+                # pytesseract installed without the tesseract binary
+                self._available = False
+        return self._available
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a threaded server process is not safe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def extract(self, document: OcrDocument) -> List[dict]:
+        if document.fileobj is None:
+            raise OcrEngineError("Local OCR needs the uploaded file")
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(None, _read_document, document)
+        return lines_to_blocks(await loop.run_in_executor(self._executor(), _tesseract_lines, image_bytes))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class _EngineStats:
+    __slots__ = ("requests", "failures", "consecutive_failures", "cooldown_until", "latency", "samples", "last_used")
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # monotonic time until which the engine is tried only after the others
+        self.cooldown_until = 0.0
+        # Moving average of seconds per document, by file type
+        self.latency: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+        self.last_used: Dict[str, float] = {}
+
+
+class OcrRouter:
+    def __init__(self, engines: Sequence[OcrEngine], enabled: Optional[Sequence[str]] = None,
+                 min_samples: int = OCR_ROUTER_MIN_SAMPLES, explore_every: int = OCR_ROUTER_EXPLORE_EVERY,
+                 failure_cooldown: float = OCR_ROUTER_FAILURE_COOLDOWN):
+        enabled = list(enabled) if enabled is not None else [engine.name for engine in engines]
+        by_name = {engine.name: engine for engine in engines}
+        # Configured order breaks ties and orders unmeasured engines
+        self.engines = [by_name[name] for name in enabled if name in by_name]
+        self.min_samples = min_samples
+        self.explore_every = explore_every
+        self.failure_cooldown = failure_cooldown
+        self.routed = 0
+        self._stats = {engine.name: _EngineStats() for engine in self.engines}
+
+    def candidates(self, file_type: str, size: int) -> List[OcrEngine]:
+        eligible = [e for e in self.engines if e.accepts(file_type, size) and e.available()]
+        now = time.monotonic()
+
+        def expected(engine: OcrEngine):
+            stats = self._stats[engine.name]
+            if stats.cooldown_until > now:
+                # Failed recently: only a fallback until the cooldown ends
+                return (2, stats.cooldown_until)
+            if stats.samples.get(file_type, 0) < self.min_samples:
+                # Unmeasured: try it before relying on the others' estimates
+                return (0, 0.0)
+            return (1, stats.latency[file_type])
+
+        return sorted(eligible, key=expected)
+
+    def _record(self, engine: OcrEngine, file_type: str, seconds: float):
+        stats = self._stats[engine.name]
+        previous = stats.latency.get(file_type)
+        stats.latency[file_type] = seconds if previous is None else previous + _LATENCY_ALPHA * (seconds - previous)
+        stats.samples[file_type] = stats.samples.get(file_type, 0) + 1
+        stats.last_used[file_type] = time.monotonic()
+        stats.consecutive_failures = 0
+        stats.cooldown_until = 0.0
+
+    def _record_failure(self, engine: OcrEngine):
+        stats = self._stats[engine.name]
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        cooldown = min(self.failure_cooldown * 2 ** (stats.consecutive_failures - 1), _MAX_COOLDOWN)
+        stats.cooldown_until = time.monotonic() + cooldown
+
+    async def extract(self, document: OcrDocument) -> Tuple[Optional[str], Optional[List[dict]]]:
+        """
+        OCR with the best candidate engine, falling back to the next one on failure.
+        Returns (None, None) when no engine could process the document.
+        """
+        candidates = self.candidates(document.file_type, document.size)
+        self.routed += 1
+        now = time.monotonic()
+        healthy = [e for e in candidates if self._stats[e.name].cooldown_until <= now]
+        if self.explore_every and len(healthy) > 1 and self.routed % self.explore_every == 0:
+            stale = min(healthy, key=lambda e: self._stats[e.name].last_used.get(document.file_type, 0.0))
+            candidates.remove(stale)
+            candidates.insert(0, stale)
+
+        for engine in candidates:
+            stats = self._stats[engine.name]
+            stats.requests += 1
+            started = time.perf_counter()
+            try:
+                blocks = await engine.extract(document)
+            except Exception as e:
+                self._record_failure(engine)
+                logger.warning(f"OCR engine {engine.name} failed on {document.s3_path}: {e}")
+                continue
+            self._record(engine, document.file_type, time.perf_counter() - started)
+            return engine.name, blocks
+
+        logger.error(f"No OCR engine could process {document.s3_path} ({document.file_type}, {document.size} bytes)")
+        return None, None
+
+    def stats(self) -> dict:
+        return {
+            engine.name: {
+                "available": engine.available(),
+                "file_types": list(engine.file_types),
+                "max_bytes": engine.max_bytes,
+                "requests": self._stats[engine.name].requests,
+                "failures": self._stats[engine.name].failures,
+                "cooling_down": self._stats[engine.name].cooldown_until > time.monotonic(),
+                "latency_seconds": {k: round(v, 3) for k, v in self._stats[engine.name].latency.items()},
+                "samples": dict(self._stats[engine.name].samples),
+            }
+            for engine in self.engines
+        }
+
+    def close(self):
+        for engine in self.engines:
+            if hasattr(engine, "close"):
+                engine.close()
+
+
+ocr_router = OcrRouter([TesseractEngine(), TextractEngine(), OpenAIVisionEngine()], OCR_ENGINES)
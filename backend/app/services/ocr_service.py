@@ -1,47 +1,55 @@
-import boto3
+import asyncio
 import logging
+from typing import List, Optional
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
-import os
-from dotenv import load_dotenv
-import time
+from app.services.client_registry import client_registry
 from app.services.ner_openai_service import analyze_medical_document
+from app.services.textract_poller import TextractJobError, TextractPoller, blocks_to_text
 
 # Setup logger
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Load AWS credentials
-load_dotenv()
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+def get_textract_client():
+    return client_registry.aws("textract")
 
 
-logger = logging.getLogger(__name__)
+def get_s3_client():
+    return client_registry.aws("s3")
 
-def get_textract_client():
-    logger.info("Creating Textract client")
-    return boto3.client(
-        'textract',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
-    )
 
+_textract_poller = None
+
+
+def get_textract_poller() -> TextractPoller:
+    global _textract_poller
+    if _textract_poller is None:
+        _textract_poller = TextractPoller(get_textract_client())
+    return _textract_poller
 
-def get_s3_client():
-    logger.info("Creating S3 client")
-    return boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
-    )
 
+def _detect_image_blocks(bucket: str, key: str, document_bytes: Optional[bytes] = None) -> list:
+    textract_client = get_textract_client()
+    if document_bytes is not None:
+        logger.info(f"Sending {len(document_bytes)} image bytes to Textract")
+        document = {'Bytes': document_bytes}
+    else:
+        # Textract reads the object itself; no download through this process
+        document = {'S3Object': {'Bucket': bucket, 'Name': key}}
+    response = textract_client.detect_document_text(Document=document)
+    return response.get('Blocks', [])
 
-def extract_text_with_textract(s3_path: str, file_type: str) -> str:
+
+async def extract_blocks_with_textract_async(s3_path: str, file_type: str,
+                                             document_bytes: Optional[bytes] = None) -> Optional[List[dict]]:
+    """
+    Textract OCR without blocking the event loop. PDFs go through the async job poller
+    (all result pages); images use the sync API on an executor thread, with
+    ``document_bytes`` sent directly when the caller already has them. Returns the
+    Textract blocks, or None when the document could not be processed.
+    """
     try:
         logger.info(f"Starting text extraction from S3 path: {s3_path} with file type: {file_type}")
         parsed = urlparse(s3_path)
@@ -49,41 +57,16 @@ def extract_text_with_textract(s3_path: str, file_type: str) -> str:
         key = parsed.path.lstrip("/")
         logger.info(f"Parsed bucket: {bucket}, key: {key}")
 
-        textract_client = get_textract_client()
-
         if file_type.lower() == "pdf":
             logger.info("Using Textract async API for PDF")
-            # Start async job
-            response = textract_client.start_document_text_detection(
-                DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
-            )
-            job_id = response['JobId']
-            # Poll for result
-            while True:
-                result = textract_client.get_document_text_detection(JobId=job_id)
-                status = result['JobStatus']
-                if status in ['SUCCEEDED', 'FAILED']:
-                    break
-                logger.info(f"Textract job status: {status}, waiting...")
-                time.sleep(5)
-            if status == 'SUCCEEDED':
-                blocks = result.get('Blocks', [])
-            else:
-                logger.error("Textract PDF job failed")
-                return ""
+            poller = get_textract_poller()
+            blocks = await poller.wait(await poller.start(bucket, key))
         elif file_type.lower() in ['image', 'jpg', 'jpeg', 'png']:
             logger.info("Using Textract sync API for image")
-            s3 = get_s3_client()
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            document_bytes = obj['Body'].read()
-            logger.info(f"Read {len(document_bytes)} bytes from S3 object")
-            response = textract_client.detect_document_text(
-                Document={'Bytes': document_bytes}
-            )
-            blocks = response.get('Blocks', [])
+            blocks = await asyncio.get_running_loop().run_in_executor(None, _detect_image_blocks, bucket, key, document_bytes)
         else:
             logger.warning(f"Unsupported file type: {file_type}")
-            return ""
+            return None
 
         logger.info(f"Textract response contains {len(blocks)} blocks")
 
@@ -94,18 +77,24 @@ def extract_text_with_textract(s3_path: str, file_type: str) -> str:
         for i, block in enumerate(blocks[:5]):
             logger.debug(f"Block {i}: Type={block['BlockType']} Text={block.get('Text', '')}")
 
-        extracted_lines = [block['Text'] for block in blocks if block['BlockType'] == 'LINE' and 'Text' in block]
-        logger.info(f"Extracted {len(extracted_lines)} lines from Textract response")
-
-        if not extracted_lines:
-            logger.warning("No lines extracted from Textract response")
-
-        full_text = "\n".join(extracted_lines)
-        return full_text
+        return blocks
 
     except ClientError as e:
         logger.error(f"AWS Textract or S3 error: {e}")
-        return ""
+        return None
+    except TextractJobError as e:
+        logger.error(f"Textract PDF job failed: {e}")
+        return None
     except Exception as e:
         logger.error(f"Textract extraction failed: {e}")
-        return ""
\ No newline at end of file
+        return None
+
+
+async def extract_text_with_textract_async(s3_path: str, file_type: str) -> str:
+    blocks = await extract_blocks_with_textract_async(s3_path, file_type)
+    full_text = blocks_to_text(blocks or [])
+    if not full_text:
+        logger.warning("No lines extracted from Textract response")
+    else:
+        logger.info(f"Extracted {full_text.count(chr(10)) + 1} lines from Textract response")
+    return full_text
@@ -0,0 +1,325 @@
+"""
+Parallel fuzzy matching
+
+The fuzzy stage of process_fuzzy_match (blocking lookup plus batch scoring) is pure
+CPU work over a read-only list of stored patients. For large batches it is spread over
+a process pool:
+
+- The stored patients are published once as a column snapshot: a directory (in
+  /dev/shm where available) holding one shared string column per field blocking and
+  scoring read, with match keys filled in, plus the blocks of every blocking key (see
+  app.utils.shared_columns). No ORM objects cross the process boundary.
+- Workers memory-map the snapshot, so every process reads the same pages instead of
+  holding its own copy of the patients, and build a BlockingIndex and FuzzyScorer
+  over the columns per blocking strategy. Tasks carry the snapshot path; a worker
+  maps a new snapshot when the path changes.
+- The pool is long-lived and only grows when a caller asks for more processes. For
+  the shared patient snapshot (database.patient_snapshot) the column snapshot is
+  republished only when the snapshot version changes; other record lists are
+  published for the call and removed afterwards.
+- Results come back tagged with their input position and are merged in input order,
+  so the output is identical to the serial path regardless of scheduling.
+
+Workers never touch the database; all writes stay in the calling process.
+
+Functions:
+- use_parallel_matching: Decides whether a batch is large enough for the process pool.
+- map_partitions: Runs a task over partitions on workers sharing the snapshot.
+- MatchPool.close: Stops the long-lived pool and removes its published snapshot.
+- parallel_match_candidates: Runs CandidateMatcher.match across the process pool.
+"""
+
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.config import MATCH_PARALLEL_MIN_BATCH, MATCH_PARALLEL_WORKERS
+from app.utils.batch_matcher import EXACT_FIELDS, TEXT_FIELDS, FuzzyScorer
+from app.utils.blocking import BLOCKING_KEYS, BlockingIndex
+from app.utils.match_keys import MATCH_KEY_COLUMNS, TEXT_KEY_COLUMNS, compute_match_keys
+from app.utils.shared_columns import SharedBlocks, StringColumn, write_blocks, write_string_column
+from database.patient_snapshot import patient_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Attributes read by the blocking keys and the fuzzy scorer
+RECORD_FIELDS = ("name", "dob", "ssn", "insurance_number", "address", "email", "phone") + MATCH_KEY_COLUMNS
+
+# Partitions per worker; more than one evens out partitions with large blocks
+_PARTITIONS_PER_WORKER = 4
+
+# (best position or None, rounded score, candidates compared)
+FuzzyResult = Tuple[Optional[int], float, int]
+
+
+class MatchRecord:
+    """
+    Slotted stand-in for a patient carrying only the fields used for matching.
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, values: Sequence):
+        for field, value in zip(RECORD_FIELDS, values):
+            setattr(self, field, value)
+
+    @staticmethod
+    def values(patient) -> tuple:
+        return tuple(getattr(patient, field, None) for field in RECORD_FIELDS)
+
+
+class CandidateMatcher:
+    """
+    Blocking index and batch scorer over one list of stored patients.
+    """
+
+    def __init__(self, existing: Sequence, blocking_keys: Optional[Sequence[str]]):
+        self.blocking = BlockingIndex(existing, blocking_keys)
+        self.scorer = FuzzyScorer(existing)
+
+    def match(self, incoming: Sequence, threshold: float,
+              candidates: Optional[Sequence[Sequence[int]]] = None) -> List[FuzzyResult]:
+        """
+        ``candidates`` gives each record's candidate positions directly (e.g. from
+        SQL retrieval) instead of looking them up in the blocking index.
+        """
+        results = []
+        for i, record in enumerate(incoming):
+            positions = self.blocking.candidate_positions(record) if candidates is None else candidates[i]
+            [(best_position, best_score)] = self.scorer.best_matches([record], threshold, positions)
+            results.append((best_position, best_score, len(positions)))
+        return results
+
+
+def use_parallel_matching(batch_size: int, parallel: Optional[bool] = None) -> bool:
+    """
+    ``parallel`` forces the mode either way; ``None`` picks it by batch size.
+    """
+    if MATCH_PARALLEL_WORKERS < 2 or not batch_size:
+        return False
+    if parallel is not None:
+        return parallel
+    return batch_size >= MATCH_PARALLEL_MIN_BATCH
+
+
+def _parse_dob(value: str) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+
+def _column_value(field: str, value) -> Optional[str]:
+    if field == "dob":
+        return value.isoformat() if value else None
+    return value
+
+
+# Published snapshots get a fresh name each time, so a worker can tell them apart by path
+_snapshot_sequence = itertools.count()
+
+
+def publish_snapshot(existing: Sequence) -> str:
+    """
+    Writes ``existing`` as a column snapshot and returns its directory.
+    """
+    # /dev/shm keeps the snapshot in memory where available
+    parent = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    directory = tempfile.mkdtemp(prefix=f"match-snapshot-{os.getpid()}-{next(_snapshot_sequence)}-", dir=parent)
+    try:
+        keys = [None] * len(existing)
+        for position, patient in enumerate(existing):
+            # Rows written before the match-key backfill get their keys computed here
+            if any(getattr(patient, column, None) is None for column in MATCH_KEY_COLUMNS):
+                keys[position] = compute_match_keys(patient)
+
+        for field in RECORD_FIELDS:
+            if field in MATCH_KEY_COLUMNS:
+                values = (
+                    getattr(patient, field, None) if computed is None or getattr(patient, field, None) is not None
+                    else computed[field]
+                    for patient, computed in zip(existing, keys)
+                )
+            else:
+                values = (_column_value(field, getattr(patient, field, None)) for patient in existing)
+            write_string_column(directory, field, values)
+        write_blocks(directory, BlockingIndex(existing, list(BLOCKING_KEYS)).blocks)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return directory
+
+
+class SnapshotRecords(Sequence):
+    """
+    The stored patients of a column snapshot. Columns are memory-mapped; a
+    MatchRecord is only built for a position that is asked for.
+    """
+
+    def __init__(self, directory: str):
+        self.path = directory
+        self.columns = {
+            field: StringColumn(directory, field, _parse_dob if field == "dob" else None)
+            for field in RECORD_FIELDS
+        }
+        self.blocks = SharedBlocks(directory)
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    def __getitem__(self, position):
+        return MatchRecord(tuple(self.columns[field][position] for field in RECORD_FIELDS))
+
+    def matcher(self, blocking_keys: Sequence[str]) -> "CandidateMatcher":
+        matcher = CandidateMatcher.__new__(CandidateMatcher)
+        matcher.blocking = BlockingIndex.from_blocks(self, blocking_keys, self.blocks)
+        matcher.scorer = FuzzyScorer.from_columns(
+            self,
+            {field: self.columns[TEXT_KEY_COLUMNS[field]] for field in TEXT_FIELDS},
+            {field: self.columns[field] for field in EXACT_FIELDS},
+        )
+        return matcher
+
+
+# Per-process snapshot last mapped by _run_task, and its matcher per blocking strategy
+_worker_snapshot: Optional[SnapshotRecords] = None
+_worker_matchers: Dict[tuple, CandidateMatcher] = {}
+
+
+def _run_task(snapshot_path: str, task: Callable, blocking_keys: List[str], args: tuple):
+    global _worker_snapshot
+    if _worker_snapshot is None or _worker_snapshot.path != snapshot_path:
+        _worker_snapshot = SnapshotRecords(snapshot_path)
+        _worker_matchers.clear()
+    key = tuple(blocking_keys)
+    matcher = _worker_matchers.get(key)
+    if matcher is None:
+        matcher = _worker_matchers[key] = _worker_snapshot.matcher(blocking_keys)
+    return task(matcher, *args)
+
+
+def _run_partitions(pool: ProcessPoolExecutor, snapshot_path: str, task: Callable, blocking_keys: List[str],
+                    partitions: Sequence[tuple]) -> List:
+    futures = [pool.submit(_run_task, snapshot_path, task, blocking_keys, args) for args in partitions]
+    return [future.result() for future in futures]
+
+
+class MatchPool:
+    """
+    Long-lived worker pool, plus the column snapshot published for the current
+    version of the patient snapshot.
+    """
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._workers = 0
+        self._published: Optional[Tuple[int, str]] = None  # (snapshot version, directory)
+        self._lock = threading.Lock()
+
+    def _executor(self, workers: int) -> ProcessPoolExecutor:
+        if self._pool is None or workers > self._workers:
+            self._shutdown_pool()
+            # spawn: forking a threaded server process is not safe
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            self._workers = workers
+            logger.info(f"Started match pool of {workers} processes")
+        return self._pool
+
+    def _snapshot(self, existing: Sequence, version: int) -> str:
+        if self._published is not None and self._published[0] == version:
+            return self._published[1]
+        directory = publish_snapshot(existing)
+        previous, self._published = self._published, (version, directory)
+        if previous is not None:
+            # Workers still mapping the old files keep them until they switch
+            shutil.rmtree(previous[1], ignore_errors=True)
+        return directory
+
+    def map(self, existing: Sequence, blocking_keys: List[str], task: Callable, partitions: Sequence[tuple],
+            workers: int, version: Optional[int] = None) -> List:
+        """
+        ``version`` is the patient snapshot version of ``existing``, or None when
+        ``existing`` is not the patient snapshot.
+        """
+        # One run at a time: a newer snapshot must not be published under a running one
+        with self._lock:
+            pool = self._executor(max(1, workers))
+            snapshot_path = publish_snapshot(existing) if version is None else self._snapshot(existing, version)
+            try:
+                return _run_partitions(pool, snapshot_path, task, blocking_keys, partitions)
+            except BrokenProcessPool:
+                # A worker died; start a new pool on the next run
+                self._shutdown_pool()
+                raise
+            finally:
+                if version is None:
+                    shutil.rmtree(snapshot_path, ignore_errors=True)
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._workers = 0
+
+    def close(self):
+        with self._lock:
+            self._shutdown_pool()
+            if self._published is not None:
+                shutil.rmtree(self._published[1], ignore_errors=True)
+                self._published = None
+
+
+match_pool = MatchPool()
+# Worker processes outside the API (job workers, scripts) have no shutdown hook
+atexit.register(match_pool.close)
+
+
+def map_partitions(existing: Sequence, blocking_keys: List[str], task: Callable,
+                   partitions: Sequence[tuple], workers: int = MATCH_PARALLEL_WORKERS) -> List:
+    """
+    Runs ``task(matcher, *args)`` for every ``args`` in ``partitions`` on match_pool
+    workers, where ``matcher`` is the worker's CandidateMatcher over ``existing``.
+    ``task`` must be a module-level function. Results are returned in partition order.
+    """
+    if not partitions:
+        return []
+    version = patient_snapshot.version_of(existing)
+    return match_pool.map(existing, blocking_keys, task, partitions, min(workers, len(partitions)), version)
+
+
+def _match_partition(matcher: CandidateMatcher, rows: List[tuple], threshold: float,
+                     candidates: Optional[List[List[int]]]) -> List[FuzzyResult]:
+    return matcher.match([MatchRecord(row) for row in rows], threshold, candidates)
+
+
+def parallel_match_candidates(existing: Sequence, incoming: Sequence, blocking_keys: List[str],
+                              threshold: float, workers: int = MATCH_PARALLEL_WORKERS,
+                              candidates: Optional[Sequence[Sequence[int]]] = None) -> List[FuzzyResult]:
+    """
+    Same result as ``CandidateMatcher(existing, blocking_keys).match(incoming, threshold, candidates)``,
+    computed by ``workers`` processes.
+    """
+    if not incoming:
+        return []
+
+    rows = [MatchRecord.values(record) for record in incoming]
+    workers = max(1, min(workers, len(rows)))
+    size = -(-len(rows) // (workers * _PARTITIONS_PER_WORKER))
+    partitions = [
+        (rows[start:start + size], threshold, None if candidates is None else list(candidates[start:start + size]))
+        for start in range(0, len(rows), size)
+    ]
+
+    results = [
+        result
+        for partition in map_partitions(existing, blocking_keys, _match_partition, partitions, workers)
+        for result in partition
+    ]
+    logger.info(f"Matched {len(rows)} records against {len(existing)} patients with {workers} processes")
+    return results
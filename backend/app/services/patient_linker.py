@@ -0,0 +1,259 @@
+"""
+Patient Linker
+
+Finds duplicates that already exist inside the ``patients`` table and groups them
+into clusters:
+
+1. Candidate pairs come from the blocking index (app.utils.blocking) over the patient
+   snapshot. Blocks larger than LINK_MAX_BLOCK_SIZE (very common surnames, placeholder
+   birth dates) are skipped: they add quadratic work and almost no real links.
+2. Pairs are scored with the weighted fuzzy scorer and its branch-and-bound pruning
+   (app.utils.batch_matcher); pairs reaching the threshold are linked. Large runs are
+   split over the process pool of app.services.parallel_matcher.
+3. Patients whose stored embeddings are near-identical (LINK_EMBEDDING_THRESHOLD) are
+   linked through the vector index as well.
+4. Links are merged transitively with union-find. A patient's cluster_id is the lowest
+   patient id in its cluster; only rows whose cluster changed are written, with
+   ``updated_at`` kept as it was, since a new cluster id is not an edit.
+
+Runs are incremental: only patients with ``updated_at`` at or after the previous
+run's watermark are compared (against the whole table), and existing clusters are
+kept and merged into. A full run recomputes every cluster from scratch, which is also
+how links that no longer hold get split.
+
+Functions:
+- link_patients: Runs one linking pass and records it in patient_link_runs.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Session
+
+from app.config import (
+    LINK_EMBEDDING_NEIGHBOURS,
+    LINK_EMBEDDING_THRESHOLD,
+    LINK_MAX_BLOCK_SIZE,
+    LINK_WORKERS,
+    MATCH_BLOCKING_KEYS,
+    PATIENT_SNAPSHOT_OVERLAP_SECONDS,
+)
+from app.services.embedding_service import search_similar
+from app.services.parallel_matcher import CandidateMatcher, map_partitions
+from app.utils.blocking import resolve_blocking_keys
+from app.utils.embedding_store import parse_embedding
+from database.models import Patient, PatientLinkRun
+from database.patient_snapshot import patient_snapshot
+
+logger = logging.getLogger(__name__)
+
+LINK_THRESHOLD = 90
+
+# Changed patients per pool task
+_PARTITION_SIZE = 2000
+# Patients per embedding query / cluster update statement
+_EMBEDDING_CHUNK = 1000
+_WRITE_CHUNK = 10000
+
+
+class UnionFind:
+    """
+    Disjoint sets over patient ids; the root of a set is always its lowest id.
+    """
+
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, item: int) -> int:
+        self.parent.setdefault(item, item)
+        while self.parent[item] != item:
+            # Path halving
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _candidate_positions(matcher: CandidateMatcher, record, max_block: int, oversized: Set[str]) -> Set[int]:
+    positions = set()
+    for block in matcher.blocking.block_keys(record):
+        members = matcher.blocking.blocks.get(block, ())
+        if len(members) > max_block:
+            oversized.add(block)
+        else:
+            positions.update(members)
+    return positions
+
+
+def _link_partition(matcher: CandidateMatcher, positions: Sequence[int], threshold: float,
+                    max_block: int) -> Tuple[List[Tuple[int, int]], int, Set[str]]:
+    """
+    Fuzzy links of the patients at ``positions`` against all stored patients, as
+    position pairs, plus the number of pairs compared and the blocks skipped.
+    """
+    pairs, compared, oversized = [], 0, set()
+    patients = matcher.blocking.patients
+    for i in positions:
+        candidates = sorted(_candidate_positions(matcher, patients[i], max_block, oversized) - {i})
+        compared += len(candidates)
+        pairs.extend((i, j) for j, _ in matcher.scorer.matches_above(patients[i], threshold, candidates))
+    return pairs, compared, oversized
+
+
+def _fuzzy_links(records: Sequence, positions: List[int], keys: List[str], threshold: float,
+                 max_block: int, workers: int) -> Tuple[Set[Tuple[int, int]], int, Set[str]]:
+    partitions = [
+        (positions[start:start + _PARTITION_SIZE], threshold, max_block)
+        for start in range(0, len(positions), _PARTITION_SIZE)
+    ]
+    if workers > 1 and len(partitions) > 1:
+        results = map_partitions(records, keys, _link_partition, partitions, workers)
+    else:
+        matcher = CandidateMatcher(records, keys)
+        results = [_link_partition(matcher, *partition) for partition in partitions]
+
+    links, compared, oversized = set(), 0, set()
+    for pairs, partition_compared, partition_oversized in results:
+        # Both sides of a pair may have changed; keep each pair once
+        links.update((min(a, b), max(a, b)) for a, b in pairs)
+        compared += partition_compared
+        oversized |= partition_oversized
+    return {(records[a].id, records[b].id) for a, b in links}, compared, oversized
+
+
+def _embedding_links(db: Session, patient_ids: List[int], threshold: float, neighbours: int) -> Set[Tuple[int, int]]:
+    links = set()
+    for start in range(0, len(patient_ids), _EMBEDDING_CHUNK):
+        rows = (
+            db.query(Patient.id, Patient.embedding)
+            .filter(Patient.id.in_(patient_ids[start:start + _EMBEDDING_CHUNK]), Patient.embedding.isnot(None))
+            .all()
+        )
+        if not rows:
+            continue
+        vectors = np.array([parse_embedding(row.embedding) for row in rows], dtype=np.float32)
+        top_ids, top_scores = search_similar(db, vectors, k=neighbours + 1)
+        for row, patient in enumerate(rows):
+            for other, score in zip(top_ids[row], top_scores[row]):
+                if other >= 0 and other != patient.id and score >= threshold:
+                    links.add((min(patient.id, int(other)), max(patient.id, int(other))))
+    return links
+
+
+def _cluster_updates(records: Sequence, links: Iterable[Tuple[int, int]], full: bool,
+                     cluster_ids: Optional[Dict[int, int]] = None) -> List[dict]:
+    """
+    Rows whose cluster changed. ``cluster_ids`` are the stored cluster ids by patient
+    id; without it the records' own cluster_id is used.
+    """
+    if cluster_ids is None:
+        cluster_ids = {record.id: record.cluster_id for record in records if record.cluster_id is not None}
+    clusters = UnionFind()
+    if not full:
+        for patient_id, cluster_id in cluster_ids.items():
+            clusters.union(patient_id, cluster_id)
+    for a, b in links:
+        clusters.union(a, b)
+
+    # Label each cluster with its lowest live patient id
+    labels: Dict[int, int] = {}
+    for record in records:
+        root = clusters.find(record.id)
+        labels[root] = min(labels.get(root, record.id), record.id)
+    return [
+        {"id": record.id, "cluster_id": labels[clusters.find(record.id)]}
+        for record in records
+        if cluster_ids.get(record.id) != labels[clusters.find(record.id)]
+    ]
+
+
+def _stored_cluster_ids(db: Session) -> Dict[int, int]:
+    # Read from the table: cluster writes keep updated_at, so the snapshot does not see them
+    return dict(db.query(Patient.id, Patient.cluster_id).filter(Patient.cluster_id.isnot(None)).all())
+
+
+def _cluster_id_update():
+    # Core UPDATE that sets updated_at to itself, so the onupdate default does not fire
+    # and relinking does not mark rows changed for the next incremental run
+    table = Patient.__table__
+    return (
+        table.update()
+        .where(table.c.id == bindparam("patient_id"))
+        .values(cluster_id=bindparam("new_cluster_id"), updated_at=table.c.updated_at)
+    )
+
+
+def _last_watermark(db: Session) -> Optional[datetime]:
+    run = (
+        db.query(PatientLinkRun)
+        .filter(PatientLinkRun.finished_at.isnot(None))
+        .order_by(PatientLinkRun.id.desc())
+        .first()
+    )
+    return run.watermark if run else None
+
+
+def link_patients(db: Session, full: bool = False, threshold: float = LINK_THRESHOLD,
+                  blocking_keys: Optional[List[str]] = None, max_block: int = LINK_MAX_BLOCK_SIZE,
+                  use_embeddings: bool = True, workers: int = LINK_WORKERS) -> dict:
+    started = time.perf_counter()
+    keys = resolve_blocking_keys(MATCH_BLOCKING_KEYS if blocking_keys is None else blocking_keys)
+    if not keys:
+        raise ValueError("Linking needs at least one blocking key; a full pairwise scan does not scale")
+
+    run = PatientLinkRun(started_at=datetime.utcnow())
+    records = patient_snapshot.records(db)
+
+    since = None if full else _last_watermark(db)
+    full = since is None
+    if full:
+        positions = list(range(len(records)))
+    else:
+        since -= timedelta(seconds=PATIENT_SNAPSHOT_OVERLAP_SECONDS)
+        positions = [i for i, r in enumerate(records) if r.updated_at and r.updated_at >= since]
+
+    links, compared, oversized = _fuzzy_links(records, positions, keys, threshold, max_block, workers)
+    fuzzy_links = len(links)
+    if use_embeddings and positions:
+        links |= _embedding_links(db, [records[i].id for i in positions], LINK_EMBEDDING_THRESHOLD, LINK_EMBEDDING_NEIGHBOURS)
+
+    updates = _cluster_updates(records, links, full, _stored_cluster_ids(db))
+    statement = _cluster_id_update()
+    for start in range(0, len(updates), _WRITE_CHUNK):
+        db.execute(statement, [
+            {"patient_id": update["id"], "new_cluster_id": update["cluster_id"]}
+            for update in updates[start:start + _WRITE_CHUNK]
+        ])
+        db.commit()
+
+    run.finished_at = datetime.utcnow()
+    # No timestamped rows yet: leave the watermark empty so the next run is full again
+    run.watermark = patient_snapshot.synced_until if patient_snapshot.synced_until != datetime.min else None
+    run.full_run = full
+    run.patients_processed = len(positions)
+    run.pairs_found = len(links)
+    run.clusters_updated = len(updates)
+    db.add(run)
+    db.commit()
+
+    summary = {
+        "full_run": full,
+        "patients": len(records),
+        "patients_processed": len(positions),
+        "pairs_compared": compared,
+        "fuzzy_links": fuzzy_links,
+        "embedding_links": len(links) - fuzzy_links,
+        "rows_updated": len(updates),
+        "oversized_blocks_skipped": len(oversized),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Patient linking finished: {summary}")
+    return summary
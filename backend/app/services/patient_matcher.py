@@ -10,18 +10,39 @@ Functions:
 - patient_to_string: Converts a PatientData object to a string for matching.
 - parse_incoming_json: Cleans and parses raw JSON into PatientData objects.
 - process_fuzzy_match: Matches incoming patients to existing ones using fuzzy and embedding methods.
+  Records carrying a known SSN/MRN/insurance number resolve through the identifier index first.
+  Fuzzy scoring only runs against candidates that share a block with the incoming record
+  (see app.utils.blocking). Records that miss the fuzzy threshold are embedded in one
+  batched pass before the similarity stage. Candidates are scored as a matrix by the
+  batch fuzzy scorer (app.utils.batch_matcher). All resulting updates are written in a
+  single transaction through PatientWriteBatch. Large batches score their fuzzy stage
+  in a process pool (app.services.parallel_matcher); `parallel` forces the mode.
+  With MATCH_CANDIDATE_SOURCE=sql the candidates come from an indexed pg_trgm query
+  (find_similar_patient_ids) instead of the in-memory blocking index.
 - find_embedding_match: Finds the best embedding-based match for a patient.
 
+Stored patients are read from the in-memory patient snapshot (database.patient_snapshot),
+not loaded as ORM objects on every call.
+
+Embedding similarity is answered by app.services.embedding_service: the on-disk ANN
+index for large tables, or the exact in-memory embedding store for small ones.
+
 Dependencies:
 - Requires database access and utility functions for string matching and embeddings.
 """
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime
 from database.schemas import PatientData
-from database.patient_repository import get_all_patients, update_patient, insert_unmatched
-from app.utils.string_matcher import is_fuzzy_match
-from app.utils.embeddings_utils import get_openai_embedding, cosine_similarity
+from database.patient_repository import (
+    find_similar_patient_ids, get_patient_record, get_patient_records, PatientWriteBatch
+)
+from app.config import MATCH_BLOCKING_KEYS, MATCH_CANDIDATE_SOURCE
+from app.utils.blocking import resolve_blocking_keys
+from app.utils.identifier_index import IdentifierIndex
+from app.services.parallel_matcher import CandidateMatcher, parallel_match_candidates, use_parallel_matching
+from app.utils.embeddings_utils import get_openai_embedding, get_openai_embeddings
+from app.services.embedding_service import search_similar
 
 FUZZY_THRESHOLD = 90
 EMBEDDING_THRESHOLD = 0.85
@@ -56,39 +77,99 @@ def parse_incoming_json(raw_json: List[dict]) -> List[PatientData]:
             print(f"Skipping invalid record: {e}")
     return cleaned_patients
 
-def process_fuzzy_match(patients_json: List[Dict], db) -> Dict:
-    existing_patients = get_all_patients(db)
-    matched_patients = []
-    unmatched_patients = []
-    new_patients = []
+def incoming_update_data(incoming: PatientData) -> dict:
+    incoming_data = incoming.dict()
+    if isinstance(incoming_data.get("dob"), str):
+        try:
+            incoming_data["dob"] = datetime.strptime(incoming_data["dob"], "%Y-%m-%d").date()
+        except ValueError:
+            incoming_data["dob"] = None
+    return incoming_data
+
+def updated_view(patient, changes: dict) -> dict:
+    """
+    patient.to_dict() as it will read once the queued changes are written.
+    """
+    view = patient.to_dict()
+    for column, value in changes.items():
+        if column in view:
+            view[column] = value.isoformat() if hasattr(value, "isoformat") else value
+    return view
+
+def sql_candidate_positions(db, existing_patients: List, incoming: List[PatientData]) -> List[List[int]]:
+    """
+    Candidate positions per incoming record from the trigram/B-tree indexed query,
+    in stored order so tie-breaking matches the in-memory path.
+    """
+    position_by_id = {p.id: position for position, p in enumerate(existing_patients)}
+    return [
+        sorted(position_by_id[i] for i in find_similar_patient_ids(db, record) if i in position_by_id)
+        for record in incoming
+    ]
 
-    for entry in patients_json:
-        incoming = entry
-        incoming_str = patient_to_string(incoming)
+def process_fuzzy_match(patients_json: List[Dict], db, blocking_keys: Optional[List[str]] = None,
+                        parallel: Optional[bool] = None, with_outcomes: bool = False) -> Dict:
+    existing_patients = get_patient_records(db)
+    patients_by_id = {p.id: p for p in existing_patients}
+    identifiers = IdentifierIndex(existing_patients)
+    keys = resolve_blocking_keys(MATCH_BLOCKING_KEYS if blocking_keys is None else blocking_keys)
+    writes = PatientWriteBatch(db)
+    comparisons = 0
+    identifier_matches = 0
+    identifier_conflicts = 0
+    outcomes = [None] * len(patients_json)
+    pending = []
 
-        best_match = None
-        best_score = 0
-        method = None
+    # Fuzzy scoring only reads the stored patients, so it runs up front for every
+    # record without an identifier hit, in a process pool for large batches
+    hits = [identifiers.lookup(incoming) for incoming in patients_json]
+    fuzzy_positions = [position for position, hit in enumerate(hits) if not hit]
+    fuzzy_incoming = [patients_json[position] for position in fuzzy_positions]
+    candidates = sql_candidate_positions(db, existing_patients, fuzzy_incoming) if MATCH_CANDIDATE_SOURCE == "sql" else None
+    if use_parallel_matching(len(fuzzy_incoming), parallel):
+        fuzzy_matches = parallel_match_candidates(
+            existing_patients, fuzzy_incoming, keys, FUZZY_THRESHOLD, candidates=candidates
+        )
+    else:
+        fuzzy_matches = CandidateMatcher(existing_patients, keys).match(fuzzy_incoming, FUZZY_THRESHOLD, candidates)
+    fuzzy_results = dict(zip(fuzzy_positions, fuzzy_matches))
+
+    for position, incoming in enumerate(patients_json):
+        hit = hits[position]
+        if hit and hit.conflict:
+            identifier_conflicts += 1
+            outcomes[position] = ("unmatched", {
+                **incoming.dict(),
+                "reason": f"conflicting {hit.field}",
+                "conflicting_patient_id": hit.patient.id,
+                "name_score": hit.name_score,
+                "review_status": "Human Review"
+            })
+            continue
+        if hit:
+            identifier_matches += 1
+            changes = writes.update(hit.patient, incoming_update_data(incoming))
+            outcomes[position] = ("matched", {
+                "incoming": incoming.dict(),
+                "matched_with": updated_view(hit.patient, changes),
+                "method": f"identifier:{hit.field}",
+                "score": 100,
+                "status": "updated",
+                "review_status": "Confirmed"
+            })
+            continue
 
-        for db_patient in existing_patients:
-            is_match, score = is_fuzzy_match(db_patient, incoming)
-            if is_match and score > best_score:
-                best_score = score
-                best_match = db_patient
-                method = "fuzzy"
+        best_position, best_score, compared = fuzzy_results[position]
+        comparisons += compared
+        best_match = existing_patients[best_position] if best_position is not None else None
+        method = "fuzzy"
 
         if best_score >= FUZZY_THRESHOLD:
-            incoming_data = incoming.dict()
-            if isinstance(incoming_data.get("dob"), str):
-                try:
-                    incoming_data["dob"] = datetime.strptime(incoming_data["dob"], "%Y-%m-%d").date()
-                except ValueError:
-                    incoming_data["dob"] = None
-
-            update_patient(db, best_match, incoming_data)
-            matched_patients.append({
+            incoming_data = incoming_update_data(incoming)
+            changes = writes.update(best_match, incoming_data)
+            outcomes[position] = ("matched", {
                 "incoming": incoming.dict(),
-                "matched_with": best_match.to_dict(),
+                "matched_with": updated_view(best_match, changes),
                 "method": method,
                 "score": best_score,
                 "status": "updated",
@@ -96,53 +177,52 @@ def process_fuzzy_match(patients_json: List[Dict], db) -> Dict:
             })
             continue
 
-        incoming_embedding = get_openai_embedding(incoming_str)
+        pending.append((position, incoming))
+
+    # Records that missed the fuzzy threshold are embedded together in batches,
+    # then matched with one similarity search
+    if pending:
+        incoming_embeddings = get_openai_embeddings([patient_to_string(incoming) for _, incoming in pending])
+        top_ids, top_scores = search_similar(db, incoming_embeddings, k=1)
+
+    for row, (position, incoming) in enumerate(pending):
         emb_best = None
         emb_score = 0
 
-        for db_patient in existing_patients:
-            if db_patient.embedding:
-                # Parse string embedding to list if needed
-                embedding = db_patient.embedding
-                if isinstance(embedding, str):
-                    try:
-                        embedding = ast.literal_eval(embedding)
-                    except Exception:
-                        continue  # skip if parsing fails
-                score = cosine_similarity(incoming_embedding, embedding)
-                if score > emb_score:
-                    emb_score = score
-                    emb_best = db_patient
+        if top_ids.shape[1] and int(top_ids[row, 0]) in patients_by_id:
+            emb_score = float(top_scores[row, 0])
+            emb_best = patients_by_id[int(top_ids[row, 0])]
 
         if emb_score >= EMBEDDING_THRESHOLD:
-            incoming_data = incoming.dict()
-            if isinstance(incoming_data.get("dob"), str):
-                try:
-                    incoming_data["dob"] = datetime.strptime(incoming_data["dob"], "%Y-%m-%d").date()
-                except ValueError:
-                    incoming_data["dob"] = None
-
-            update_patient(db, emb_best, incoming_data)
-            matched_patients.append({
+            incoming_data = incoming_update_data(incoming)
+            changes = writes.update(emb_best, incoming_data)
+            outcomes[position] = ("matched", {
                 "incoming": incoming.dict(),
-                "matched_with": emb_best.to_dict(),
+                "matched_with": updated_view(emb_best, changes),
                 "method": "embedding",
                 "score": round(emb_score * 100, 2),
                 "status": "updated",
                 "review_status": "Confirmed" if emb_score >= 0.95 else "Human Review"
             })
         elif all([incoming.name, incoming.dob, incoming.ssn, incoming.insurance_number]):
-            new_patients.append({
+            outcomes[position] = ("new", {
                 **incoming.dict(),
                 "review_status": "Human Review"
             })
         else:
-            unmatched_patients.append({
+            outcomes[position] = ("unmatched", {
                 **incoming.dict(),
                 "reason": "no similar match found"
             })
 
-    return {
+    # All updates for the batch are written in one transaction
+    writes.flush()
+
+    matched_patients = [record for bucket, record in outcomes if bucket == "matched"]
+    unmatched_patients = [record for bucket, record in outcomes if bucket == "unmatched"]
+    new_patients = [record for bucket, record in outcomes if bucket == "new"]
+
+    result = {
         "matched_patients": matched_patients,
         "unmatched_patients": unmatched_patients,
         "new_patients": new_patients,
@@ -151,23 +231,29 @@ def process_fuzzy_match(patients_json: List[Dict], db) -> Dict:
             "matched": len(matched_patients),
             "unmatched": len(unmatched_patients),
             "new": len(new_patients),
-            "review_required": len([m for m in matched_patients if m["review_status"] == "Human Review"]) + len(new_patients),
-            "confirmed": len([m for m in matched_patients if m["review_status"] == "Confirmed"])
+            "review_required": len([m for m in matched_patients if m["review_status"] == "Human Review"]) + len(new_patients) + identifier_conflicts,
+            "confirmed": len([m for m in matched_patients if m["review_status"] == "Confirmed"]),
+            "identifier_matches": identifier_matches,
+            "identifier_conflicts": identifier_conflicts,
+            "blocking_keys": keys,
+            "candidate_source": MATCH_CANDIDATE_SOURCE,
+            "comparisons": comparisons,
+            "comparisons_pruned": len(patients_json) * len(existing_patients) - comparisons
         }
     }
+    if with_outcomes:
+        # Per-input results in input order, for callers that track each record
+        result["outcomes"] = [{"status": bucket, "record": record} for bucket, record in outcomes]
+    return result
 
 def find_embedding_match(incoming, db, similarity_threshold=0.85):
     incoming_text = patient_to_string(incoming)
     incoming_embedding = get_openai_embedding(incoming_text)
-    existing_patients = get_all_patients(db)
-    best_match = None
-    best_score = 0
-
-    for patient in existing_patients:
-        if patient.embedding:
-            score = cosine_similarity(incoming_embedding, patient.embedding)
-            if score > similarity_threshold and score > best_score:
-                best_match = patient
-                best_score = score
-
-    return best_match, best_score
\ No newline at end of file
+    top_ids, top_scores = search_similar(db, incoming_embedding, k=1)
+
+    if top_ids.size and top_scores[0, 0] > similarity_threshold:
+        best_match = get_patient_record(db, int(top_ids[0, 0]))
+        if best_match:
+            return best_match, float(top_scores[0, 0])
+
+    return None, 0
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+Page-parallel PDF OCR
+
+Long scanned PDFs are split into ranges of OCR_PDF_PAGES_PER_RANGE pages (pypdf).
+Each range is uploaded as its own small PDF and OCR'd through the OCR router, with
+up to OCR_PDF_MAX_CONCURRENT_RANGES ranges in flight, so a 60-page record becomes
+several short Textract jobs running side by side instead of one long one. Range
+PDFs are only needed while their range is OCR'd and are deleted right after.
+
+Pages are yielded in page order as soon as every earlier range has finished, so
+consumers can start on page 1 while later ranges are still being processed. Range
+PDFs are built one at a time and only while a range slot is free, which keeps
+memory bounded by the number of ranges in flight.
+
+Block ``Page`` numbers are rewritten to absolute page numbers of the original
+document. Engines that do not report pages have their text attributed to the first
+page of the range.
+
+Functions:
+- pdf_page_count: Number of pages of a PDF.
+- page_ranges: Splits a page count into (start, end) ranges.
+- ocr_pdf_pages: Async generator of OCR'd pages in page order.
+- merge_pages: Engine name and blocks of a whole document from its pages.
+"""
+
+import asyncio
+import io
+import logging
+import threading
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import IO, AsyncIterator, Callable, List, Optional, Tuple
+
+from app.config import OCR_PDF_MAX_CONCURRENT_RANGES, OCR_PDF_PAGES_PER_RANGE
+from app.services.ocr_engines import OcrDocument, OcrRouter, ocr_router
+from app.services.textract_poller import blocks_to_text
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.errors import PdfReadError
+except ImportError:  # pragma: no cover - exercised only without pypdf
+    PdfReader = PdfWriter = None
+
+    class PdfReadError(Exception):
+        pass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PdfPage:
+    number: int  # 1-based page number in the original document
+    text: str
+    blocks: List[dict] = field(default_factory=list)
+    engine: Optional[str] = None  # None when the page's range could not be OCR'd
+
+
+def page_parallel_available() -> bool:
+    return PdfReader is not None
+
+
+def pdf_page_count(fileobj: IO[bytes]) -> int:
+    fileobj.seek(0)
+    try:
+        return len(PdfReader(fileobj).pages)
+    finally:
+        fileobj.seek(0)
+
+
+def page_ranges(page_count: int, pages_per_range: int) -> List[Tuple[int, int]]:
+    """
+    Zero-based, end-exclusive page ranges covering ``page_count`` pages.
+    """
+    size = max(1, pages_per_range)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+class _RangeWriter:
+    """
+    Builds the PDF of one page range from a shared reader; pypdf readers are not
+    thread-safe, so ranges are written one at a time.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._lock = threading.Lock()
+
+    def write(self, start: int, end: int) -> bytes:
+        with self._lock:
+            writer = PdfWriter()
+            for index in range(start, end):
+                writer.add_page(self.reader.pages[index])
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            return buffer.getvalue()
+
+
+def _split_pages(blocks: List[dict], start: int, end: int) -> List[List[dict]]:
+    pages = [[] for _ in range(end - start)]
+    for block in blocks:
+        relative = block.get("Page", 1) - 1
+        index = relative if 0 <= relative < len(pages) else 0
+        pages[index].append({**block, "Page": start + index + 1})
+    return pages
+
+
+async def ocr_pdf_pages(fileobj: IO[bytes], key_prefix: str, upload: Callable[[IO[bytes], str], str],
+                        delete: Callable[[str], None], executor: Optional[Executor] = None,
+                        router: Optional[OcrRouter] = None, pages_per_range: Optional[int] = None,
+                        max_concurrent: Optional[int] = None) -> AsyncIterator[PdfPage]:
+    """
+    OCRs the PDF in ``fileobj`` range by range and yields its pages in order.
+    ``upload(fileobj, name)`` stores one range PDF and returns its S3 path; ranges
+    are named ``{key_prefix}.p{first}-{last}.pdf`` and removed with
+    ``delete(s3_path)`` once OCR'd. Blocking work (parsing, splitting, uploading,
+    deleting) runs on ``executor``. A PDF without pages raises ValueError.
+    """
+    if not page_parallel_available():
+        raise RuntimeError("Page-parallel OCR needs pypdf")
+    router = router or ocr_router
+    pages_per_range = pages_per_range or OCR_PDF_PAGES_PER_RANGE
+    max_concurrent = max_concurrent or OCR_PDF_MAX_CONCURRENT_RANGES
+    loop = asyncio.get_running_loop()
+
+    fileobj.seek(0)
+    reader = await loop.run_in_executor(executor, PdfReader, fileobj)
+    if not len(reader.pages):
+        raise ValueError("PDF has no pages")
+    ranges = page_ranges(len(reader.pages), pages_per_range)
+    writer = _RangeWriter(reader)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    logger.info(f"OCR of {len(reader.pages)} pages in {len(ranges)} ranges ({max_concurrent} at a time)")
+
+    async def _delete_range(s3_path: str):
+        try:
+            await loop.run_in_executor(executor, delete, s3_path)
+        except Exception as e:
+            logger.warning(f"Could not delete range PDF {s3_path}: {e}")
+
+    async def process(start: int, end: int) -> List[PdfPage]:
+        async with semaphore:
+            data = await loop.run_in_executor(executor, writer.write, start, end)
+            name = f"{key_prefix}.p{start + 1}-{end}.pdf"
+            s3_path = await loop.run_in_executor(executor, upload, io.BytesIO(data), name)
+            try:
+                engine, blocks = await router.extract(OcrDocument(s3_path, "pdf", len(data), io.BytesIO(data)))
+            finally:
+                await _delete_range(s3_path)
+        if blocks is None:
+            return [PdfPage(number, "") for number in range(start + 1, end + 1)]
+        return [
+            PdfPage(start + index + 1, blocks_to_text(page_blocks), page_blocks, engine)
+            for index, page_blocks in enumerate(_split_pages(blocks, start, end))
+        ]
+
+    tasks = [asyncio.ensure_future(process(start, end)) for start, end in ranges]
+    try:
+        for task in tasks:
+            for page in await task:
+                yield page
+    finally:
+        # Consumer stopped early or a range raised: do not leave ranges running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def merge_pages(pages: List[PdfPage]) -> Tuple[Optional[str], Optional[List[dict]]]:
+    """
+    (engine names, all blocks) of a document. Blocks are None if any range failed,
+    so partial results are not cached as complete.
+    """
+    engines = sorted({page.engine for page in pages if page.engine})
+    engine = ",".join(engines) or None
+    if any(page.engine is None for page in pages):
+        return engine, None
+    return engine, [block for page in pages for block in page.blocks]
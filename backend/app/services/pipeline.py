@@ -0,0 +1,239 @@
+"""
+Staged Pipeline
+
+Runs items through a chain of async stages connected by bounded queues. Each stage
+has its own worker count (its concurrency limit) and reads from a queue of at most
+``queue_size`` items; when a stage falls behind, its queue fills up and the stage in
+front of it blocks on put, all the way back to the input. Inputs are pulled lazily,
+so a folder of thousands of documents never has more than the queued and in-flight
+items open at once.
+
+A batch stage collects up to that many items (waiting at most
+``batch_wait`` seconds after the first one) and hands them to its handler together.
+
+An item whose handler raises is marked failed with the stage and error and is passed
+through the remaining stages untouched, so every input comes out exactly once.
+
+Functions:
+- Pipeline.run: Async generator of finished items, in completion order.
+- Pipeline.stats: Per-stage throughput, latency and queue depth.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+from app.config import PIPELINE_QUEUE_SIZE
+
+# End of input, forwarded from stage to stage once all of a stage's workers are done
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    # item -> result, or for batch stages [item, ...] -> [result or Exception, ...]
+    handler: Callable[[Any], Awaitable[Any]]
+    concurrency: int = 1
+    queue_size: Optional[int] = None
+    batch: bool = False
+    batch_size: int = 1
+    batch_wait: float = 0.0
+
+
+@dataclass
+class PipelineItem:
+    index: int  # Position in the input
+    value: Any
+    error: Optional[str] = None
+    failed_stage: Optional[str] = None
+    # Seconds spent in each stage's handler
+    seconds: Dict[str, float] = field(default_factory=dict)
+
+
+class _StageStats:
+    __slots__ = ("processed", "failed", "skipped", "calls", "in_flight", "busy", "queue_max", "first_start", "last_end")
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0  # Items that failed earlier and were passed through
+        self.calls = 0  # Handler calls; one per batch in batch stages
+        self.in_flight = 0
+        self.busy = 0.0
+        self.queue_max = 0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+
+
+class Pipeline:
+    def __init__(self, stages: Sequence[Stage], queue_size: Optional[int] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        self._stats = {stage.name: _StageStats() for stage in self.stages}
+        self._queues: List[asyncio.Queue] = []
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.inputs = 0
+        self.outputs = 0
+
+    async def _put(self, position: int, item):
+        queue = self._queues[position]
+        await queue.put(item)
+        if position < len(self.stages) and item is not _DONE:
+            stats = self._stats[self.stages[position].name]
+            stats.queue_max = max(stats.queue_max, queue.qsize())
+
+    async def _feed(self, inputs: Union[Iterable, AsyncIterable]):
+        try:
+            if hasattr(inputs, "__aiter__"):
+                async for value in inputs:
+                    await self._put(0, PipelineItem(self.inputs, value))
+                    self.inputs += 1
+            else:
+                for value in inputs:
+                    await self._put(0, PipelineItem(self.inputs, value))
+                    self.inputs += 1
+        finally:
+            await self._put(0, _DONE)
+
+    async def _next_batch(self, stage: Stage, queue: asyncio.Queue) -> List:
+        """
+        One item, plus whatever else arrives within batch_wait, up to batch_size.
+        A trailing _DONE is included so the worker can stop after the batch.
+        """
+        batch = [await queue.get()]
+        if batch[0] is _DONE or not stage.batch:
+            return batch
+        deadline = time.monotonic() + stage.batch_wait
+        while len(batch) < stage.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(queue.get(), remaining)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            batch.append(item)
+            if item is _DONE:
+                break
+        return batch
+
+    async def _handle(self, stage: Stage, items: List[PipelineItem]):
+        stats = self._stats[stage.name]
+        live = [item for item in items if item.error is None]
+        stats.skipped += len(items) - len(live)
+        if not live:
+            return
+
+        stats.in_flight += len(live)
+        stats.calls += 1
+        started = time.monotonic()
+        if stats.first_start is None:
+            stats.first_start = started
+        try:
+            if stage.batch:
+                results = await stage.handler([item.value for item in live])
+                if len(results) != len(live):
+                    raise RuntimeError(f"Stage {stage.name} returned {len(results)} results for {len(live)} items")
+            else:
+                results = [await stage.handler(live[0].value)]
+        except Exception as e:
+            results = [e] * len(live)
+        finally:
+            ended = time.monotonic()
+            stats.in_flight -= len(live)
+            stats.busy += ended - started
+            stats.last_end = ended
+
+        for item, result in zip(live, results):
+            item.seconds[stage.name] = round(ended - started, 4)
+            if isinstance(result, Exception):
+                item.error = str(result) or type(result).__name__
+                item.failed_stage = stage.name
+                stats.failed += 1
+            else:
+                item.value = result
+                stats.processed += 1
+
+    async def _worker(self, position: int, finished: List[int]):
+        stage = self.stages[position]
+        queue = self._queues[position]
+        while True:
+            batch = await self._next_batch(stage, queue)
+            done = batch[-1] is _DONE
+            items = batch[:-1] if done else batch
+            await self._handle(stage, items)
+            for item in items:
+                await self._put(position + 1, item)
+            if done:
+                # Let the stage's other workers see the end of input too
+                queue.put_nowait(_DONE)
+                finished[position] += 1
+                if finished[position] == max(1, stage.concurrency):
+                    await self._put(position + 1, _DONE)
+                return
+
+    async def run(self, inputs: Union[Iterable, AsyncIterable]):
+        """
+        Feeds ``inputs`` through the stages and yields each PipelineItem once its
+        last stage is done (or it failed). Closing the generator early cancels the
+        run.
+        """
+        self._queues = [asyncio.Queue(maxsize=stage.queue_size or self.queue_size) for stage in self.stages]
+        # Finished items; bounded too, so a slow consumer holds back the last stage
+        self._queues.append(asyncio.Queue(maxsize=self.queue_size))
+        self.started = time.monotonic()
+        finished = [0] * len(self.stages)
+
+        tasks = [asyncio.ensure_future(self._feed(inputs))]
+        for position, stage in enumerate(self.stages):
+            tasks.extend(asyncio.ensure_future(self._worker(position, finished)) for _ in range(max(1, stage.concurrency)))
+
+        output = self._queues[-1]
+        try:
+            while True:
+                item = await output.get()
+                if item is _DONE:
+                    break
+                self.outputs += 1
+                yield item
+            # Surface an error raised while reading the inputs
+            await tasks[0]
+        finally:
+            self.finished = time.monotonic()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        now = self.finished or time.monotonic()
+        elapsed = now - self.started if self.started else 0.0
+        stages = {}
+        for position, stage in enumerate(self.stages):
+            stats = self._stats[stage.name]
+            handled = stats.processed + stats.failed
+            active = (stats.last_end or now) - stats.first_start if stats.first_start else 0.0
+            stages[stage.name] = {
+                "concurrency": max(1, stage.concurrency),
+                "batch_size": stage.batch_size,
+                "processed": stats.processed,
+                "failed": stats.failed,
+                "skipped": stats.skipped,
+                "in_flight": stats.in_flight,
+                "queue_depth": self._queues[position].qsize() if self._queues else 0,
+                "queue_max_depth": stats.queue_max,
+                "queue_size": stage.queue_size or self.queue_size,
+                "busy_seconds": round(stats.busy, 3),
+                "avg_ms": round(stats.busy / stats.calls * 1000, 2) if stats.calls else 0.0,
+                # Items per second while the stage had work
+                "throughput": round(handled / active, 3) if active > 0 else None,
+            }
+        return {
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "seconds": round(elapsed, 3),
+            "throughput": round(self.outputs / elapsed, 3) if elapsed > 0 else None,
+            "stages": stages,
+        }
@@ -0,0 +1,140 @@
+"""
+Textract Poller
+
+Async driver for Textract's asynchronous text detection (StartDocumentTextDetection
+/ GetDocumentTextDetection). Any number of jobs can be awaited at once from the event
+loop; they share one limit on in-flight API calls so a large upload does not trip
+Textract's request rate limits.
+
+- Polling backs off adaptively: the first checks come quickly (short documents are
+  often done within a second or two), then the delay grows geometrically up to a cap.
+- Throttling responses are retried on the same backoff instead of failing the job.
+- Once a job succeeds, every result page is fetched by following NextToken, so long
+  PDFs are no longer cut off after the first page of blocks.
+- Each job has an overall deadline; past it TextractJobError is raised.
+
+boto3 clients are blocking, so each API call runs on an executor thread; no thread is
+held while a job is waiting between polls.
+
+Functions:
+- TextractPoller.start: Starts a text detection job for an S3 object.
+- TextractPoller.wait: Waits for a job and returns all of its blocks.
+- TextractPoller.extract_text: start + wait, returning the LINE text.
+- blocks_to_text: Joins the LINE blocks of a result into text.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+from concurrent.futures import Executor
+from functools import partial
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from app.config import (
+    TEXTRACT_JOB_TIMEOUT,
+    TEXTRACT_MAX_CONCURRENT_CALLS,
+    TEXTRACT_POLL_BACKOFF,
+    TEXTRACT_POLL_INITIAL_DELAY,
+    TEXTRACT_POLL_MAX_DELAY,
+)
+
+logger = logging.getLogger(__name__)
+
+_THROTTLING_CODES = {"ThrottlingException", "ProvisionedThroughputExceededException", "LimitExceededException"}
+
+
+class TextractJobError(Exception):
+    pass
+
+
+def blocks_to_text(blocks: List[Dict]) -> str:
+    return "\n".join(block["Text"] for block in blocks if block["BlockType"] == "LINE" and "Text" in block)
+
+
+class TextractPoller:
+    def __init__(self, client, executor: Optional[Executor] = None,
+                 max_concurrent_calls: int = TEXTRACT_MAX_CONCURRENT_CALLS,
+                 initial_delay: float = TEXTRACT_POLL_INITIAL_DELAY,
+                 max_delay: float = TEXTRACT_POLL_MAX_DELAY,
+                 backoff: float = TEXTRACT_POLL_BACKOFF,
+                 timeout: float = TEXTRACT_JOB_TIMEOUT):
+        self.client = client
+        self.executor = executor
+        self.max_concurrent_calls = max_concurrent_calls
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # One limit per event loop: asyncio primitives cannot be shared across loops
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent_calls)
+        return self._semaphores[loop]
+
+    async def _call(self, method: str, **kwargs) -> Dict:
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(getattr(self.client, method), **kwargs))
+
+    async def start(self, bucket: str, key: str) -> str:
+        response = await self._call(
+            "start_document_text_detection",
+            DocumentLocation={"S3Object": {"Bucket": bucket, "Name": key}},
+        )
+        return response["JobId"]
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> List[Dict]:
+        """
+        Polls until the job finishes, then returns the blocks of every result page.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        delay = self.initial_delay
+        polls = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TextractJobError(f"Textract job {job_id} did not finish within {timeout}s")
+            try:
+                result = await asyncio.wait_for(self._call("get_document_text_detection", JobId=job_id), remaining)
+            except asyncio.TimeoutError:
+                raise TextractJobError(f"Textract job {job_id} did not finish within {timeout}s")
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in _THROTTLING_CODES:
+                    raise
+                logger.warning(f"Textract throttled polling job {job_id}, backing off")
+                result = {"JobStatus": "IN_PROGRESS"}
+            polls += 1
+
+            status = result["JobStatus"]
+            if status in ("SUCCEEDED", "PARTIAL_SUCCESS"):
+                break
+            if status == "FAILED":
+                raise TextractJobError(f"Textract job {job_id} failed: {result.get('StatusMessage', 'unknown error')}")
+
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * self.backoff, self.max_delay)
+
+        blocks = list(result.get("Blocks", []))
+        pages = 1
+        # Result pages are chained by NextToken, so they are read one after another
+        while result.get("NextToken"):
+            if time.monotonic() >= deadline:
+                raise TextractJobError(f"Textract job {job_id} results not read within {timeout}s")
+            result = await self._call("get_document_text_detection", JobId=job_id, NextToken=result["NextToken"])
+            blocks.extend(result.get("Blocks", []))
+            pages += 1
+
+        logger.info(f"Textract job {job_id}: {status} after {polls} polls, {pages} result pages, {len(blocks)} blocks")
+        return blocks
+
+    async def extract_text(self, bucket: str, key: str, timeout: Optional[float] = None) -> str:
+        job_id = await self.start(bucket, key)
+        return blocks_to_text(await self.wait(job_id, timeout))
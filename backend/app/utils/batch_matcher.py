@@ -0,0 +1,270 @@
+"""
+Batch fuzzy scorer.
+
+Computes the weighted name/DOB/SSN/insurance/address/email/phone score of
+``is_fuzzy_match`` for N incoming records against M stored patients in one call.
+The four token-sort components are computed as whole matrices with
+``rapidfuzz.process.cdist`` (C++, multi-threaded), over match keys computed once per
+string instead of once per pair. Stored patients use the keys precomputed at write
+time (app.utils.match_keys) when present. Weights, rounding and the threshold semantics are
+exactly those of ``app.utils.string_matcher.is_fuzzy_match``.
+
+``best_matches`` scores branch-and-bound: the exact DOB/SSN/insurance points come
+first, then name, address, email and phone in order of weight. After each stage a
+candidate is dropped once the best score it could still reach misses the threshold
+or falls below what another candidate is already guaranteed, so most pairs never get
+their address, email and phone compared. The winner is the same as with full scoring.
+
+rapidfuzz is optional: without it the same matrices are filled with fuzzywuzzy.
+"""
+
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fuzzywuzzy import fuzz
+
+from app.config import FUZZY_SCORER_WORKERS
+from app.utils.string_matcher import (
+    NAME_WEIGHT,
+    DOB_POINTS,
+    SSN_POINTS,
+    INSURANCE_POINTS,
+    ADDRESS_WEIGHT,
+    EMAIL_WEIGHT,
+    PHONE_WEIGHT,
+    match_key,
+)
+from app.utils.match_keys import TEXT_KEY_COLUMNS
+
+try:
+    from rapidfuzz.distance import Indel
+    from rapidfuzz.process import cdist
+except ImportError:  # pragma: no cover - exercised only without rapidfuzz
+    cdist = None
+
+TEXT_FIELDS = ("name", "address", "email", "phone")
+EXACT_FIELDS = ("dob", "ssn", "insurance_number")
+
+# Fuzzy components in the order branch-and-bound evaluates them (heaviest first)
+FUZZY_STAGES = (
+    ("name", NAME_WEIGHT),
+    ("address", ADDRESS_WEIGHT),
+    ("email", EMAIL_WEIGHT),
+    ("phone", PHONE_WEIGHT),
+)
+PRUNING_STAGES = ("exact",) + tuple(field for field, _ in FUZZY_STAGES[:-1])
+
+# Slack on score bounds so float summation order can never prune a real winner
+_BOUND_EPSILON = 1e-6
+
+# Below this many pairs a thread pool costs more than it saves
+_PARALLEL_MIN_PAIRS = 10000
+
+
+def ratio_matrix(incoming_keys: Sequence[str], existing_keys: Sequence[str]) -> np.ndarray:
+    """
+    ``fuzz.ratio`` for every (incoming, existing) key pair, as a float64 matrix.
+    """
+    if not incoming_keys or not existing_keys:
+        return np.zeros((len(incoming_keys), len(existing_keys)))
+
+    if cdist is None:
+        return np.array([[fuzz.ratio(a, b) for b in existing_keys] for a in incoming_keys], dtype=np.float64)
+
+    workers = FUZZY_SCORER_WORKERS if len(incoming_keys) * len(existing_keys) >= _PARALLEL_MIN_PAIRS else 1
+    similarity = cdist(
+        incoming_keys, existing_keys,
+        scorer=Indel.normalized_similarity, dtype=np.float64, workers=workers,
+    )
+    # fuzz.ratio is intr(100 * Levenshtein.ratio); np.rint rounds half to even like round()
+    return np.rint(100 * similarity)
+
+
+def _stored_key(patient, field: str) -> str:
+    value = getattr(patient, TEXT_KEY_COLUMNS[field], None)
+    return match_key(getattr(patient, field)) if value is None else value
+
+
+def _equality_matrix(incoming_values: Sequence, existing_values: Sequence) -> np.ndarray:
+    """
+    True where both values are truthy and equal, as in ``a and b and a == b``.
+    """
+    codes = {}
+    incoming_codes = np.array([codes.setdefault(v, len(codes) + 1) if v else 0 for v in incoming_values], dtype=np.int64)
+    existing_codes = np.array([codes.get(v, -1) if v else 0 for v in existing_values], dtype=np.int64)
+    return (incoming_codes[:, None] == existing_codes[None, :]) & (incoming_codes[:, None] > 0)
+
+
+def _object_array(values: Sequence) -> np.ndarray:
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class FuzzyScorer:
+    """
+    Scores incoming records against a fixed list of stored patients. Match keys for
+    the stored side are computed once here and reused for every batch.
+    """
+
+    def __init__(self, existing: Sequence):
+        self.existing = existing
+        self.keys = {field: [_stored_key(p, field) for p in existing] for field in TEXT_FIELDS}
+        self.values = {field: [getattr(p, field) for p in existing] for field in EXACT_FIELDS}
+        # Object arrays allow gathering a candidate subset with one fancy index
+        self._key_arrays = {field: _object_array(keys) for field, keys in self.keys.items()}
+        self._value_arrays = {field: _object_array(values) for field, values in self.values.items()}
+        # Candidates seen, dropped after each stage and scored in full by best_matches
+        self.stats = Counter()
+
+    @classmethod
+    def from_columns(cls, existing: Sequence, keys: Dict[str, Sequence], values: Dict[str, Sequence]) -> "FuzzyScorer":
+        """
+        Scorer over prebuilt columns instead of patient objects: ``keys`` holds the
+        match keys of each TEXT_FIELDS field, ``values`` the raw EXACT_FIELDS values.
+        Columns must support ``len``, int indexing and gathering with an index array
+        returning an object array (e.g. app.utils.shared_columns.StringColumn).
+        """
+        scorer = cls.__new__(cls)
+        scorer.existing = existing
+        scorer.keys = keys
+        scorer.values = values
+        scorer._key_arrays = keys
+        scorer._value_arrays = values
+        scorer.stats = Counter()
+        return scorer
+
+    def score_matrix(self, incoming: Sequence, positions: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Unrounded, capped scores of shape ``(len(incoming), len(positions))``.
+        ``positions`` restricts the stored side to a candidate subset.
+        """
+        if positions is None:
+            positions = range(len(self.existing))
+
+        def stored(column):
+            return [column[i] for i in positions]
+
+        def ratios(field):
+            return ratio_matrix([match_key(getattr(p, field)) for p in incoming], stored(self.keys[field]))
+
+        def equal(field):
+            return _equality_matrix([getattr(p, field) for p in incoming], stored(self.values[field]))
+
+        # Same order of floating point additions as is_fuzzy_match
+        score = np.zeros((len(incoming), len(positions)))
+        score += NAME_WEIGHT * ratios("name")
+        score += np.where(equal("dob"), DOB_POINTS, 0)
+        score += np.where(equal("ssn"), SSN_POINTS, 0)
+        score += np.where(equal("insurance_number"), INSURANCE_POINTS, 0)
+        score += ADDRESS_WEIGHT * ratios("address")
+        score += EMAIL_WEIGHT * ratios("email")
+        score += PHONE_WEIGHT * ratios("phone")
+        return np.minimum(score, 100)
+
+    def best_matches(self, incoming: Sequence, threshold: float,
+                     positions: Optional[Sequence[int]] = None,
+                     prune: bool = True) -> List[Tuple[Optional[int], float]]:
+        """
+        For each incoming record, ``(position, score)`` of the stored patient
+        ``process_fuzzy_match`` would pick, or ``(None, 0)``.
+
+        Mirrors the scalar loop: a candidate counts if its unrounded score reaches
+        ``threshold``; the highest rounded score wins and ties go to the earliest.
+        ``prune=False`` scores every pair in full (same result, used for checks).
+        """
+        if positions is None:
+            positions = range(len(self.existing))
+        if not prune:
+            scores = self.score_matrix(incoming, positions)
+            return [_select(row, positions, threshold) for row in scores]
+
+        candidates = np.asarray(positions, dtype=np.int64)
+        results = []
+        for record in incoming:
+            survivors, scores = self._bounded_scores(record, threshold, candidates)
+            results.append(_select(scores, survivors, threshold))
+        return results
+
+    def matches_above(self, record, threshold: float, positions: Sequence[int]) -> List[Tuple[int, float]]:
+        """
+        Every ``(position, rounded score)`` among ``positions`` whose score reaches
+        ``threshold``, with the same branch-and-bound pruning (threshold bound only).
+        """
+        candidates, scores = self._bounded_scores(record, threshold, np.asarray(positions, dtype=np.int64), use_floor=False)
+        return [(int(candidates[i]), round(float(scores[i]), 2)) for i in np.flatnonzero(scores >= threshold)]
+
+    def _bounded_scores(self, record, threshold: float, candidates: np.ndarray,
+                        use_floor: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Surviving candidate positions and their final capped scores. ``use_floor`` also
+        drops candidates that cannot beat one already guaranteed to pass.
+        """
+        self.stats["candidates"] += len(candidates)
+        equal = {}
+        for field in EXACT_FIELDS:
+            value = getattr(record, field)
+            equal[field] = (self._value_arrays[field][candidates] == value) if value else np.zeros(len(candidates), dtype=bool)
+
+        # Points collected so far and the most the remaining components can add
+        partial = (
+            np.where(equal["dob"], DOB_POINTS, 0)
+            + np.where(equal["ssn"], SSN_POINTS, 0)
+            + np.where(equal["insurance_number"], INSURANCE_POINTS, 0)
+        ).astype(np.float64)
+        remaining = 100 * sum(weight for _, weight in FUZZY_STAGES)
+        ratios = {}
+        floor_score: Optional[float] = None
+
+        for stage, (field, weight) in zip(PRUNING_STAGES, ((None, 0),) + FUZZY_STAGES[:-1]):
+            if field is not None:
+                ratios[field] = ratio_matrix(
+                    [match_key(getattr(record, field))],
+                    self._key_arrays[field][candidates].tolist()
+                )[0]
+                partial = partial + weight * ratios[field]
+                remaining -= 100 * weight
+
+            upper = np.minimum(partial + remaining + _BOUND_EPSILON, 100)
+            lower = np.minimum(partial - _BOUND_EPSILON, 100)
+            keep = upper >= threshold
+            # A candidate already sure to pass the threshold sets a floor for the winner.
+            # Anything that could still round to the floor is kept: it may be earlier
+            # in order and win the tie.
+            secured = lower[lower >= threshold]
+            if use_floor and secured.size:
+                floor_score = round(float(secured.max()), 2)
+                keep &= upper + 0.005 >= floor_score
+
+            self.stats[f"pruned_after_{stage}"] += int(len(candidates) - keep.sum())
+            if not keep.all():
+                candidates, partial = candidates[keep], partial[keep]
+                equal = {f: mask[keep] for f, mask in equal.items()}
+                ratios = {f: ratio[keep] for f, ratio in ratios.items()}
+            if not len(candidates):
+                return candidates, partial
+
+        field, _ = FUZZY_STAGES[-1]
+        ratios[field] = ratio_matrix([match_key(getattr(record, field))], self._key_arrays[field][candidates].tolist())[0]
+        self.stats["fully_scored"] += len(candidates)
+
+        # Same order of floating point additions as is_fuzzy_match
+        score = np.zeros(len(candidates))
+        score += NAME_WEIGHT * ratios["name"]
+        score += np.where(equal["dob"], DOB_POINTS, 0)
+        score += np.where(equal["ssn"], SSN_POINTS, 0)
+        score += np.where(equal["insurance_number"], INSURANCE_POINTS, 0)
+        score += ADDRESS_WEIGHT * ratios["address"]
+        score += EMAIL_WEIGHT * ratios["email"]
+        score += PHONE_WEIGHT * ratios["phone"]
+        return candidates, np.minimum(score, 100)
+
+
+def _select(row: np.ndarray, positions: Sequence[int], threshold: float) -> Tuple[Optional[int], float]:
+    best_position, best_score = None, 0
+    for column in np.flatnonzero(row >= threshold):
+        rounded = round(float(row[column]), 2)
+        if rounded > best_score:
+            best_position, best_score = int(positions[column]), rounded
+    return best_position, best_score
@@ -0,0 +1,199 @@
+"""
+Candidate blocking for patient matching.
+
+Instead of scoring every incoming record against every stored patient, patients are
+grouped into blocks by cheap keys (date of birth, phonetic name codes, name-token
+prefixes, last four phone digits, email local part). Only patients that share at
+least one block with the incoming record are handed to the fuzzy scorer.
+
+Key functions accept anything with the patient attributes (``Patient`` rows or
+``PatientData``), so the same keys are used on both sides of the comparison.
+"""
+
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from fuzzywuzzy import utils as fuzz_utils
+
+NAME_PREFIX_LENGTH = 3
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(token: str) -> str:
+    """
+    American Soundex code of a single token, e.g. ``robert`` -> ``R163``.
+    """
+    letters = [c for c in token.lower() if c.isascii() and c.isalpha()]
+    if not letters:
+        return ""
+
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = _SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code, vowels do
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def name_tokens(name: Optional[str]) -> List[str]:
+    if not name:
+        return []
+    return fuzz_utils.full_process(name, force_ascii=True).split()
+
+
+def phone_digits(phone: Optional[str]) -> str:
+    return re.sub(r"\D", "", phone or "")
+
+
+def canonical_email(email: Optional[str]) -> str:
+    if not email or "@" not in email:
+        return ""
+    local, domain = email.strip().lower().split("@", 1)
+    # Drop sub-addressing ("jane+clinic@...") so tagged addresses compare equal
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def email_local_part(email: Optional[str]) -> str:
+    return canonical_email(email).split("@", 1)[0]
+
+
+def _stored(patient, column: str):
+    """
+    Precomputed match key column (see app.utils.match_keys), or None when the
+    record has none (incoming data, or rows not yet backfilled).
+    """
+    return getattr(patient, column, None)
+
+
+def _dob_keys(patient) -> Iterable[str]:
+    if patient.dob:
+        yield str(patient.dob)
+
+
+def _name_soundex_keys(patient) -> Iterable[str]:
+    phonetic = _stored(patient, "name_phonetic")
+    if phonetic is not None:
+        yield from phonetic.split()
+        return
+    for token in name_tokens(patient.name):
+        code = soundex(token)
+        if code:
+            yield code
+
+
+def _name_prefix_keys(patient) -> Iterable[str]:
+    name_key = _stored(patient, "name_key")
+    tokens = name_key.split() if name_key is not None else name_tokens(patient.name)
+    for token in tokens:
+        if len(token) >= NAME_PREFIX_LENGTH:
+            yield token[:NAME_PREFIX_LENGTH]
+
+
+def _phone_last4_keys(patient) -> Iterable[str]:
+    digits = _stored(patient, "phone_digits")
+    if digits is None:
+        digits = phone_digits(patient.phone)
+    if len(digits) >= 4:
+        yield digits[-4:]
+
+
+def _email_local_keys(patient) -> Iterable[str]:
+    email = _stored(patient, "email_canonical")
+    local = email.split("@", 1)[0] if email is not None else email_local_part(patient.email)
+    if local:
+        yield local
+
+
+BLOCKING_KEYS: Dict[str, Callable] = {
+    "dob": _dob_keys,
+    "name_soundex": _name_soundex_keys,
+    "name_prefix": _name_prefix_keys,
+    "phone_last4": _phone_last4_keys,
+    "email_local": _email_local_keys,
+}
+
+
+def resolve_blocking_keys(keys: Optional[Sequence[str]]) -> List[str]:
+    """
+    Validates a blocking strategy. ``None``/``[]``/``["none"]`` disable blocking.
+    """
+    if not keys or list(keys) == ["none"]:
+        return []
+    unknown = [k for k in keys if k not in BLOCKING_KEYS]
+    if unknown:
+        raise ValueError(
+            f"Unknown blocking keys: {', '.join(unknown)}. "
+            f"Available: {', '.join(BLOCKING_KEYS)}"
+        )
+    return list(dict.fromkeys(keys))
+
+
+class BlockingIndex:
+    """
+    Inverted index from blocking key to positions in the stored patient list.
+
+    ``candidates`` returns patients in their original order so tie-breaking in the
+    matcher (first best score wins) is the same as in a full scan.
+    """
+
+    def __init__(self, patients: Sequence, keys: Optional[Sequence[str]]):
+        self.patients = patients
+        self.keys = resolve_blocking_keys(keys)
+        self.blocks: Dict[str, List[int]] = {}
+
+        for position, patient in enumerate(patients):
+            for block in self.block_keys(patient):
+                self.blocks.setdefault(block, []).append(position)
+
+    @classmethod
+    def from_blocks(cls, patients: Sequence, keys: Optional[Sequence[str]], blocks) -> "BlockingIndex":
+        """
+        Index whose ``blocks`` were built elsewhere (anything with ``get``, e.g. the
+        shared blocks of app.services.parallel_matcher). ``blocks`` may hold blocks of
+        other keys too; only blocks of ``keys`` are ever looked up.
+        """
+        index = cls.__new__(cls)
+        index.patients = patients
+        index.keys = resolve_blocking_keys(keys)
+        index.blocks = blocks
+        return index
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keys)
+
+    def block_keys(self, patient) -> set:
+        return {
+            f"{name}:{value}"
+            for name in self.keys
+            for value in BLOCKING_KEYS[name](patient)
+        }
+
+    def candidate_positions(self, incoming) -> List[int]:
+        """
+        Positions of candidate patients, in their original order.
+        """
+        if not self.enabled:
+            return list(range(len(self.patients)))
+
+        positions = set()
+        for block in self.block_keys(incoming):
+            positions.update(self.blocks.get(block, ()))
+        return sorted(positions)
+
+    def candidates(self, incoming) -> List:
+        return [self.patients[i] for i in self.candidate_positions(incoming)]
@@ -0,0 +1,160 @@
+"""
+Content-addressed embedding cache.
+
+Embeddings are keyed by SHA-256 of the model name plus the whitespace-normalized input
+text, so resubmitting the same patient string never pays for a second API call. Lookups
+go through a bounded in-process LRU first, then a persistent SQLite table shared across
+restarts and scripts. Counters track hits, misses, evictions and the estimated tokens
+and API time saved.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, path: str = EMBEDDING_CACHE_PATH):
+        self.max_entries = max_entries
+        self.path = path
+        self._lru: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.counters = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "tokens_saved": 0,
+            "api_calls": 0,
+            "api_texts": 0,
+            "api_seconds": 0.0,
+        }
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+                " embedding BLOB NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, vector: list):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[list]]:
+        """
+        Cached vectors for ``texts`` in order, ``None`` where the text is not cached.
+        """
+        keys = [cache_key(model, text) for text in texts]
+        results: List[Optional[list]] = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for position, key in enumerate(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    results[position] = self._lru[key]
+                    self.counters["memory_hits"] += 1
+                else:
+                    missing.setdefault(key, []).append(position)
+
+            conn = self._db()
+            if conn is not None and missing:
+                found = self._load(conn, list(missing))
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    for position in missing.pop(key):
+                        results[position] = vector
+                        self.counters["persistent_hits"] += 1
+
+            self.counters["misses"] += sum(len(positions) for positions in missing.values())
+            # Same ~4 characters per token estimate used for request batching
+            self.counters["tokens_saved"] += sum(
+                len(texts[i]) // 4 + 1 for i, vector in enumerate(results) if vector is not None
+            )
+        return results
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, keys: List[str]) -> dict:
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, embedding FROM embedding_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, texts: List[str], vectors: List[list]):
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                self._remember(key, vector)
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                rows.append((key, model, len(vector), blob))
+
+            conn = self._db()
+            if conn is not None and rows:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (key, model, dim, embedding) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.commit()
+
+    def record_api_call(self, texts: int, seconds: float):
+        with self._lock:
+            self.counters["api_calls"] += 1
+            self.counters["api_texts"] += texts
+            self.counters["api_seconds"] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            entries = len(self._lru)
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        lookups = hits + counters["misses"]
+        seconds_per_text = counters["api_seconds"] / counters["api_texts"] if counters["api_texts"] else 0.0
+        return {
+            **counters,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": entries,
+            "max_entries": self.max_entries,
+            "persistent_path": self.path or None,
+            "api_seconds_saved_estimate": round(hits * seconds_per_text, 3),
+        }
+
+
+embedding_cache = EmbeddingCache()
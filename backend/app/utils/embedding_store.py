@@ -0,0 +1,206 @@
+"""
+In-memory embedding store for similarity search.
+
+Holds every patient embedding as a row of a contiguous, L2-normalized float32 matrix
+with a parallel array of patient ids, so cosine similarity against the whole registry
+is one matrix multiply. Rows are added, replaced and removed in place when patients
+are written, and the store is loaded lazily from the ``patients`` table on first use.
+"""
+
+import json
+import logging
+import threading
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from database.models import Patient
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_CAPACITY = 1024
+
+
+def parse_embedding(value) -> Optional[np.ndarray]:
+    """
+    Returns a float32 vector from a JSONB list or a serialized JSON string.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    try:
+        vector = np.asarray(value, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if vector.ndim != 1 or vector.size == 0:
+        return None
+    return vector
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix: Optional[np.ndarray] = None
+        self._ids = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def _reserve(self, dim: int, capacity: int):
+        if self._matrix is None:
+            self._matrix = np.empty((max(capacity, _INITIAL_CAPACITY), dim), dtype=np.float32)
+        elif dim != self._matrix.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self._matrix.shape[1]}")
+
+        if capacity > self._matrix.shape[0]:
+            new_capacity = max(capacity, 2 * self._matrix.shape[0])
+            matrix = np.empty((new_capacity, dim), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        if capacity > self._ids.shape[0]:
+            ids = np.empty(max(capacity, 2 * self._ids.shape[0]), dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._ids = ids
+
+    def load(self, rows: Iterable[Tuple[int, object]]):
+        """
+        Replaces the store contents with ``(patient_id, embedding)`` rows.
+        """
+        ids, vectors = [], []
+        for patient_id, embedding in rows:
+            vector = parse_embedding(embedding)
+            if vector is not None:
+                ids.append(patient_id)
+                vectors.append(vector)
+
+        with self._lock:
+            self._matrix = None
+            self._ids = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+            self._rows = {}
+            self._size = 0
+            if not vectors:
+                return
+            self._reserve(vectors[0].shape[0], len(vectors))
+            self._matrix[:len(vectors)] = _normalize(np.vstack(vectors))
+            self._ids[:len(ids)] = ids
+            self._rows = {patient_id: row for row, patient_id in enumerate(ids)}
+            self._size = len(ids)
+
+    def upsert(self, patient_id: int, embedding):
+        vector = parse_embedding(embedding)
+        if vector is None:
+            self.delete(patient_id)
+            return
+
+        with self._lock:
+            row = self._rows.get(patient_id)
+            if row is None:
+                self._reserve(vector.shape[0], self._size + 1)
+                row = self._size
+                self._rows[patient_id] = row
+                self._ids[row] = patient_id
+                self._size += 1
+            else:
+                self._reserve(vector.shape[0], self._size)
+            self._matrix[row] = _normalize(vector)
+
+    def delete(self, patient_id: int):
+        with self._lock:
+            row = self._rows.pop(patient_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                # Move the last row into the hole to keep the matrix contiguous
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._size -= 1
+
+    def top_k(self, queries, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine top-k for one vector or a batch of vectors.
+
+        Returns ``(ids, scores)`` arrays of shape ``(n_queries, k')`` sorted by
+        descending score, where ``k' = min(k, len(store))``.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                empty = np.empty((queries.shape[0], 0))
+                return empty.astype(np.int64), empty.astype(np.float32)
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Query dimension {queries.shape[1]} does not match store dimension {self.dim}")
+
+            scores = _normalize(queries) @ self.matrix.T
+            ids = self.ids.copy()
+
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (scores.shape[0], k))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return ids[top], np.take_along_axis(top_scores, order, axis=1)
+
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store(db) -> EmbeddingStore:
+    """
+    Process-wide store, loaded from the ``patients`` table on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = EmbeddingStore()
+            store.load(
+                db.query(Patient.id, Patient.embedding)
+                .filter(Patient.embedding.isnot(None))
+                .yield_per(1000)
+            )
+            logger.info(f"Loaded {len(store)} patient embeddings into the embedding store")
+            _store = store
+    return _store
+
+
+def sync_patient_embedding(patient: Patient):
+    """
+    Mirrors a written patient row into the store, if the store has been loaded.
+    """
+    if _store is None:
+        return
+    try:
+        _store.upsert(patient.id, patient.embedding)
+    except ValueError as e:
+        logger.warning(f"Skipping embedding for patient {patient.id}: {e}")
@@ -1,19 +1,107 @@
 # utils/embedding_utils.py
 
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
 import openai
 import numpy as np
 from dotenv import load_dotenv
 import os
 
+from app.config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_BACKOFF,
+)
+from app.services.client_registry import client_registry  # noqa: F401  (pooled OpenAI session)
+from app.utils.embedding_cache import embedding_cache
+
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def make_batches(texts: List[str], batch_size: int, max_tokens: int) -> List[List[int]]:
+    """
+    Groups text positions into batches bounded by count and estimated tokens.
+    A single text over the token budget is sent on its own.
+    """
+    batches, current, current_tokens = [], [], 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(texts: List[str], model: str) -> List[list]:
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            started = time.perf_counter()
+            response = openai.Embedding.create(input=texts, model=model)
+            embedding_cache.record_api_call(len(texts), time.perf_counter() - started)
+            # Items carry their input index; don't rely on response order
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            delay = EMBEDDING_RETRY_BACKOFF * (2 ** attempt)
+            logger.warning(f"Embedding batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def get_openai_embeddings(texts: List[str], model: str = EMBEDDING_MODEL) -> List[list]:
+    """
+    Embeds many texts with size/token-bounded batches sent concurrently.
+    Cached texts are served from the embedding cache; results are in input order.
+    """
+    if not texts:
+        return []
+
+    embeddings = embedding_cache.get_many(model, texts)
+    # Each distinct uncached text is requested once
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, embeddings) if vector is None))
+    if not missing:
+        return embeddings
+
+    batches = make_batches(missing, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS)
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(EMBEDDING_MAX_CONCURRENCY, len(batches)))) as pool:
+        results = pool.map(lambda batch: _embed_batch([missing[i] for i in batch], model), batches)
+        for batch, vectors in zip(batches, results):
+            for position, vector in zip(batch, vectors):
+                fetched[missing[position]] = vector
+
+    embedding_cache.put_many(model, list(fetched), list(fetched.values()))
+    return [vector if vector is not None else fetched[text] for text, vector in zip(texts, embeddings)]
+
+
 def get_openai_embedding(text: str) -> list:
-    response = openai.Embedding.create(
-        input=[text],
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+    return get_openai_embeddings([text])[0]
 
 def cosine_similarity(vec1, vec2):
     vec1 = np.array(vec1, dtype=np.float32)
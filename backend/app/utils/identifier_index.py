@@ -0,0 +1,63 @@
+"""
+Exact identifier index for patient matching.
+
+Maps normalized SSN, medical record number and insurance number to stored patients so
+an incoming record carrying a known identifier resolves with a dict lookup instead of
+the fuzzy and embedding passes. A hit whose name disagrees with the stored patient is
+reported as a conflict so it can go to human review instead of being scored; a record
+without a name on either side cannot disagree and is matched on the identifier.
+"""
+
+import re
+from typing import Dict, NamedTuple, Optional, Sequence
+
+from fuzzywuzzy import fuzz
+
+# Checked in this order; the first identifier that hits decides the outcome.
+IDENTIFIER_FIELDS = ("ssn", "medical_record_number", "insurance_number")
+
+# Minimum token_sort_ratio between names for an identifier hit to count as a match
+IDENTIFIER_NAME_AGREEMENT = 60
+
+
+def normalize_identifier(field: str, value: Optional[str]) -> str:
+    if not value:
+        return ""
+    if field == "ssn":
+        return re.sub(r"\D", "", value)
+    return re.sub(r"[^0-9A-Z]", "", value.upper())
+
+
+class IdentifierHit(NamedTuple):
+    patient: object
+    field: str
+    name_score: int
+    conflict: bool
+
+
+class IdentifierIndex:
+    def __init__(self, patients: Sequence):
+        self.index: Dict[tuple, object] = {}
+        for patient in patients:
+            for field in IDENTIFIER_FIELDS:
+                key = normalize_identifier(field, getattr(patient, field))
+                if key:
+                    # Keep the first stored patient for duplicated identifiers
+                    self.index.setdefault((field, key), patient)
+
+    def lookup(self, incoming) -> Optional[IdentifierHit]:
+        for field in IDENTIFIER_FIELDS:
+            key = normalize_identifier(field, getattr(incoming, field))
+            patient = self.index.get((field, key)) if key else None
+            if patient is None:
+                continue
+
+            name_score = fuzz.token_sort_ratio(patient.name or "", incoming.name or "")
+            return IdentifierHit(
+                patient=patient,
+                field=field,
+                name_score=name_score,
+                # A missing name is not a disagreement
+                conflict=bool(patient.name and incoming.name) and name_score < IDENTIFIER_NAME_AGREEMENT,
+            )
+        return None
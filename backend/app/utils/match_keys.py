@@ -0,0 +1,56 @@
+"""
+Normalized match keys, computed once when a patient is written.
+
+The fuzzy scorer compares token-sorted, lowercased, punctuation-free strings and the
+blocking index uses digits-only phones, canonical emails and Soundex codes. Storing
+those on the patient row means the matcher never re-normalizes a stored patient:
+
+- name_key / address_key / email_key / phone_key: token-sort form used for scoring
+  (``fuzz.ratio`` on two keys equals ``fuzz.token_sort_ratio`` on the raw values)
+- phone_digits: digits-only phone
+- email_canonical: lowercased email without ``+tag`` sub-addressing
+- name_phonetic: space-separated Soundex codes of the name tokens
+
+Readers treat a ``None`` column as "not computed yet" and fall back to normalizing
+the raw value, so rows written before the backfill still match correctly.
+"""
+
+from app.utils.blocking import canonical_email, name_tokens, phone_digits, soundex
+from app.utils.string_matcher import match_key
+
+MATCH_KEY_COLUMNS = (
+    "name_key",
+    "address_key",
+    "email_key",
+    "phone_key",
+    "phone_digits",
+    "email_canonical",
+    "name_phonetic",
+)
+
+# Scoring key column for each fuzzy-compared field
+TEXT_KEY_COLUMNS = {
+    "name": "name_key",
+    "address": "address_key",
+    "email": "email_key",
+    "phone": "phone_key",
+}
+
+
+def compute_match_keys(patient) -> dict:
+    return {
+        "name_key": match_key(patient.name),
+        "address_key": match_key(patient.address),
+        "email_key": match_key(patient.email),
+        "phone_key": match_key(patient.phone),
+        "phone_digits": phone_digits(patient.phone),
+        "email_canonical": canonical_email(patient.email),
+        "name_phonetic": " ".join(
+            dict.fromkeys(code for code in map(soundex, name_tokens(patient.name)) if code)
+        ),
+    }
+
+
+def apply_match_keys(patient):
+    for column, value in compute_match_keys(patient).items():
+        setattr(patient, column, value)
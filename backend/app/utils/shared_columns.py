@@ -0,0 +1,88 @@
+"""
+Read-only string columns shared between processes.
+
+A column is two .npy files in a directory: the UTF-8 bytes of every value back to
+back and an int64 offsets array (value ``i`` is ``data[offsets[i]:offsets[i + 1]]``).
+Readers memory-map both, so any number of processes share one copy in the page cache
+and only decode the values they actually touch. ``None`` is stored as ``""``.
+
+Functions:
+- write_string_column: Writes a column of strings.
+- StringColumn: Memory-mapped column; index with an int or gather with an index array.
+- write_blocks: Writes a block key -> positions mapping.
+- SharedBlocks: Blocking index (block key -> positions) over shared columns.
+"""
+
+import bisect
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+def write_string_column(directory: str, name: str, values: Iterable[Optional[str]]):
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{name}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+class StringColumn:
+    """
+    ``parse`` turns the stored string back into the original value (e.g. a date).
+    """
+
+    def __init__(self, directory: str, name: str, parse: Optional[Callable[[str], object]] = None):
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        self.data = np.load(os.path.join(directory, f"{name}.data.npy"), mmap_mode="r")
+        self.parse = parse
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def _value(self, i: int):
+        value = self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+        return self.parse(value) if self.parse else value
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self._value(int(index))
+        # Gathering returns an object array, like FuzzyScorer's own columns
+        values = np.empty(len(index), dtype=object)
+        values[:] = [self._value(int(i)) for i in index]
+        return values
+
+
+def write_blocks(directory: str, blocks: Dict[str, Sequence[int]]):
+    """
+    Writes a block key -> positions mapping as sorted keys plus CSR offsets/positions.
+    """
+    keys = sorted(blocks)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(blocks[key]) for key in keys])
+    positions = np.fromiter((p for key in keys for p in blocks[key]), dtype=np.int64, count=int(offsets[-1]))
+    write_string_column(directory, "block_keys", keys)
+    np.save(os.path.join(directory, "block_offsets.npy"), offsets)
+    np.save(os.path.join(directory, "block_positions.npy"), positions)
+
+
+class SharedBlocks:
+    """
+    The ``blocks`` mapping of a BlockingIndex, read from ``write_blocks`` output.
+    Keys are looked up by binary search over the sorted key column.
+    """
+
+    def __init__(self, directory: str):
+        self.keys = StringColumn(directory, "block_keys")
+        self.offsets = np.load(os.path.join(directory, "block_offsets.npy"), mmap_mode="r")
+        self.positions = np.load(os.path.join(directory, "block_positions.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key: str, default=()) -> List[int]:
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return default
+        return self.positions[self.offsets[i]:self.offsets[i + 1]].tolist()
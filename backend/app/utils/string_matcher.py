@@ -1,7 +1,24 @@
-from fuzzywuzzy import fuzz
+from fuzzywuzzy import fuzz, utils
 from database.models import Patient
 from database.schemas import PatientData
 
+# Field weights shared by is_fuzzy_match and the batch scorer (app.utils.batch_matcher)
+NAME_WEIGHT = 0.5
+DOB_POINTS = 10
+SSN_POINTS = 10
+INSURANCE_POINTS = 5
+ADDRESS_WEIGHT = 0.2
+EMAIL_WEIGHT = 0.1
+PHONE_WEIGHT = 0.1
+
+
+def match_key(value) -> str:
+    """
+    The token-sorted form fuzz.token_sort_ratio compares, so that
+    fuzz.ratio(match_key(a), match_key(b)) == fuzz.token_sort_ratio(a, b).
+    """
+    return " ".join(sorted(utils.full_process(value or "", force_ascii=True).split()))
+
 def is_fuzzy_match(existing: Patient, incoming: PatientData, threshold=90):
     """
     Enhanced fuzzy matching that considers multiple fields with individual weights.
@@ -10,31 +27,31 @@ def is_fuzzy_match(existing: Patient, incoming: PatientData, threshold=90):
 
     # Name match
     name_score = fuzz.token_sort_ratio(existing.name or "", incoming.name or "")
-    score += 0.5 * name_score
+    score += NAME_WEIGHT * name_score
 
     # Date of Birth match
     if existing.dob and incoming.dob and existing.dob == incoming.dob:
-        score += 10
+        score += DOB_POINTS
 
     # SSN match
     if existing.ssn and incoming.ssn and existing.ssn == incoming.ssn:
-        score += 10
+        score += SSN_POINTS
 
     # Insurance Number match
     if existing.insurance_number and incoming.insurance_number and existing.insurance_number == incoming.insurance_number:
-        score += 5
+        score += INSURANCE_POINTS
 
     # Address match
     address_score = fuzz.token_sort_ratio(existing.address or "", incoming.address or "")
-    score += 0.2 * address_score
+    score += ADDRESS_WEIGHT * address_score
 
     # Email match
     email_score = fuzz.token_sort_ratio(existing.email or "", incoming.email or "")
-    score += 0.1 * email_score
+    score += EMAIL_WEIGHT * email_score
 
     # Phone match
     phone_score = fuzz.token_sort_ratio(existing.phone or "", incoming.phone or "")
-    score += 0.1 * phone_score
+    score += PHONE_WEIGHT * phone_score
 
     final_score = min(score, 100)  # Cap score at 100
 
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from database.models import Job
+
+
+def enqueue_job(db: Session, kind: str, payload: dict, max_attempts: int = 3, delay: float = 0) -> Job:
+    job = Job(
+        kind=kind,
+        payload=payload,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[Job]:
+    return db.get(Job, job_id)
+
+
+def list_jobs(db: Session, status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50) -> List[Job]:
+    query = db.query(Job)
+    if status:
+        query = query.filter(Job.status == status)
+    if kind:
+        query = query.filter(Job.kind == kind)
+    return query.order_by(Job.created_at.desc()).limit(limit).all()
+
+
+def claim_jobs(db: Session, worker_id: str, visibility_timeout: float, kinds: Optional[Sequence[str]] = None,
+               limit: int = 1) -> List[Job]:
+    """
+    Claims up to ``limit`` due jobs for ``worker_id``: queued jobs whose run_after has
+    passed, and running jobs whose worker let the visibility timeout lapse. Rows
+    locked by another claiming worker are skipped rather than waited on. Lapsed jobs
+    that have used up their attempts are failed instead of claimed.
+    """
+    now = datetime.utcnow()
+    query = db.query(Job).filter(or_(
+        and_(Job.status == "queued", Job.run_after <= now),
+        and_(Job.status == "running", Job.locked_until < now),
+    ))
+    if kinds:
+        query = query.filter(Job.kind.in_(list(kinds)))
+    candidates = query.order_by(Job.run_after).limit(limit).with_for_update(skip_locked=True).all()
+
+    claimed = []
+    for job in candidates:
+        if job.status == "running" and job.attempts >= job.max_attempts:
+            job.status = "failed"
+            job.error = f"Worker {job.locked_by} did not finish the job within the visibility timeout"
+            job.locked_by = job.locked_until = None
+            job.finished_at = now
+            continue
+        job.status = "running"
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_until = now + timedelta(seconds=visibility_timeout)
+        job.started_at = now
+        claimed.append(job)
+    db.commit()
+    return claimed
+
+
+def _owned(db: Session, job_id: str, worker_id: str) -> Optional[Job]:
+    # A worker whose lease lapsed and was reclaimed no longer owns the job
+    job = db.query(Job).filter(Job.id == job_id).with_for_update().one_or_none()
+    if job is None or job.status != "running" or job.locked_by != worker_id:
+        db.rollback()
+        return None
+    return job
+
+
+def extend_job(db: Session, job_id: str, worker_id: str, visibility_timeout: float) -> bool:
+    job = _owned(db, job_id, worker_id)
+    if job is None:
+        return False
+    job.locked_until = datetime.utcnow() + timedelta(seconds=visibility_timeout)
+    db.commit()
+    return True
+
+
+def complete_job(db: Session, job_id: str, worker_id: str, result: Optional[dict]) -> bool:
+    job = _owned(db, job_id, worker_id)
+    if job is None:
+        return False
+    job.status = "completed"
+    job.result = result
+    job.error = None
+    job.locked_by = job.locked_until = None
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+def fail_job(db: Session, job_id: str, worker_id: str, error: str, retry_delay: Optional[float]) -> bool:
+    """
+    Records a failed attempt. The job is queued again after ``retry_delay`` seconds
+    while it has attempts left (and retry_delay is not None), otherwise it fails.
+    """
+    job = _owned(db, job_id, worker_id)
+    if job is None:
+        return False
+    now = datetime.utcnow()
+    job.error = error
+    job.locked_by = job.locked_until = None
+    if retry_delay is not None and job.attempts < job.max_attempts:
+        job.status = "queued"
+        job.run_after = now + timedelta(seconds=retry_delay)
+    else:
+        job.status = "failed"
+        job.finished_at = now
+    db.commit()
+    return True
+
+
+def job_counts(db: Session) -> Dict[str, Dict[str, int]]:
+    """
+    Number of jobs by kind and status.
+    """
+    counts: Dict[str, Dict[str, int]] = {}
+    for kind, status, count in db.query(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status):
+        counts.setdefault(kind, {})[status] = count
+    return counts
+
+
+def oldest_queued_at(db: Session) -> Optional[datetime]:
+    return db.query(func.min(Job.run_after)).filter(Job.status == "queued").scalar()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Text, Float, DateTime, ARRAY, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, Text, Float, DateTime, ARRAY, ForeignKey, Index, Boolean
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, DateTime, JSON, String
@@ -33,17 +33,22 @@ Base = declarative_base()
 
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        # Trigram indexes for similarity candidate retrieval (needs the pg_trgm extension)
+        Index("ix_patients_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_patients_address_trgm", "address", postgresql_using="gin", postgresql_ops={"address": "gin_trgm_ops"}),
+    )
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
-    dob = Column(Date)
+    name = Column(String, index=True)
+    dob = Column(Date, index=True)
     gender = Column(String)
-    ssn = Column(String)
+    ssn = Column(String, index=True)
     address = Column(Text)
     phone = Column(String)
     email = Column(String)
-    insurance_number = Column(String)
-    medical_record_number = Column(String)
+    insurance_number = Column(String, index=True)
+    medical_record_number = Column(String, index=True)
     emergency_contact = Column(String)
     medical_conditions = Column(ARRAY(String))
     medications = Column(ARRAY(String))
@@ -61,9 +66,21 @@ class Patient(Base):
     follow_up = Column(Text)
     provider_notes = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     embedding = Column(JSONB, nullable=True)  # serialized OpenAI vector
 
+    # Normalized match keys, written with the row (see app.utils.match_keys)
+    name_key = Column(String, nullable=True)
+    address_key = Column(Text, nullable=True)
+    email_key = Column(String, nullable=True)
+    phone_key = Column(String, nullable=True)
+    phone_digits = Column(String, nullable=True)
+    email_canonical = Column(String, nullable=True)
+    name_phonetic = Column(String, nullable=True)
+
+    # Duplicate cluster from the linking job: lowest patient id in the cluster
+    cluster_id = Column(Integer, nullable=True, index=True)
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -94,6 +111,7 @@ class Patient(Base):
             "provider_notes": self.provider_notes,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "cluster_id": self.cluster_id,
             "embedding": self.embedding
         }
 
@@ -114,6 +132,68 @@ class UnmatchedPatient(Base):
     medical_conditions = Column(Text, nullable=True)
 
 
+class PatientLinkRun(Base):
+    """
+    One run of the patient linking job; ``watermark`` is the latest updated_at it
+    processed, so the next incremental run starts from there.
+    """
+    __tablename__ = "patient_link_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    watermark = Column(DateTime, nullable=True)
+    full_run = Column(Boolean, default=False)
+    patients_processed = Column(Integer, default=0)
+    pairs_found = Column(Integer, default=0)
+    clusters_updated = Column(Integer, default=0)
+
+
+class OcrResult(Base):
+    """
+    OCR output of one uploaded document, keyed by the SHA-256 of its content, so an
+    identical re-upload skips both the S3 upload and the OCR job.
+    """
+    __tablename__ = "ocr_results"
+
+    content_hash = Column(String(64), primary_key=True)
+    file_type = Column(String, nullable=False)
+    s3_path = Column(String, nullable=False)
+    ocr_engine = Column(String, nullable=False)
+    extracted_text = Column(Text, nullable=False)
+    blocks = Column(JSONB, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, nullable=True)
+    hit_count = Column(Integer, default=0)
+
+
+class Job(Base):
+    """
+    A unit of background work (see app.services.job_queue). Workers claim queued jobs
+    with SELECT ... FOR UPDATE SKIP LOCKED and hold them until ``locked_until``; a job
+    whose worker died becomes claimable again once that passes.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "run_after"),
+    )
+
+    id = Column(String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued, running, completed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
 class PatientContext(Base):
     __tablename__ = "patient_contexts"
 
@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.models import OcrResult
+
+
+def get_ocr_result(db: Session, content_hash: str) -> Optional[OcrResult]:
+    """
+    Cached OCR result for a document, counting the hit.
+    """
+    result = db.get(OcrResult, content_hash)
+    if result is not None:
+        result.hit_count = (result.hit_count or 0) + 1
+        result.last_hit_at = datetime.utcnow()
+        db.commit()
+    return result
+
+
+def save_ocr_result(db: Session, content_hash: str, file_type: str, s3_path: str, ocr_engine: str,
+                    extracted_text: str, blocks: Optional[List[dict]]) -> OcrResult:
+    result = db.merge(OcrResult(
+        content_hash=content_hash,
+        file_type=file_type,
+        s3_path=s3_path,
+        ocr_engine=ocr_engine,
+        extracted_text=extracted_text,
+        blocks=blocks,
+        created_at=datetime.utcnow(),
+        hit_count=0,
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another upload of the same document stored it first
+        db.rollback()
+        return db.get(OcrResult, content_hash)
+    return result
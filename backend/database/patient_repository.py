@@ -1,30 +1,128 @@
 from database.schemas import StructuredPatientInput
 from database.models import Patient, UnmatchedPatient
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from datetime import datetime
+from typing import Dict, List, Optional
+from app.config import SQL_CANDIDATE_LIMIT
+from app.services.embedding_service import sync_patient_embedding
+from app.utils.match_keys import apply_match_keys, compute_match_keys
+from database.patient_snapshot import PatientRecord, patient_snapshot
 
 def get_all_patients(db: Session):
     return db.query(Patient).all()
 
+def get_patient_records(db: Session) -> List[PatientRecord]:
+    """
+    All patients as read-only snapshot records (see database.patient_snapshot).
+    """
+    return patient_snapshot.records(db)
+
+def get_patient_record(db: Session, patient_id: int) -> Optional[PatientRecord]:
+    return patient_snapshot.get(db, patient_id)
+
+def get_patient_by_name(db: Session, name: str) -> Optional[Patient]:
+    # Served by ix_patients_name
+    return db.query(Patient).filter(Patient.name == name).order_by(Patient.id).first()
+
+def find_similar_patient_ids(db: Session, incoming, limit: int = SQL_CANDIDATE_LIMIT) -> List[int]:
+    """
+    Ids of the ``limit`` stored patients most similar to ``incoming``, ranked in SQL.
+
+    Candidates are patients whose name or address is trigram-similar (pg_trgm ``%``,
+    served by the GIN indexes) or whose DOB/SSN is equal (B-tree indexes), ordered by
+    name similarity plus a smaller address similarity. Requires PostgreSQL with pg_trgm.
+    """
+    conditions, rank = [], []
+    if incoming.name:
+        conditions.append(Patient.name.op("%")(incoming.name))
+        rank.append(func.coalesce(func.similarity(Patient.name, incoming.name), 0))
+    if incoming.address:
+        conditions.append(Patient.address.op("%")(incoming.address))
+        rank.append(0.4 * func.coalesce(func.similarity(Patient.address, incoming.address), 0))
+    if incoming.dob:
+        conditions.append(Patient.dob == incoming.dob)
+    if incoming.ssn:
+        conditions.append(Patient.ssn == incoming.ssn)
+    if not conditions:
+        return []
+
+    query = db.query(Patient.id).filter(or_(*conditions))
+    if rank:
+        query = query.order_by(sum(rank[1:], rank[0]).desc())
+    return [row.id for row in query.order_by(Patient.id).limit(limit).all()]
+
+def patient_update_values(existing: Patient, new_data: dict) -> dict:
+    values = {
+        "dob": new_data.get("dob", existing.dob),
+        "ssn": new_data.get("ssn", existing.ssn),
+        "insurance_number": new_data.get("insurance_number", existing.insurance_number),
+        "medical_conditions": ",".join(new_data.get("medical_conditions", [])),
+    }
+    values.update(compute_match_keys(existing))
+    return values
+
 def update_patient(db: Session, existing: Patient, new_data: dict):
-    existing.dob = new_data.get("dob", existing.dob)
-    existing.ssn = new_data.get("ssn", existing.ssn)
-    existing.insurance_number = new_data.get("insurance_number", existing.insurance_number)
-    existing.medical_conditions = ",".join(new_data.get("medical_conditions", []))
+    for column, value in patient_update_values(existing, new_data).items():
+        setattr(existing, column, value)
     db.commit()
+    patient_snapshot.invalidate()
+    sync_patient_embedding(existing)
+
+def unmatched_values(data: dict) -> dict:
+    return {
+        "name": data.get("name"),
+        "dob": data.get("dob"),
+        "ssn": data.get("ssn"),
+        "insurance_number": data.get("insurance_number"),
+        "medical_conditions": ",".join(data.get("medical_conditions", [])),
+    }
 
 def insert_unmatched(db: Session, data: dict):
-    new_entry = UnmatchedPatient(
-        name=data.get("name"),
-        dob=data.get("dob"),
-        ssn=data.get("ssn"),
-        insurance_number=data.get("insurance_number"),
-        medical_conditions=",".join(data.get("medical_conditions", []))
-    )
+    new_entry = UnmatchedPatient(**unmatched_values(data))
     db.add(new_entry)
     db.commit()
 
 
+class PatientWriteBatch:
+    """
+    Unit of work for a matching batch.
+
+    Collects patient updates, then writes them with one bulk update in a single
+    transaction. If the write fails the whole batch is rolled back and the error
+    is re-raised.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.updates: Dict[int, dict] = {}
+
+    def __len__(self):
+        return len(self.updates)
+
+    def update(self, existing: Patient, new_data: dict) -> dict:
+        """
+        Queues the same change update_patient makes and returns the new column values.
+        """
+        values = patient_update_values(existing, new_data)
+        # bulk_update_mappings skips column onupdate defaults
+        values["updated_at"] = datetime.utcnow()
+        self.updates.setdefault(existing.id, {"id": existing.id}).update(values)
+        return values
+
+    def flush(self):
+        if not self.updates:
+            return
+        try:
+            self.db.bulk_update_mappings(Patient, list(self.updates.values()))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        patient_snapshot.invalidate()
+        self.updates = {}
+
+
 def parse_date(date_str):
     try:
         return datetime.strptime(date_str, "%Y-%m-%d").date()
@@ -60,8 +158,11 @@ def add_patient_from_json(db: Session, structured_data: StructuredPatientInput):
         provider_notes=data.ProviderNotes,
     )
 
+    apply_match_keys(patient)
     db.add(patient)
     db.commit()
+    patient_snapshot.invalidate()
     db.refresh(patient)
+    sync_patient_embedding(patient)
     return patient
 
@@ -0,0 +1,190 @@
+"""
+Patient Snapshot
+
+Process-wide, read-only view of the patients table for the matching paths. Rows are
+held as slotted PatientRecord objects (every column except the embedding, which
+app.services.embedding_service already keeps as a float32 matrix) instead of ORM
+instances, so reads neither hydrate objects nor touch the session identity map.
+
+Refreshing is incremental: each read asks only for rows whose ``updated_at`` is at
+or after the last synced timestamp (minus a small overlap for rows committed late
+with an older timestamp). Local writes invalidate the snapshot so the next read
+picks them up immediately; a periodic full reload drops rows deleted elsewhere.
+
+Records are replaced, never mutated, so a list returned by ``records()`` stays
+consistent while a refresh runs.
+
+Functions:
+- PatientSnapshot.records: Current records in id order, refreshed as needed.
+- PatientSnapshot.get: One record by id.
+- PatientSnapshot.version_of: Version of a list returned by ``records()``, if still current.
+- PatientSnapshot.invalidate: Forces a refresh on the next read.
+- PatientSnapshot.stats: Size, memory footprint and refresh latency.
+"""
+
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config import (
+    PATIENT_SNAPSHOT_FULL_RELOAD_SECONDS,
+    PATIENT_SNAPSHOT_MAX_AGE_SECONDS,
+    PATIENT_SNAPSHOT_OVERLAP_SECONDS,
+)
+from app.utils.match_keys import MATCH_KEY_COLUMNS
+from database.models import Patient
+
+SNAPSHOT_COLUMNS = tuple(column.name for column in Patient.__table__.columns if column.name != "embedding")
+# Columns of Patient.to_dict, in its order
+_DICT_COLUMNS = tuple(column for column in SNAPSHOT_COLUMNS if column not in MATCH_KEY_COLUMNS)
+
+# Records sampled to estimate the memory footprint
+_MEMORY_SAMPLE = 1000
+
+
+class PatientRecord:
+    """
+    Immutable-by-convention copy of one patients row.
+    """
+
+    __slots__ = SNAPSHOT_COLUMNS
+
+    def __init__(self, row):
+        for column, value in zip(SNAPSHOT_COLUMNS, row):
+            setattr(self, column, value)
+
+    def to_dict(self) -> dict:
+        # Same shape as Patient.to_dict; the vector itself is not kept here
+        data = {column: getattr(self, column) for column in _DICT_COLUMNS}
+        for column in ("dob", "visit_date", "created_at", "updated_at"):
+            data[column] = data[column].isoformat() if data[column] else None
+        data["embedding"] = None
+        return data
+
+
+class PatientSnapshot:
+    def __init__(self):
+        self._records: Dict[int, PatientRecord] = {}
+        self._ordered: List[PatientRecord] = []
+        self._lock = threading.Lock()
+        self.version = 0
+        self.synced_until: Optional[datetime] = None
+        self._dirty = True
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self._counters = {
+            "full_reloads": 0,
+            "delta_refreshes": 0,
+            "rows_refreshed": 0,
+            "invalidations": 0,
+            "last_refresh_ms": 0.0,
+            "last_refresh_rows": 0,
+            "last_full_reload_ms": 0.0,
+        }
+
+    def invalidate(self):
+        self._dirty = True
+        self._counters["invalidations"] += 1
+
+    def records(self, db: Session) -> List[PatientRecord]:
+        self.refresh(db)
+        return self._ordered
+
+    def version_of(self, records) -> Optional[int]:
+        """
+        The current version when ``records`` is the list ``records()`` returns now,
+        otherwise None (an older list, or records from elsewhere).
+        """
+        with self._lock:
+            return self.version if records is self._ordered else None
+
+    def get(self, db: Session, patient_id: int) -> Optional[PatientRecord]:
+        self.refresh(db)
+        return self._records.get(patient_id)
+
+    def refresh(self, db: Session, force_full: bool = False):
+        now = time.monotonic()
+        if not (force_full or self._dirty or now - self._checked_at >= PATIENT_SNAPSHOT_MAX_AGE_SECONDS):
+            return
+
+        with self._lock:
+            started = time.perf_counter()
+            self._dirty = False
+            if force_full or self.synced_until is None or now - self._loaded_at >= PATIENT_SNAPSHOT_FULL_RELOAD_SECONDS:
+                self._full_reload(db)
+                self._loaded_at = now
+                self._counters["full_reloads"] += 1
+                self._counters["last_full_reload_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                rows = len(self._records)
+            else:
+                rows = self._delta_refresh(db)
+                self._counters["delta_refreshes"] += 1
+            self._checked_at = now
+            self._counters["rows_refreshed"] += rows
+            self._counters["last_refresh_rows"] = rows
+            self._counters["last_refresh_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _query(self, db: Session):
+        return db.query(*(Patient.__table__.c[column] for column in SNAPSHOT_COLUMNS))
+
+    def _full_reload(self, db: Session):
+        records = {}
+        synced_until = None
+        for row in self._query(db).order_by(Patient.id).yield_per(5000):
+            record = PatientRecord(row)
+            records[record.id] = record
+            if record.updated_at and (synced_until is None or record.updated_at > synced_until):
+                synced_until = record.updated_at
+        self._records = records
+        self._ordered = list(records.values())
+        self.synced_until = synced_until or datetime.min
+        self.version += 1
+
+    def _delta_refresh(self, db: Session) -> int:
+        since = self.synced_until
+        if since > datetime.min + timedelta(seconds=PATIENT_SNAPSHOT_OVERLAP_SECONDS):
+            since -= timedelta(seconds=PATIENT_SNAPSHOT_OVERLAP_SECONDS)
+        rows = self._query(db).filter(Patient.updated_at >= since).order_by(Patient.id).all()
+
+        changed = False
+        for row in rows:
+            record = PatientRecord(row)
+            current = self._records.get(record.id)
+            if record.updated_at and record.updated_at > self.synced_until:
+                self.synced_until = record.updated_at
+            if current is not None and current.updated_at == record.updated_at:
+                continue
+            # Copy on write: readers keep iterating the previous dict and list
+            if not changed:
+                self._records = dict(self._records)
+                changed = True
+            self._records[record.id] = record
+
+        if changed:
+            self._ordered = list(self._records.values())
+            self.version += 1
+        return len(rows)
+
+    def stats(self) -> dict:
+        records = self._ordered
+        sample = records[:_MEMORY_SAMPLE]
+        per_record = (
+            sum(sys.getsizeof(r) + sum(sys.getsizeof(getattr(r, c)) for c in SNAPSHOT_COLUMNS) for r in sample) / len(sample)
+            if sample else 0
+        )
+        memory = per_record * len(records) + sys.getsizeof(self._records) + sys.getsizeof(records)
+        return {
+            "records": len(records),
+            "version": self.version,
+            "synced_until": self.synced_until.isoformat() if self.synced_until and self.synced_until != datetime.min else None,
+            "estimated_memory_bytes": int(memory),
+            "estimated_memory_mb": round(memory / 2 ** 20, 2),
+            **self._counters,
+        }
+
+
+patient_snapshot = PatientSnapshot()
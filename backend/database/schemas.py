@@ -35,6 +35,14 @@ class PatientData(BaseModel):
 
 class FuzzyMatchRequest(BaseModel):
     patients: List[PatientData]
+    # Blocking keys for candidate generation; None uses MATCH_BLOCKING_KEYS, ["none"] scans all
+    blocking_keys: Optional[List[str]] = None
+    # Multi-process fuzzy stage; None decides by batch size (MATCH_PARALLEL_MIN_BATCH)
+    parallel: Optional[bool] = None
+
+class FuzzyMatchJobRequest(FuzzyMatchRequest):
+    # Records per chunk; None uses MATCH_JOB_CHUNK_SIZE
+    chunk_size: Optional[int] = None
 
 
 class VitalSigns(BaseModel):
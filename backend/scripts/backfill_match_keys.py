@@ -0,0 +1,44 @@
+# backfill_match_keys.py
+# Populates the normalized match key columns for patients written before they existed.
+# Usage: python -m scripts.backfill_match_keys [--batch-size N] [--all]
+import argparse
+from database.database import SessionLocal
+from database.models import Patient
+from app.utils.match_keys import compute_match_keys
+
+
+def backfill(db, batch_size: int, recompute_all: bool = False) -> int:
+    query = db.query(Patient.id, Patient.name, Patient.address, Patient.email, Patient.phone)
+    if not recompute_all:
+        query = query.filter(Patient.name_key.is_(None))
+
+    updated, last_id = 0, 0
+    while True:
+        # Keyset pagination so each batch commits independently
+        rows = query.filter(Patient.id > last_id).order_by(Patient.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.bulk_update_mappings(Patient, [{"id": row.id, **compute_match_keys(row)} for row in rows])
+        db.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+        print(f"… {updated} patients updated")
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill patient match keys")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--all", action="store_true", help="Recompute keys for every patient")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        updated = backfill(db, args.batch_size, recompute_all=args.all)
+    finally:
+        db.close()
+    print(f"✅ Backfilled match keys for {updated} patients.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# build_vector_index.py
+# Rebuilds the on-disk IVF index over patients.embedding.
+# Usage: python -m scripts.build_vector_index [--nlist N] [--dir PATH]
+import argparse
+from database.database import SessionLocal
+from app.config import VECTOR_INDEX_DIR, VECTOR_INDEX_NLIST
+from app.services.embedding_service import rebuild_vector_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the patient embedding vector index")
+    parser.add_argument("--dir", default=VECTOR_INDEX_DIR, help="Index output directory")
+    parser.add_argument("--nlist", type=int, default=VECTOR_INDEX_NLIST, help="Number of inverted lists (0 = auto)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        index = rebuild_vector_index(db, directory=args.dir, nlist=args.nlist)
+    finally:
+        db.close()
+
+    if index is None:
+        print("❌ No embeddings found, index not built.")
+    else:
+        print(f"✅ Indexed {len(index)} patients in {index.nlist} lists -> {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
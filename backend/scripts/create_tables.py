@@ -1,6 +1,11 @@
 # create_tables.py
+from sqlalchemy import text
 from database.database import engine
 from database.models import Base
 
+# Trigram indexes on patients need pg_trgm
+with engine.begin() as conn:
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 Base.metadata.create_all(bind=engine)
 print("✅ Tables created.")
\ No newline at end of file
@@ -32,4 +32,83 @@ CREATE TABLE IF NOT EXISTS patient_contexts (
     patient_id INT NOT NULL REFERENCES patients(id),
     context_json JSONB NOT NULL,
     created_at TIMESTAMP DEFAULT NOW()
-);
\ No newline at end of file
+);
+
+-- Exact identifier lookups used by the matcher's identifier index
+ALTER TABLE patients
+    ADD COLUMN IF NOT EXISTS medical_record_number VARCHAR;
+
+CREATE INDEX IF NOT EXISTS ix_patients_ssn ON patients (ssn);
+CREATE INDEX IF NOT EXISTS ix_patients_medical_record_number ON patients (medical_record_number);
+CREATE INDEX IF NOT EXISTS ix_patients_insurance_number ON patients (insurance_number);
+
+-- Normalized match keys written with each patient (see app/utils/match_keys.py)
+ALTER TABLE patients
+    ADD COLUMN IF NOT EXISTS name_key VARCHAR,
+    ADD COLUMN IF NOT EXISTS address_key TEXT,
+    ADD COLUMN IF NOT EXISTS email_key VARCHAR,
+    ADD COLUMN IF NOT EXISTS phone_key VARCHAR,
+    ADD COLUMN IF NOT EXISTS phone_digits VARCHAR,
+    ADD COLUMN IF NOT EXISTS email_canonical VARCHAR,
+    ADD COLUMN IF NOT EXISTS name_phonetic VARCHAR;
+
+-- Incremental refresh of the in-memory patient snapshot reads rows by updated_at
+CREATE INDEX IF NOT EXISTS ix_patients_updated_at ON patients (updated_at);
+
+-- Database-side candidate retrieval (see find_similar_patient_ids in database/patient_repository.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_patients_name ON patients (name);
+CREATE INDEX IF NOT EXISTS ix_patients_dob ON patients (dob);
+CREATE INDEX IF NOT EXISTS ix_patients_name_trgm ON patients USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_patients_address_trgm ON patients USING gin (address gin_trgm_ops);
+
+-- Duplicate clusters written by the linking job (scripts/link_patients.py)
+ALTER TABLE patients
+    ADD COLUMN IF NOT EXISTS cluster_id INT;
+
+CREATE INDEX IF NOT EXISTS ix_patients_cluster_id ON patients (cluster_id);
+
+CREATE TABLE IF NOT EXISTS patient_link_runs (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    watermark TIMESTAMP,
+    full_run BOOLEAN DEFAULT FALSE,
+    patients_processed INT DEFAULT 0,
+    pairs_found INT DEFAULT 0,
+    clusters_updated INT DEFAULT 0
+);
+
+-- OCR results keyed by document content hash (see database/ocr_result_repository.py)
+CREATE TABLE IF NOT EXISTS ocr_results (
+    content_hash VARCHAR(64) PRIMARY KEY,
+    file_type VARCHAR NOT NULL,
+    s3_path VARCHAR NOT NULL,
+    ocr_engine VARCHAR NOT NULL,
+    extracted_text TEXT NOT NULL,
+    blocks JSONB,
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_hit_at TIMESTAMP,
+    hit_count INT DEFAULT 0
+);
+
+-- Durable background jobs claimed by worker processes (see app/services/job_queue.py)
+CREATE TABLE IF NOT EXISTS jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    kind VARCHAR NOT NULL,
+    payload JSON NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_by VARCHAR,
+    locked_until TIMESTAMP,
+    result JSON,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (status, run_after);
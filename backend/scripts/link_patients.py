@@ -0,0 +1,48 @@
+# link_patients.py
+# Finds duplicate patients already in the table and writes their cluster ids.
+# Incremental by default: only patients changed since the previous run are compared.
+# Usage: python -m scripts.link_patients [--full] [--no-embeddings] [--threshold N] [--workers N]
+import argparse
+from database.database import SessionLocal
+from app.config import LINK_MAX_BLOCK_SIZE, LINK_WORKERS
+from app.services.embedding_service import load_vector_index
+from app.services.patient_linker import LINK_THRESHOLD, link_patients
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Link duplicate patients into clusters")
+    parser.add_argument("--full", action="store_true", help="Recompute every cluster instead of only changed patients")
+    parser.add_argument("--no-embeddings", action="store_true", help="Link on fuzzy scores only")
+    parser.add_argument("--threshold", type=float, default=LINK_THRESHOLD, help="Fuzzy score needed to link two patients")
+    parser.add_argument("--blocking", default=None, help="Comma-separated blocking keys (default MATCH_BLOCKING_KEYS)")
+    parser.add_argument("--max-block", type=int, default=LINK_MAX_BLOCK_SIZE, help="Skip blocks larger than this")
+    parser.add_argument("--workers", type=int, default=LINK_WORKERS, help="Scoring processes (1 = in-process)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if not args.no_embeddings:
+            load_vector_index(db)
+        summary = link_patients(
+            db,
+            full=args.full,
+            threshold=args.threshold,
+            blocking_keys=args.blocking.split(",") if args.blocking else None,
+            max_block=args.max_block,
+            use_embeddings=not args.no_embeddings,
+            workers=args.workers,
+        )
+    finally:
+        db.close()
+
+    mode = "full" if summary["full_run"] else "incremental"
+    print(f"✅ {mode.capitalize()} run: {summary['patients_processed']}/{summary['patients']} patients processed, "
+          f"{summary['pairs_compared']} pairs compared, "
+          f"{summary['fuzzy_links'] + summary['embedding_links']} links, "
+          f"{summary['rows_updated']} cluster ids updated in {summary['seconds']}s")
+    if summary["oversized_blocks_skipped"]:
+        print(f"… skipped {summary['oversized_blocks_skipped']} blocks larger than {args.max_block}")
+
+
+if __name__ == "__main__":
+    main()
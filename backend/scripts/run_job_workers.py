@@ -0,0 +1,39 @@
+# run_job_workers.py
+# Starts background job worker processes that claim and run jobs from the jobs table.
+# Run as many of these as needed, on as many hosts as needed; workers never share a job.
+# Usage: python -m scripts.run_job_workers [--workers N] [--kinds document,ner,fuzzy_match]
+import argparse
+import signal
+from app.config import JOB_WORKER_PROCESSES
+from app.services.job_queue import start_workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKER_PROCESSES, help="Worker processes to start")
+    parser.add_argument("--kinds", default=None, help="Comma-separated job kinds to run (default all)")
+    args = parser.parse_args()
+
+    kinds = args.kinds.split(",") if args.kinds else None
+    processes = start_workers(args.workers, kinds)
+    print(f"✅ Started {len(processes)} job workers for {', '.join(kinds) if kinds else 'all job kinds'}")
+
+    def stop(*_):
+        # Workers finish their current job, then exit
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        print(f"❌ Workers exited with errors: {', '.join(failed)}")
+    else:
+        print("✅ All job workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,24 @@
-import openai
 import psycopg2
 import os
 import json
+from app.utils.embeddings_utils import get_openai_embeddings
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 conn = psycopg2.connect(dbname="medifusion", user="postgres", password="postgres")
 cursor = conn.cursor()
 
 cursor.execute("SELECT id, name, diagnosis, medical_conditions FROM patients WHERE embedding IS NULL")
 rows = cursor.fetchall()
 
-for row in rows:
-    pid, name, diagnosis, conditions = row
-    text = f"{name}, {diagnosis or ''}, {', '.join(conditions or [])}"
-    response = openai.Embedding.create(model="text-embedding-3-small", input=text)
-    embedding = response['data'][0]['embedding']
+# One batched, cached call for every row instead of one request per patient
+texts = [
+    f"{name}, {diagnosis or ''}, {', '.join(conditions or [])}"
+    for _, name, diagnosis, conditions in rows
+]
+embeddings = get_openai_embeddings(texts)
 
-    cursor.execute("UPDATE patients SET embedding = %s WHERE id = %s", (embedding, pid))
+for (pid, *_), embedding in zip(rows, embeddings):
+    cursor.execute("UPDATE patients SET embedding = %s WHERE id = %s", (json.dumps(embedding), pid))
 
 conn.commit()
 cursor.close()
-conn.close()
\ No newline at end of file
+conn.close()
@@ -0,0 +1,879 @@
+import asyncio
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("S3_BUCKET", "test-bucket")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from botocore.exceptions import ClientError
+
+from app.routes import ingestion
+from app.services.ocr_engines import OcrDocument, OcrEngine, OcrRouter
+from app.services.textract_poller import TextractJobError, TextractPoller
+
+
+def _client():
+    app = FastAPI()
+    app.include_router(ingestion.ingestion_router, prefix="/api/ingestion")
+    return TestClient(app)
+
+
+class FakeEngine(OcrEngine):
+    def __init__(self, name, extract, file_types=("pdf", "image"), max_bytes=None, available=True):
+        self.name = name
+        self._extract = extract
+        self.file_types = file_types
+        self.max_bytes = max_bytes
+        self._available = available
+        self.calls = 0
+
+    def available(self):
+        return self._available
+
+    async def extract(self, document):
+        self.calls += 1
+        return await self._extract(document)
+
+
+def _route_ocr_to(monkeypatch, extract, name="aws_textract"):
+    engine = FakeEngine(name, extract)
+    monkeypatch.setattr(ingestion, "ocr_router", OcrRouter([engine]))
+    return engine
+
+
+def test_upload_processes_files_concurrently_in_order(monkeypatch):
+    active, peak = [0], [0]
+
+    async def slow_textract(document):
+        s3_path = document.s3_path
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.3)
+        active[0] -= 1
+        return [{"BlockType": "LINE", "Text": f"text of {s3_path.rsplit('/', 1)[-1]}"}]
+
+    monkeypatch.setattr(ingestion, "upload_fileobj_to_s3", lambda fileobj, name: f"s3://test-bucket/uploads/{name}")
+    _route_ocr_to(monkeypatch, slow_textract)
+    monkeypatch.setattr(ingestion, "INGESTION_MAX_CONCURRENCY", 4)
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+
+    files = [("files", (f"doc{i}.pdf", f"%PDF-1.4 {i}".encode(), "application/pdf")) for i in range(8)]
+    files.insert(3, ("files", ("notes.txt", b"hello", "text/plain")))
+
+    started = time.perf_counter()
+    response = _client().post("/api/ingestion/upload", files=files)
+    elapsed = time.perf_counter() - started
+
+    results = response.json()["results"]
+    assert [r["filename"] for r in results] == ["doc0.pdf", "doc1.pdf", "doc2.pdf", "notes.txt"] + [f"doc{i}.pdf" for i in range(3, 8)]
+    assert "Unsupported file type" in results[3]["error"]
+    assert all(r["extracted_text"].startswith("text of ") for r in results if "error" not in r)
+    # Eight 0.3s files, four at a time: two waves instead of eight
+    assert peak[0] == 4
+    assert elapsed < 1.5
+
+
+class StubTextract:
+    """
+    Local stand-in for the Textract async API. Each job reports IN_PROGRESS for
+    ``polls`` calls, then returns its lines spread over result pages chained by
+    NextToken.
+    """
+
+    def __init__(self, polls=2, lines_per_page=2, fail=(), throttle=0):
+        self.polls = polls
+        self.lines_per_page = lines_per_page
+        self.fail = set(fail)
+        self.throttle = throttle
+        self.jobs = {}
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def start_document_text_detection(self, DocumentLocation):
+        key = DocumentLocation["S3Object"]["Name"]
+        job_id = f"job-{key}"
+        self.jobs[job_id] = {"key": key, "polls": 0}
+        return {"JobId": job_id}
+
+    def get_document_text_detection(self, JobId, NextToken=None):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.01)
+            job = self.jobs[JobId]
+            if NextToken is None:
+                if self.throttle:
+                    self.throttle -= 1
+                    raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "GetDocumentTextDetection")
+                job["polls"] += 1
+                if job["polls"] <= self.polls:
+                    return {"JobStatus": "IN_PROGRESS"}
+                if job["key"] in self.fail:
+                    return {"JobStatus": "FAILED", "StatusMessage": "Unsupported document"}
+            page = int(NextToken or 0)
+            lines = [f"{job['key']} line {page * self.lines_per_page + i}" for i in range(self.lines_per_page)]
+            response = {"JobStatus": "SUCCEEDED", "Blocks": [{"BlockType": "PAGE"}] + [{"BlockType": "LINE", "Text": line} for line in lines]}
+            if page < 2:
+                response["NextToken"] = str(page + 1)
+            return response
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def _poller(client, **kwargs):
+    options = dict(initial_delay=0.01, max_delay=0.05, backoff=2.0, timeout=5)
+    options.update(kwargs)
+    return TextractPoller(client, **options)
+
+
+def test_textract_poller_multiplexes_jobs_and_reads_every_page():
+    client = StubTextract(polls=3)
+    poller = _poller(client, max_concurrent_calls=3)
+
+    async def run():
+        return await asyncio.gather(*(poller.extract_text("medifusion", f"doc{i}.pdf") for i in range(6)))
+
+    texts = asyncio.run(run())
+
+    # Three result pages of two lines each, in page order
+    assert texts[4].splitlines() == [f"doc4.pdf line {i}" for i in range(6)]
+    assert all(len(text.splitlines()) == 6 for text in texts)
+    # Six jobs x (3 in-progress polls + 3 result pages), never more than 3 calls in flight
+    assert client.calls == 36
+    assert client.peak == 3
+
+
+def test_textract_poller_reports_failed_jobs_and_timeouts():
+    async def wait(poller, key, **kwargs):
+        return await poller.wait(await poller.start("medifusion", key), **kwargs)
+
+    poller = _poller(StubTextract(polls=1, fail={"bad.pdf"}))
+    with pytest.raises(TextractJobError, match="Unsupported document"):
+        asyncio.run(wait(poller, "bad.pdf"))
+
+    poller = _poller(StubTextract(polls=1000))
+    with pytest.raises(TextractJobError, match="did not finish"):
+        asyncio.run(wait(poller, "slow.pdf", timeout=0.2))
+
+
+def test_textract_poller_retries_throttled_polls():
+    client = StubTextract(polls=0, throttle=2)
+    text = asyncio.run(_poller(client).extract_text("medifusion", "doc.pdf"))
+    assert len(text.splitlines()) == 6
+
+
+def test_client_registry_builds_each_client_once_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    import openai
+
+    from app.services.client_registry import ClientRegistry
+
+    registry = ClientRegistry()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: registry.aws("s3"), range(32)))
+    session = registry.openai_session()
+
+    assert all(client is clients[0] for client in clients)
+    assert clients[0].meta.config.max_pool_connections >= 10
+    assert registry.openai_session() is session
+    # The openai SDK gets its session from the shared registry
+    assert callable(openai.requestssession)
+
+    stats = registry.stats()
+    assert stats["s3"]["clients_created"] == 1
+    assert stats["s3"]["client_lookups"] == 32
+    assert stats["openai"]["clients_created"] == 1
+    registry.close()
+
+
+def test_openai_sessions_share_one_pool_that_survives_sdk_close():
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from app.services.client_registry import ClientRegistry
+
+    class KeepAliveHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    registry = ClientRegistry()
+
+    def call(_):
+        session = registry.openai_session()
+        assert session.get(url).text == "ok"
+        # What the openai SDK does once a thread's session is 180s old
+        session.close()
+        return session
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as first, ThreadPoolExecutor(max_workers=1) as second:
+            sessions = list(first.map(call, range(3))) + list(second.map(call, range(3)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # A session per thread, one adapter behind all of them
+    assert sessions[0] is sessions[2] and sessions[0] is not sessions[3]
+    assert sessions[0].get_adapter("https://") is sessions[3].get_adapter("https://")
+    stats = registry.stats()["openai"]
+    assert stats["requests_sent"] == 6
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 5
+    registry.close()
+
+
+class StubS3:
+    def __init__(self, fail_on_part=None):
+        self.fail_on_part = fail_on_part
+        self.objects = {}
+        self.uploads = {}
+        self.part_sizes = []
+        self.aborted = []
+        self.deleted = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.read()
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_on_part:
+            raise ClientError({"Error": {"Code": "InternalError", "Message": "boom"}}, "UploadPart")
+        self.part_sizes.append(len(Body))
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [p["PartNumber"] for p in MultipartUpload["Parts"]] == sorted(parts)
+        self.objects[Key] = b"".join(parts[n] for n in sorted(parts))
+
+    def delete_object(self, Bucket, Key):
+        self.deleted.append(Key)
+        self.objects.pop(Key, None)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId)
+
+
+def test_upload_streams_to_s3_in_parts_without_temp_files(monkeypatch, tmp_path):
+    from PIL import Image
+
+    s3 = StubS3()
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    monkeypatch.setattr(ingestion, "S3_UPLOAD_PART_SIZE", 1024)
+    _route_ocr_to(monkeypatch, lambda document: asyncio.sleep(0, []))
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+    monkeypatch.setattr(ingestion, "OCR_IMAGE_PREPROCESS", False)
+    # Anything the route writes to a temp dir would land here
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    pdf = os.urandom(2500)
+    webp = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(webp, format="WEBP")
+    files = [
+        ("files", ("scan.pdf", pdf, "application/pdf")),
+        ("files", ("photo.webp", webp.getvalue(), "image/webp")),
+    ]
+    results = _client().post("/api/ingestion/upload", files=files).json()["results"]
+
+    assert [r["file_type"] for r in results] == ["pdf", "png"]
+    keys = {r["filename"]: r["s3_path"].split("/", 3)[-1] for r in results}
+    # 2500 bytes in 1 KB parts: two full parts and the rest
+    assert s3.part_sizes == [1024, 1024, 452]
+    assert s3.objects[keys["scan.pdf"]] == pdf
+    # WebP converted in memory and sent in one PUT
+    assert s3.objects[keys["photo.webp"]].startswith(b"\x89PNG")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_multipart_upload_is_aborted(monkeypatch):
+    s3 = StubS3(fail_on_part=2)
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    monkeypatch.setattr(ingestion, "S3_UPLOAD_PART_SIZE", 1024)
+
+    with pytest.raises(ingestion.HTTPException, match="S3 upload failed"):
+        ingestion.upload_fileobj_to_s3(io.BytesIO(os.urandom(4000)), "scan.pdf")
+    assert s3.aborted == ["upload-0"]
+    assert s3.objects == {} and s3.uploads == {}
+
+
+def test_identical_uploads_reuse_cached_ocr_result(monkeypatch):
+    s3 = StubS3()
+    cache, ocr_calls = {}, []
+
+    async def fake_textract(document):
+        ocr_calls.append(document.s3_path)
+        return [{"BlockType": "PAGE"}, {"BlockType": "LINE", "Text": "Discharge summary"}]
+
+    def store(document_hash, file_type, s3_path, ocr_engine, extracted_text, blocks):
+        cache[document_hash] = {"s3_path": s3_path, "file_type": file_type, "ocr_engine": ocr_engine,
+                                "extracted_text": extracted_text, "blocks": blocks}
+
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    _route_ocr_to(monkeypatch, fake_textract)
+    monkeypatch.setattr(ingestion, "lookup_ocr_result", cache.get)
+    monkeypatch.setattr(ingestion, "store_ocr_result", store)
+
+    client = _client()
+    first, second = (
+        client.post("/api/ingestion/upload", files=[("files", (name, b"%PDF-1.4 discharge", "application/pdf"))]).json()["results"][0]
+        for name in ("discharge.pdf", "discharge-copy.pdf")
+    )
+
+    assert (first["ocr_cache_hit"], second["ocr_cache_hit"]) == (False, True)
+    assert first["content_hash"] == second["content_hash"]
+    assert first["s3_path"] == second["s3_path"] == f"s3://medifusion/uploads/{first['content_hash']}.pdf"
+    assert second["extracted_text"] == first["extracted_text"] == "Discharge summary"
+    # One upload and one OCR job for both requests
+    assert len(s3.objects) == 1 and len(ocr_calls) == 1
+    assert cache[first["content_hash"]]["blocks"][1]["Text"] == "Discharge summary"
+    assert first["ocr_engine_used"] == second["ocr_engine_used"] == "aws_textract"
+    # Blocks come back too, from the OCR run and from the cache
+    assert first["blocks"] == second["blocks"] == [{"BlockType": "PAGE"}, {"BlockType": "LINE", "Text": "Discharge summary"}]
+
+
+def test_page_stream_replays_cached_pdf_without_upload_or_ocr(monkeypatch):
+    async def no_ocr(document):
+        raise AssertionError("cached document OCR'd again")
+
+    def no_upload(*args):
+        raise AssertionError("cached document uploaded again")
+
+    cached = {"s3_path": "s3://medifusion/uploads/abc.pdf", "file_type": "pdf", "ocr_engine": "aws_textract",
+              "extracted_text": "first\nsecond", "blocks": [
+                  {"BlockType": "PAGE", "Page": 1},
+                  {"BlockType": "LINE", "Text": "first", "Page": 1},
+                  {"BlockType": "LINE", "Text": "second", "Page": 2},
+              ]}
+    monkeypatch.setattr(ingestion, "lookup_ocr_result", lambda document_hash: cached)
+    monkeypatch.setattr(ingestion, "process_upload", no_upload)
+    _route_ocr_to(monkeypatch, no_ocr)
+
+    response = _client().post("/api/ingestion/upload/pages", files={"file": ("scan.pdf", b"%PDF-1.4 scan", "application/pdf")})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["page"], line["text"]) for line in lines[:-1]] == [(1, "first"), (2, "second")]
+    assert lines[-1]["ocr_cache_hit"] and lines[-1]["s3_path"] == cached["s3_path"] and lines[-1]["pages"] == 2
+
+
+def test_ocr_router_picks_engine_by_type_size_and_latency():
+    def engine(name, delay, **kwargs):
+        async def extract(document):
+            await asyncio.sleep(delay)
+            return [{"BlockType": "LINE", "Text": name}]
+        return FakeEngine(name, extract, **kwargs)
+
+    local = engine("tesseract", 0.0, file_types=("image",), max_bytes=1000)
+    textract = engine("aws_textract", 0.03)
+    missing = engine("other", 0.0, available=False)
+    router = OcrRouter([local, textract, missing], ["tesseract", "aws_textract", "other"], min_samples=2, explore_every=0)
+
+    async def run(file_type, size, times=1):
+        return [await router.extract(OcrDocument("s3://medifusion/doc", file_type, size)) for _ in range(times)]
+
+    # PDFs and large images only fit Textract
+    assert [name for name, _ in asyncio.run(run("pdf", 10))] == ["aws_textract"]
+    assert [name for name, _ in asyncio.run(run("image", 5000))] == ["aws_textract"]
+    # Small images: both engines get measured, then the faster local one wins
+    names = [name for name, _ in asyncio.run(run("image", 10, times=6))]
+    assert set(names[:3]) == {"tesseract", "aws_textract"}
+    assert names[3:] == ["tesseract"] * 3
+    assert [e.name for e in router.candidates("image", 10)] == ["tesseract", "aws_textract"]
+    assert "other" not in [e.name for e in router.candidates("image", 10)]
+
+
+def test_ocr_router_falls_back_when_an_engine_fails():
+    async def broken(document):
+        raise RuntimeError("engine down")
+
+    async def working(document):
+        return [{"BlockType": "LINE", "Text": "ok"}]
+
+    router = OcrRouter([FakeEngine("tesseract", broken), FakeEngine("aws_textract", working)])
+    name, blocks = asyncio.run(router.extract(OcrDocument("s3://medifusion/doc", "image", 10)))
+    assert (name, blocks[0]["Text"]) == ("aws_textract", "ok")
+    assert router.stats()["tesseract"]["failures"] == 1
+
+    router = OcrRouter([FakeEngine("tesseract", broken)])
+    assert asyncio.run(router.extract(OcrDocument("s3://medifusion/doc", "image", 10))) == (None, None)
+
+
+def test_ocr_engine_without_extract_cannot_be_created():
+    class Incomplete(OcrEngine):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_ocr_router_puts_failing_engine_last_during_cooldown():
+    async def broken(document):
+        raise RuntimeError("invalid API key")
+
+    async def working(document):
+        return [{"BlockType": "LINE", "Text": "ok"}]
+
+    failing, healthy = FakeEngine("openai_vision", broken), FakeEngine("aws_textract", working)
+    router = OcrRouter([failing, healthy], explore_every=2, failure_cooldown=0.2)
+    document = OcrDocument("s3://medifusion/doc", "image", 10)
+
+    for _ in range(10):
+        assert asyncio.run(router.extract(document))[0] == "aws_textract"
+    # Unmeasured and never successful, yet tried once rather than on every document
+    assert failing.calls == 1 and router.stats()["openai_vision"]["cooling_down"]
+
+    time.sleep(0.25)
+    asyncio.run(router.extract(document))
+    # Retried after the cooldown, failed again: the next cooldown is twice as long
+    assert failing.calls == 2
+    time.sleep(0.25)
+    asyncio.run(router.extract(document))
+    assert failing.calls == 2
+
+
+def _blank_pdf(pages):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+async def _page_numbering_ocr(document):
+    from pypdf import PdfReader
+
+    # Range "uploads/pages/<hash>.p<first>-<last>.pdf"; later ranges finish first
+    first = int(re.search(r"\.p(\d+)-\d+\.pdf$", document.s3_path).group(1))
+    await asyncio.sleep(0.2 / first)
+    pages = len(PdfReader(document.fileobj).pages)
+    return [{"BlockType": "LINE", "Page": i + 1, "Text": f"page {first + i}"} for i in range(pages)]
+
+
+def test_pdf_pages_are_ocrd_in_parallel_ranges_and_yielded_in_order():
+    from app.services.pdf_page_ocr import ocr_pdf_pages
+
+    uploads, deleted = [], []
+    router = OcrRouter([FakeEngine("aws_textract", _page_numbering_ocr)])
+
+    def upload(fileobj, name):
+        uploads.append(name)
+        return f"s3://medifusion/uploads/{name}"
+
+    async def run():
+        yielded, started = [], time.perf_counter()
+        async for page in ocr_pdf_pages(io.BytesIO(_blank_pdf(7)), "pages/abc", upload, deleted.append, router=router,
+                                        pages_per_range=3, max_concurrent=3):
+            yielded.append((page.number, page.text, page.blocks[0]["Page"], time.perf_counter() - started))
+        return yielded
+
+    pages = asyncio.run(run())
+
+    assert [(n, text, block_page) for n, text, block_page, _ in pages] == [(n, f"page {n}", n) for n in range(1, 8)]
+    assert sorted(uploads) == ["pages/abc.p1-3.pdf", "pages/abc.p4-6.pdf", "pages/abc.p7-7.pdf"]
+    # Range PDFs are removed once OCR'd
+    assert sorted(deleted) == [f"s3://medifusion/uploads/{name}" for name in sorted(uploads)]
+    # Ranges ran side by side: the slowest range (0.2s) bounds the whole document
+    assert pages[-1][3] < 0.35
+
+
+def test_upload_with_page_parallel_ocr(monkeypatch):
+    s3 = StubS3()
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+    _route_ocr_to(monkeypatch, _page_numbering_ocr)
+    monkeypatch.setattr("app.services.pdf_page_ocr.ocr_router", ingestion.ocr_router)
+    monkeypatch.setattr("app.services.pdf_page_ocr.OCR_PDF_PAGES_PER_RANGE", 2)
+    pdf = _blank_pdf(5)
+
+    client = _client()
+    result = client.post("/api/ingestion/upload?page_parallel=true",
+                         files=[("files", ("record.pdf", pdf, "application/pdf"))]).json()["results"][0]
+    assert result["extracted_text"].splitlines() == [f"page {n}" for n in range(1, 6)]
+    assert result["ocr_engine_used"] == "aws_textract"
+
+    response = client.post("/api/ingestion/upload/pages", files=[("file", ("record.pdf", pdf, "application/pdf"))])
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["page"] for line in lines[:-1]] == [1, 2, 3, 4, 5]
+    assert lines[-1]["pages"] == 5 and lines[-1]["failed_pages"] == []
+    # Only the whole documents are left in the bucket, not their range PDFs
+    assert len(s3.deleted) == 6
+    assert not [key for key in s3.objects if "/pages/" in key]
+
+
+def test_pdf_without_pages_is_rejected_before_ocr(monkeypatch):
+    s3, stored = StubS3(), []
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", True)
+    monkeypatch.setattr(ingestion, "lookup_ocr_result", lambda document_hash: None)
+    monkeypatch.setattr(ingestion, "store_ocr_result", lambda *args: stored.append(args))
+    _route_ocr_to(monkeypatch, _page_numbering_ocr)
+    monkeypatch.setattr("app.services.pdf_page_ocr.ocr_router", ingestion.ocr_router)
+    pdf = _blank_pdf(0)
+
+    client = _client()
+    result = client.post("/api/ingestion/upload?page_parallel=true",
+                         files=[("files", ("empty.pdf", pdf, "application/pdf"))]).json()["results"][0]
+    assert result["error"] == "PDF has no pages"
+
+    response = client.post("/api/ingestion/upload/pages", files=[("file", ("empty.pdf", pdf, "application/pdf"))])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "PDF has no pages"
+    assert stored == []
+
+
+def _photo(size=(4000, 3000), orientation=6, **save):
+    from PIL import Image
+
+    image = Image.new("RGB", size, "white")
+    # Some structure so JPEG sizes are realistic
+    for x in range(0, size[0], 40):
+        image.paste((30, 60, 90), (x, 0, x + 8, size[1]))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95, exif=exif, **save)
+    return buffer.getvalue()
+
+
+def test_preprocess_image_rotates_grayscales_and_downscales():
+    from PIL import Image
+
+    from app.services.image_preprocessing import preprocess_image
+
+    processed, report = preprocess_image(_photo(), max_dimension=2000)
+    with Image.open(io.BytesIO(processed)) as image:
+        # EXIF orientation 6: the 4000x3000 landscape is upright as 3000x4000 portrait
+        assert (image.mode, image.size) == ("L", (1500, 2000))
+    assert report["rotated"] and report["scale"] == 0.5
+    assert report["processed_bytes"] < report["original_bytes"]
+
+    # Scanned at 600 DPI: brought down to the 300 DPI target
+    _, report = preprocess_image(_photo((2400, 1200), orientation=1, dpi=(600, 600)), target_dpi=300, max_dimension=5000)
+    assert report["processed_size"] == [1200, 600] and not report["rotated"]
+
+
+def test_upload_sends_preprocessed_image_bytes_to_ocr(monkeypatch):
+    from app.services.image_preprocessing import ImagePreprocessor
+
+    s3, seen = StubS3(), []
+    preprocessor = ImagePreprocessor(workers=1)
+
+    async def record(document):
+        seen.append(document.fileobj.read())
+        return [{"BlockType": "LINE", "Text": "Rx"}]
+
+    monkeypatch.setattr(ingestion.client_registry, "aws", lambda service: s3)
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+    monkeypatch.setattr(ingestion, "image_preprocessor", preprocessor)
+    _route_ocr_to(monkeypatch, record)
+    photo = _photo()
+
+    try:
+        result = _client().post("/api/ingestion/upload", files=[("files", ("rx.jpg", photo, "image/jpeg"))]).json()["results"][0]
+    finally:
+        preprocessor.close()
+
+    report = result["preprocessing"]
+    assert report["processed_bytes"] < report["original_bytes"] == len(photo)
+    # The bytes OCR'd are the bytes stored, without reading them back from S3
+    assert seen == [s3.objects[f"uploads/{result['content_hash']}.jpg"]]
+    assert len(seen[0]) == report["processed_bytes"]
+    assert result["ocr_seconds"] is not None
+    assert preprocessor.stats()["bytes_saved"] == report["original_bytes"] - report["processed_bytes"]
+
+
+def test_pipeline_bounds_queues_batches_and_passes_failures_through():
+    from app.services.pipeline import Pipeline, Stage
+
+    pulled, active, peak, batches = [0], [0], [0], []
+
+    def inputs():
+        for value in range(20):
+            pulled[0] += 1
+            yield value
+
+    async def slow(value):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.02)
+        active[0] -= 1
+        return value * 10
+
+    async def reject_thirty(value):
+        if value == 30:
+            raise ValueError("bad record")
+        return value
+
+    async def collect(values):
+        batches.append(len(values))
+        return values
+
+    pipeline = Pipeline([
+        Stage("slow", slow, concurrency=3),
+        Stage("check", reject_thirty),
+        Stage("collect", collect, batch=True, batch_size=4, batch_wait=0.05),
+    ], queue_size=2)
+
+    async def consume():
+        items = []
+        async for item in pipeline.run(inputs()):
+            # Inputs are read only as the first queue has room
+            assert pulled[0] <= len(items) + 3 * 2 + 3 + 8
+            items.append(item)
+        return items
+
+    items = asyncio.run(consume())
+
+    assert sorted(item.index for item in items) == list(range(20))
+    failed = [item for item in items if item.error]
+    assert [(item.index, item.failed_stage, item.error) for item in failed] == [(3, "check", "bad record")]
+    assert sorted(item.value for item in items if not item.error) == [v * 10 for v in range(20) if v != 3]
+    assert peak[0] == 3 and max(batches) <= 4 and sum(batches) == 19
+
+    stats = pipeline.stats()
+    assert (stats["inputs"], stats["outputs"]) == (20, 20)
+    assert stats["stages"]["slow"]["processed"] == 20
+    assert stats["stages"]["check"]["failed"] == 1
+    assert stats["stages"]["collect"]["skipped"] == 1
+    assert all(stage["queue_max_depth"] <= 2 and stage["queue_depth"] <= 1 for stage in stats["stages"].values())
+    assert stats["stages"]["slow"]["throughput"] > 0
+
+
+def test_patient_from_ner_maps_extracted_data():
+    from app.services.document_pipeline import patient_from_ner
+
+    patient = patient_from_ner({"structured_data": [{"ExtractedData": {
+        "PatientName": "Jane Roe",
+        "DateOfBirth": "1984-03-09",
+        "Gender": "Female",
+        "ContactNumber": "N/A",
+        "MRN": "MRN-77",
+        "Diagnosis": "N/A",
+        "MedicalConditions": ["Asthma"],
+        "Department": "Pulmonology",
+        "HospitalName": "N/A",
+        "VisitDate": "not recorded",
+    }}]})
+
+    assert (patient.name, str(patient.dob), patient.gender) == ("Jane Roe", "1984-03-09", "Female")
+    assert patient.phone is None and patient.visit_date is None
+    assert patient.medical_record_number == "MRN-77"
+    assert patient.medical_conditions == ["Asthma"]
+    assert patient.hospital_name == "Pulmonology"
+    with pytest.raises(ValueError):
+        patient_from_ner({"structured_data": {"ExtractedData": {"PatientName": "N/A"}}})
+
+
+def test_pipeline_route_streams_documents_and_stage_stats(monkeypatch):
+    from app.routes.pipeline import pipeline_router
+    from app.services import document_pipeline
+
+    async def fake_textract(document):
+        document.fileobj.seek(0)
+        return [{"BlockType": "LINE", "Text": f"Patient: {document.fileobj.read().decode()[9:]}"}]
+
+    def fake_ner(text, is_file):
+        if "empty" in text:
+            return {"error": "Could not parse JSON from OpenAI response"}
+        return {"structured_data": {"ExtractedData": {"PatientName": text.split(": ")[1]}}}
+
+    matched_batches = []
+
+    def fake_match(patients):
+        matched_batches.append(len(patients))
+        return [{"status": "new", "record": patient.dict()} for patient in patients]
+
+    monkeypatch.setattr(ingestion, "upload_fileobj_to_s3", lambda fileobj, name: f"s3://test-bucket/uploads/{name}")
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+    _route_ocr_to(monkeypatch, fake_textract)
+    monkeypatch.setattr(document_pipeline, "analyze_medical_document", fake_ner)
+    monkeypatch.setattr(document_pipeline, "_match_batch", fake_match)
+
+    app = FastAPI()
+    app.include_router(pipeline_router, prefix="/api")
+    files = [("files", (f"doc{i}.pdf", f"%PDF-1.4 {i}".encode(), "application/pdf")) for i in range(5)]
+    files.append(("files", ("empty.pdf", b"%PDF-1.4 empty", "application/pdf")))
+    files.append(("files", ("notes.txt", b"hello", "text/plain")))
+    response = TestClient(app).post("/api/pipeline/run", files=files)
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    documents, stats = lines[:-1], lines[-1]["stats"]
+    by_name = {document["filename"]: document for document in documents}
+    assert len(documents) == 7
+    assert by_name["notes.txt"]["failed_stage"] == "upload"
+    assert by_name["empty.pdf"]["failed_stage"] == "ner"
+    assert by_name["doc2.pdf"]["status"] == "done" and by_name["doc2.pdf"]["match_status"] == "new"
+    assert by_name["doc2.pdf"]["patient"]["name"] == "2"
+    assert sum(matched_batches) == 5
+    assert list(stats["stages"]) == ["upload", "ocr", "ner", "structure", "match"]
+    assert stats["stages"]["upload"]["failed"] == 1 and stats["stages"]["match"]["processed"] == 5
+    assert stats["outputs"] == 7
+
+
+def _job_sessions():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from database.models import Job
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Job.__table__.create(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_job_queue_claims_retries_and_reclaims_lapsed_jobs():
+    from datetime import datetime, timedelta
+    from app.services.job_queue import JobWorker, PermanentJobError, enqueue
+    from database.job_repository import claim_jobs, complete_job, get_job
+    from database.models import Job
+
+    sessions = _job_sessions()
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload["n"])
+        if len(calls) == 1:
+            raise RuntimeError("OpenAI timed out")
+        return {"doubled": payload["n"] * 2}
+
+    def broken(payload):
+        raise PermanentJobError("no patient name")
+
+    worker = JobWorker("w1", handlers={"flaky": flaky, "broken": broken}, session_factory=sessions,
+                       visibility_timeout=60)
+    flaky_id = enqueue("flaky", {"n": 21}, session_factory=sessions)
+    broken_id = enqueue("broken", {}, session_factory=sessions)
+
+    assert worker.run_once() and worker.run_once()
+    db = sessions()
+    job = get_job(db, flaky_id)
+    # First attempt failed and was queued again with a delay
+    assert (job.status, job.attempts, job.locked_by) == ("queued", 1, None)
+    assert "OpenAI timed out" in job.error and job.run_after > datetime.utcnow()
+    assert (get_job(db, broken_id).status, get_job(db, broken_id).attempts) == ("failed", 1)
+
+    job.run_after = datetime.utcnow()
+    db.commit()
+    assert worker.run_once() and not worker.run_once()
+    db.expire_all()
+    job = get_job(db, flaky_id)
+    assert (job.status, job.attempts, job.result, job.error) == ("completed", 2, {"doubled": 42}, None)
+    assert worker.counters == {"completed": 1, "retried": 1, "failed": 1, "lost": 0}
+
+    # A claimed job is invisible to other workers until its claim lapses
+    lapsed_id = enqueue("flaky", {"n": 1}, max_attempts=2, session_factory=sessions)
+    assert [j.id for j in claim_jobs(db, "w1", 60)] == [lapsed_id]
+    assert claim_jobs(db, "w2", 60) == []
+    db.query(Job).filter(Job.id == lapsed_id).update({"locked_until": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    assert [j.id for j in claim_jobs(db, "w2", 60)] == [lapsed_id]
+    # The worker that lost the claim cannot record a result over the new owner
+    assert not complete_job(db, lapsed_id, "w1", {"stale": True})
+    assert complete_job(db, lapsed_id, "w2", {"ok": True})
+    db.close()
+
+
+def test_job_routes_enqueue_and_report_status(monkeypatch):
+    from app.routes.health import health_router
+    from app.routes.jobs import jobs_router
+    from app.services import job_queue
+    from app.services.job_queue import JobWorker
+    from database.database import get_db
+
+    sessions = _job_sessions()
+    monkeypatch.setattr(job_queue, "SessionLocal", sessions)
+    monkeypatch.setattr(ingestion, "upload_fileobj_to_s3", lambda fileobj, name: f"s3://test-bucket/uploads/{name}")
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+
+    def override_db():
+        db = sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(jobs_router, prefix="/api")
+    app.include_router(health_router, prefix="/api")
+    app.dependency_overrides[get_db] = override_db
+    client = TestClient(app)
+
+    response = client.post("/api/jobs/documents", files=[
+        ("files", ("scan.pdf", b"%PDF-1.4 scan", "application/pdf")),
+        ("files", ("notes.txt", b"hello", "text/plain")),
+    ])
+    assert response.status_code == 202
+    queued, rejected = response.json()["jobs"]
+    assert "Unsupported file type" in rejected["error"]
+    ner_id = client.post("/api/jobs/ner", json={"extracted_text": "Patient: Jane Roe"}).json()["job_id"]
+
+    job = client.get(f"/api/jobs/{queued['job_id']}").json()
+    assert (job["kind"], job["status"], job["attempts"]) == ("document", "queued", 0)
+    assert client.get("/api/stats/jobs").json()["jobs"] == {"document": {"queued": 1}, "ner": {"queued": 1}}
+
+    seen = []
+    worker = JobWorker("w1", handlers={"ner": lambda payload: seen.append(payload) or {"entities": 1}},
+                       kinds=["ner"], session_factory=sessions)
+    assert worker.run_once() and not worker.run_once()
+    assert seen == [{"text": "Patient: Jane Roe"}]
+    job = client.get(f"/api/jobs/{ner_id}").json()
+    assert (job["status"], job["result"]) == ("completed", {"entities": 1})
+    assert [j["job_id"] for j in client.get("/api/jobs", params={"status": "queued"}).json()["jobs"]] == [queued["job_id"]]
+    assert client.get("/api/jobs/unknown").status_code == 404
+
+
+def test_document_job_runs_pipeline_from_s3(monkeypatch):
+    from app.services import document_pipeline, job_handlers
+    from app.services.job_queue import PermanentJobError
+
+    async def fake_textract(document):
+        document.fileobj.seek(0)
+        return [{"BlockType": "LINE", "Text": document.fileobj.read().decode()}]
+
+    monkeypatch.setattr(job_handlers, "download_s3_fileobj", lambda s3_path: io.BytesIO(b"Patient: Jane Roe"))
+    monkeypatch.setattr(ingestion, "OCR_CACHE_ENABLED", False)
+    _route_ocr_to(monkeypatch, fake_textract)
+    names = iter(["Jane Roe", "N/A"])
+    monkeypatch.setattr(document_pipeline, "analyze_medical_document",
+                        lambda text, is_file: {"structured_data": {"ExtractedData": {"PatientName": next(names)}}})
+    payload = {"filename": "scan.pdf", "s3_path": "s3://test-bucket/uploads/abc.pdf", "file_ext": ".pdf",
+               "content_hash": "abc", "size": 17, "match": False}
+
+    result = job_handlers.run_document_job(payload)
+    assert (result["status"], result["patient"]["name"], result["ocr_engine_used"]) == ("done", "Jane Roe", "aws_textract")
+    assert list(result["stats"]["stages"]) == ["upload", "ocr", "ner", "structure"]
+    # A document without a patient will not get one by retrying
+    with pytest.raises(PermanentJobError, match="structure"):
+        job_handlers.run_document_job(payload)
@@ -0,0 +1,843 @@
+import json
+import os
+import random
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
+import numpy as np
+import openai
+import pytest
+
+from app.config import VECTOR_INDEX_NPROBE
+from app.services import embedding_service, match_jobs, parallel_matcher, patient_linker, patient_matcher
+from app.services.embedding_service import IVFIndex, VectorIndex
+from app.services.parallel_matcher import CandidateMatcher, match_pool, parallel_match_candidates
+from app.utils import embedding_store, embeddings_utils
+from app.utils.batch_matcher import FuzzyScorer
+from app.utils.blocking import BlockingIndex, resolve_blocking_keys, soundex
+from app.utils.match_keys import apply_match_keys
+from app.utils.embedding_cache import EmbeddingCache
+from app.utils.embedding_store import EmbeddingStore
+from app.utils.string_matcher import is_fuzzy_match
+from database.models import Patient
+from database.patient_repository import PatientWriteBatch
+from database.patient_snapshot import SNAPSHOT_COLUMNS, PatientSnapshot, patient_snapshot
+from database.schemas import PatientData
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for POST /v1/embeddings. Each text embeds to [len(text), 1.0].
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append(body["input"])
+            fail = server.failures > 0
+            server.failures -= 1 if fail else 0
+
+        if fail:
+            payload, status = {"error": {"message": "rate limited", "type": "rate_limit_error"}}, 429
+        else:
+            data = [
+                {"object": "embedding", "index": i, "embedding": [float(len(text)), 1.0]}
+                for i, text in enumerate(body["input"])
+            ]
+            # Return items out of order to check results are re-sorted by index
+            payload, status = {"object": "list", "data": data[::-1], "model": body["model"]}, 200
+
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), FakeEmbeddingsHandler)
+    server.requests, server.failures, server.lock = [], 0, threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(openai, "api_base", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(openai, "api_key", "test-key")
+    monkeypatch.setattr(embeddings_utils, "EMBEDDING_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(embeddings_utils, "embedding_cache", EmbeddingCache(path=""))
+    yield server
+    server.shutdown()
+
+
+def test_make_batches_bounds_size_and_tokens():
+    texts = ["a" * 40] * 5
+    assert embeddings_utils.make_batches(texts, batch_size=2, max_tokens=1000) == [[0, 1], [2, 3], [4]]
+    # 40 chars ~ 11 tokens, so only two fit under a 25 token budget
+    assert embeddings_utils.make_batches(texts, batch_size=10, max_tokens=25) == [[0, 1], [2, 3], [4]]
+    assert embeddings_utils.make_batches(["a" * 400], batch_size=10, max_tokens=25) == [[0]]
+
+
+def test_get_openai_embeddings_batches_in_input_order(fake_embeddings, monkeypatch):
+    monkeypatch.setattr(embeddings_utils, "EMBEDDING_BATCH_SIZE", 3)
+    texts = ["x" * n for n in range(1, 9)]
+
+    embeddings = embeddings_utils.get_openai_embeddings(texts)
+
+    assert embeddings == [[float(n), 1.0] for n in range(1, 9)]
+    assert sorted(len(batch) for batch in fake_embeddings.requests) == [2, 3, 3]
+
+
+def test_get_openai_embeddings_retries_rate_limits(fake_embeddings):
+    fake_embeddings.failures = 2
+
+    assert embeddings_utils.get_openai_embedding("abc") == [3.0, 1.0]
+    assert len(fake_embeddings.requests) == 3
+
+
+def test_get_openai_embeddings_gives_up_after_max_retries(fake_embeddings, monkeypatch):
+    monkeypatch.setattr(embeddings_utils, "EMBEDDING_MAX_RETRIES", 1)
+    fake_embeddings.failures = 5
+
+    with pytest.raises(openai.error.RateLimitError):
+        embeddings_utils.get_openai_embedding("abc")
+    assert len(fake_embeddings.requests) == 2
+
+
+def test_embedding_cache_serves_repeats_without_api_calls(fake_embeddings, monkeypatch, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(embeddings_utils, "embedding_cache", EmbeddingCache(max_entries=1, path=path))
+
+    first = embeddings_utils.get_openai_embeddings(["alpha", "beta", "alpha"])
+    second = embeddings_utils.get_openai_embeddings(["  alpha ", "beta"])
+
+    assert first == [[5.0, 1.0], [4.0, 1.0], [5.0, 1.0]]
+    assert second == [[5.0, 1.0], [4.0, 1.0]]
+    assert fake_embeddings.requests == [["alpha", "beta"]]
+    stats = embeddings_utils.embedding_cache.stats()
+    assert stats["misses"] == 3
+    assert stats["hits"] == 2
+    assert stats["evictions"] >= 1
+
+    # A fresh process (empty LRU) still hits the persistent tier
+    monkeypatch.setattr(embeddings_utils, "embedding_cache", EmbeddingCache(max_entries=10, path=path))
+    assert embeddings_utils.get_openai_embedding("beta") == [4.0, 1.0]
+    assert embeddings_utils.embedding_cache.stats()["persistent_hits"] == 1
+    assert len(fake_embeddings.requests) == 1
+
+
+class RecordingWriteBatch:
+    flushed = []
+
+    def __init__(self, db):
+        self.updates = []
+        RecordingWriteBatch.flushed = []
+
+    def update(self, existing, new_data):
+        self.updates.append(existing.id)
+        return {"dob": new_data.get("dob")}
+
+    def flush(self):
+        RecordingWriteBatch.flushed.append(self.updates)
+
+
+def _stored_patient(patient_id, name, embedding):
+    patient = SimpleNamespace(
+        id=patient_id, name=name, dob=None, gender=None, ssn=None, address=None,
+        phone=None, email=None, insurance_number=None, medical_record_number=None,
+        embedding=embedding,
+    )
+    patient.to_dict = lambda: {"id": patient_id, "name": name}
+    return patient
+
+
+def test_process_fuzzy_match_embeds_fuzzy_misses_in_one_batch(fake_embeddings, monkeypatch):
+    existing = [_stored_patient(1, "Alice Walker", [1.0, 0.0]), _stored_patient(2, "Bob Stone", [0.0, 1.0])]
+    store = EmbeddingStore()
+    store.load((p.id, p.embedding) for p in existing)
+    monkeypatch.setattr(patient_matcher, "get_patient_records", lambda db: existing)
+    monkeypatch.setattr(patient_matcher, "search_similar", lambda db, vectors, k=1: store.top_k(vectors, k))
+    monkeypatch.setattr(patient_matcher, "PatientWriteBatch", RecordingWriteBatch)
+
+    incoming = [PatientData(name="Alice Walker"), PatientData(name="Zed"), PatientData(name="Yolanda Quince")]
+    result = patient_matcher.process_fuzzy_match(incoming, db=None)
+
+    # Alice matches on the fuzzy pass; the other two are embedded together in one request
+    assert fake_embeddings.requests == [["Zed", "Yolanda Quince"]]
+    assert [m["method"] for m in result["matched_patients"]] == ["fuzzy", "embedding", "embedding"]
+    assert [m["incoming"]["name"] for m in result["matched_patients"]] == ["Alice Walker", "Zed", "Yolanda Quince"]
+    assert RecordingWriteBatch.flushed == [[1, 1, 1]]
+
+
+def _brute_force_top_k(ids, vectors, queries, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ vectors.T
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.asarray(ids)[order], np.take_along_axis(scores, order, axis=1)
+
+
+def test_embedding_store_top_k_matches_brute_force_cosine():
+    rng = np.random.default_rng(0)
+    ids = list(range(100, 400))
+    vectors = rng.normal(size=(len(ids), 16))
+    queries = rng.normal(size=(7, 16))
+    store = EmbeddingStore()
+    # Embeddings arrive as JSONB lists or serialized strings
+    store.load((i, json.dumps(v.tolist()) if i % 2 else v.tolist()) for i, v in zip(ids, vectors))
+
+    top_ids, top_scores = store.top_k(queries, k=5)
+    expected_ids, expected_scores = _brute_force_top_k(ids, vectors, queries, 5)
+    assert top_ids.shape == (7, 5)
+    assert (top_ids == expected_ids).all()
+    assert np.allclose(top_scores, expected_scores, atol=1e-5)
+
+    # k larger than the store returns every row, still sorted
+    assert store.top_k(queries[0], k=1000)[0].shape == (1, len(ids))
+
+
+def test_embedding_writes_reach_search_similar(monkeypatch):
+    store = EmbeddingStore()
+    store.load([(1, [1.0, 0.0]), (2, [0.0, 1.0]), (3, None)])
+    monkeypatch.setattr(embedding_store, "_store", store)
+    monkeypatch.setattr(embedding_service, "_vector_index", None)
+    query = [[1.0, 0.2]]
+    assert len(store) == 2
+    assert embedding_service.search_similar(None, query)[0].tolist() == [[1]]
+
+    # Added
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=4, embedding=[1.0, 0.21]))
+    assert embedding_service.search_similar(None, query)[0].tolist() == [[4]]
+    # Updated away from the query
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=4, embedding=[-1.0, 0.0]))
+    assert embedding_service.search_similar(None, query, k=3)[0].tolist() == [[1, 2, 4]]
+    # Deleted: the last row moves into the hole and keeps its id
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=1, embedding=None))
+    ids, scores = embedding_service.search_similar(None, query, k=3)
+    assert ids.tolist() == [[2, 4]]
+    assert np.allclose(scores, [[0.2 / np.hypot(1.0, 0.2), -1.0 / np.hypot(1.0, 0.2)]])
+    assert len(store) == 2
+
+
+def _clustered_vectors(rng, count, dim=16, centers=40):
+    means = rng.normal(size=(centers, dim))
+    return means[rng.integers(centers, size=count)] + 0.3 * rng.normal(size=(count, dim))
+
+
+def test_ivf_index_saves_and_memory_maps(tmp_path):
+    rng = np.random.default_rng(1)
+    ids = np.arange(1, 501)
+    vectors = _clustered_vectors(rng, len(ids))
+    ivf = IVFIndex.build(ids, vectors, nlist=10)
+    assert ivf.nlist == 10
+    assert ivf.offsets[-1] == len(ivf) == 500
+    assert sorted(ivf.ids.tolist()) == ids.tolist()
+
+    directory = str(tmp_path / "index")
+    ivf.save(directory)
+    ivf.save(directory)  # Rebuilding swaps the directory in place
+    loaded = IVFIndex.load(directory)
+    assert isinstance(loaded.vectors, np.memmap) and isinstance(loaded.ids, np.memmap)
+    assert (loaded.ids == ivf.ids).all() and (loaded.offsets == ivf.offsets).all()
+    assert loaded.built_at == ivf.built_at
+
+    queries = embedding_service._normalize(vectors[:5])
+    # Probing every list is an exact search
+    top_ids, _ = loaded.search(queries, k=3, nprobe=loaded.nlist)
+    assert (top_ids == _brute_force_top_k(ids, vectors, vectors[:5], 3)[0]).all()
+
+
+def test_vector_index_applies_tombstones_and_delta(monkeypatch):
+    rng = np.random.default_rng(2)
+    ids = np.arange(1, 201)
+    vectors = _clustered_vectors(rng, len(ids))
+    index = VectorIndex(IVFIndex.build(ids, vectors, nlist=8))
+    monkeypatch.setattr(embedding_service, "_vector_index", index)
+    monkeypatch.setattr(embedding_service, "EXACT_SEARCH_MAX_ROWS", 1)
+    monkeypatch.setattr(embedding_store, "_store", None)
+    query = vectors[:1]
+    assert embedding_service.search_similar(None, query, nprobe=8)[0][0, 0] == 1
+
+    # Patient 1 moves away, a new patient 999 takes its place
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=1, embedding=(-vectors[0]).tolist()))
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=999, embedding=vectors[0].tolist()))
+    assert index.tombstones == {1}
+    assert len(index) == 201
+    top_ids, top_scores = embedding_service.search_similar(None, query, k=len(index), nprobe=8)
+    assert top_ids[0, 0] == 999 and np.isclose(top_scores[0, 0], 1.0)
+    # The stale indexed copy of 1 is gone; only its delta row (pointing away) remains
+    assert top_ids[0].tolist().count(1) == 1
+    assert top_scores[0, top_ids[0].tolist().index(1)] < 0
+
+    embedding_service.sync_patient_embedding(SimpleNamespace(id=999, embedding=None))
+    assert 999 not in embedding_service.search_similar(None, query, k=5, nprobe=8)[0]
+    assert len(index) == 200
+
+
+def test_search_similar_uses_exact_store_below_threshold(monkeypatch):
+    rng = np.random.default_rng(3)
+    ids = np.arange(1, 101)
+    vectors = _clustered_vectors(rng, len(ids))
+    store = EmbeddingStore()
+    store.load(zip(ids.tolist(), vectors.tolist()))
+    index = VectorIndex(IVFIndex.build(ids, vectors, nlist=10))
+    monkeypatch.setattr(embedding_store, "_store", store)
+    monkeypatch.setattr(embedding_service, "_vector_index", index)
+    monkeypatch.setattr(index, "search", lambda *args, **kwargs: pytest.fail("ANN search below the threshold"))
+
+    monkeypatch.setattr(embedding_service, "EXACT_SEARCH_MAX_ROWS", len(ids) + 1)
+    top_ids, _ = embedding_service.search_similar(None, vectors[:4], k=3)
+    assert (top_ids == _brute_force_top_k(ids, vectors, vectors[:4], 3)[0]).all()
+
+
+def test_ivf_recall_at_default_nprobe():
+    rng = np.random.default_rng(4)
+    ids = np.arange(5000)
+    vectors = _clustered_vectors(rng, len(ids), centers=80)
+    queries = _clustered_vectors(rng, 100, centers=80)
+    index = VectorIndex(IVFIndex.build(ids, vectors))
+
+    k = 10
+    found, _ = index.search(queries, k, VECTOR_INDEX_NPROBE)
+    expected, _ = _brute_force_top_k(ids, vectors, queries, k)
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found.tolist(), expected.tolist())])
+    assert recall >= 0.9
+
+
+def _identified_patients():
+    alice = _stored_patient(1, "Alice Walker", [1.0, 0.0])
+    alice.ssn = "123-45-6789"
+    bob = _stored_patient(2, "Bob Stone", [0.0, 1.0])
+    bob.medical_record_number = "mrn-0042"
+    carol = _stored_patient(3, "Carol King", [0.6, 0.8])
+    carol.insurance_number = "INS 77"
+    return [alice, bob, carol]
+
+
+def test_identifier_hits_skip_fuzzy_and_embedding_passes(fake_embeddings, monkeypatch):
+    existing = _identified_patients()
+    monkeypatch.setattr(patient_matcher, "get_patient_records", lambda db: existing)
+    monkeypatch.setattr(patient_matcher, "search_similar", lambda *args, **kwargs: pytest.fail("embedding search"))
+    monkeypatch.setattr(patient_matcher, "PatientWriteBatch", RecordingWriteBatch)
+
+    incoming = [
+        PatientData(name="Walker, Alice", ssn="123456789"),
+        PatientData(name="Bob Stone", medical_record_number="MRN-0042"),
+        PatientData(name="Carol King", insurance_number="ins-77"),
+        # No name to disagree with, so the SSN decides
+        PatientData(name="", ssn="123 45 6789"),
+    ]
+    result = patient_matcher.process_fuzzy_match(incoming, db=None)
+
+    assert [m["method"] for m in result["matched_patients"]] == [
+        "identifier:ssn", "identifier:medical_record_number", "identifier:insurance_number", "identifier:ssn",
+    ]
+    assert [m["matched_with"]["id"] for m in result["matched_patients"]] == [1, 2, 3, 1]
+    assert result["summary"]["identifier_matches"] == 4
+    assert result["summary"]["comparisons"] == 0
+    assert fake_embeddings.requests == []
+
+
+def test_identifier_hit_with_a_different_name_is_a_conflict(fake_embeddings, monkeypatch):
+    existing = _identified_patients()
+    monkeypatch.setattr(patient_matcher, "get_patient_records", lambda db: existing)
+    monkeypatch.setattr(patient_matcher, "PatientWriteBatch", RecordingWriteBatch)
+
+    result = patient_matcher.process_fuzzy_match([PatientData(name="Zed Quince", ssn="123-45-6789")], db=None)
+
+    assert result["matched_patients"] == []
+    [conflict] = result["unmatched_patients"]
+    assert conflict["reason"] == "conflicting ssn"
+    assert conflict["conflicting_patient_id"] == 1
+    assert conflict["review_status"] == "Human Review"
+    assert result["summary"]["identifier_conflicts"] == 1
+    assert result["summary"]["review_required"] == 1
+    assert RecordingWriteBatch.flushed[-1] == []
+    assert fake_embeddings.requests == []
+
+
+def _random_patients(rng, count):
+    first = ["John", "Jon", "Jane", "Janet", "María", "Mary", "Robert", "Rob", ""]
+    last = ["Smith", "Smyth", "Doe", "O'Neil", "Oneil", "Lee", "Garcia"]
+    streets = ["1 Main St", "1 Main Street", "22 Elm Rd.", "22 elm road", None]
+    patients = []
+    for _ in range(count):
+        patients.append(PatientData(
+            name=f"{rng.choice(first)} {rng.choice(last)}".strip(),
+            dob=rng.choice([date(1980, 1, 1), date(1990, 5, 17), None]),
+            ssn=rng.choice(["123-45-6789", "987-65-4321", None]),
+            insurance_number=rng.choice(["INS-1", "INS-2", None]),
+            address=rng.choice(streets),
+            email=rng.choice(["john@x.com", "jon@x.com", "Jane.Doe@y.org", None]),
+            phone=rng.choice(["555-1234", "(555) 123-4444", "5551234", None]),
+        ))
+    return patients
+
+
+def test_soundex_codes():
+    assert soundex("robert") == soundex("Rupert") == "R163"
+    assert soundex("Ashcraft") == "A261"  # h does not separate the two s/c codes
+    assert soundex("Tymczak") == "T522"
+    assert soundex("Lee") == "L000"
+    assert soundex("42") == ""
+
+
+def test_blocking_index_keys_and_candidates():
+    stored = [
+        PatientData(name="Robert Smith", dob=date(1980, 1, 1), phone="555-1234", email="rob+clinic@x.com"),
+        PatientData(name="Jane Doe", dob=date(1990, 5, 17), phone="555-9876"),
+        PatientData(name="Rupert Smyth", dob=date(1975, 3, 2)),
+    ]
+    keys = ["dob", "name_soundex", "name_prefix", "phone_last4", "email_local"]
+    index = BlockingIndex(stored, keys)
+
+    assert index.block_keys(stored[0]) == {
+        "dob:1980-01-01", "name_soundex:R163", "name_soundex:S530", "name_prefix:rob",
+        "name_prefix:smi", "phone_last4:1234", "email_local:rob",
+    }
+    assert index.blocks["name_soundex:R163"] == [0, 2]
+    assert index.candidate_positions(PatientData(name="Jane Roe", dob=date(1975, 3, 2))) == [1, 2]
+    assert index.candidate_positions(PatientData(name="Zed", phone="000-1234")) == [0]
+    assert index.candidate_positions(PatientData(name="Zed")) == []
+
+    unblocked = BlockingIndex(stored, ["none"])
+    assert not unblocked.enabled
+    assert unblocked.candidate_positions(PatientData(name="Zed")) == [0, 1, 2]
+
+
+def test_resolve_blocking_keys_rejects_unknown_keys():
+    assert resolve_blocking_keys(None) == []
+    assert resolve_blocking_keys(["none"]) == []
+    assert resolve_blocking_keys(["dob", "dob", "name_soundex"]) == ["dob", "name_soundex"]
+    with pytest.raises(ValueError, match="bogus"):
+        resolve_blocking_keys(["dob", "bogus"])
+
+
+def test_process_fuzzy_match_reports_pruned_comparisons(fake_embeddings, monkeypatch):
+    rng = random.Random(13)
+    existing = []
+    for patient_id, patient in enumerate(_random_patients(rng, 40), start=1):
+        stored = _stored_patient(patient_id, patient.name, [1.0, 0.0])
+        # No shared identifiers, so every record goes through the fuzzy scorer
+        stored.__dict__.update(dob=patient.dob, address=patient.address, email=patient.email, phone=patient.phone)
+        existing.append(stored)
+    incoming = [PatientData(**{**p.dict(), "ssn": None, "insurance_number": None}) for p in _random_patients(rng, 15)]
+    store = EmbeddingStore()
+    store.load((p.id, p.embedding) for p in existing)
+    monkeypatch.setattr(patient_matcher, "get_patient_records", lambda db: existing)
+    monkeypatch.setattr(patient_matcher, "search_similar", lambda db, vectors, k=1: store.top_k(vectors, k))
+    monkeypatch.setattr(patient_matcher, "PatientWriteBatch", RecordingWriteBatch)
+
+    keys = ["dob", "name_soundex"]
+    summary = patient_matcher.process_fuzzy_match(incoming, db=None, blocking_keys=keys)["summary"]
+    index = BlockingIndex(existing, keys)
+    assert summary["comparisons"] == sum(len(index.candidate_positions(p)) for p in incoming)
+    assert summary["comparisons_pruned"] == len(incoming) * len(existing) - summary["comparisons"]
+    assert summary["comparisons_pruned"] > 0
+
+    full = patient_matcher.process_fuzzy_match(incoming, db=None, blocking_keys=["none"])["summary"]
+    assert full["comparisons"] == len(incoming) * len(existing)
+    assert full["comparisons_pruned"] == 0
+
+
+def test_batch_scorer_matches_is_fuzzy_match():
+    rng = random.Random(7)
+    existing = _random_patients(rng, 60)
+    incoming = _random_patients(rng, 40)
+
+    scorer = FuzzyScorer(existing)
+    scores = scorer.score_matrix(incoming)
+
+    matched = 0
+    for i, record in enumerate(incoming):
+        expected_best, expected_score = None, 0
+        for j, stored in enumerate(existing):
+            is_match, score = is_fuzzy_match(stored, record)
+            assert round(scores[i, j], 2) == score
+            assert (scores[i, j] >= 90) == is_match
+            if is_match and score > expected_score:
+                expected_best, expected_score = j, score
+        matched += expected_best is not None
+        assert scorer.best_matches([record], threshold=90)[0] == (expected_best, expected_score)
+
+    assert matched > 0
+
+
+def test_branch_and_bound_scoring_picks_the_same_matches():
+    rng = random.Random(3)
+    existing = _random_patients(rng, 120)
+    incoming = _random_patients(rng, 60) + existing[:10]
+    scorer = FuzzyScorer(existing)
+
+    for threshold in (60, 75, 90, 100):
+        assert scorer.best_matches(incoming, threshold) == scorer.best_matches(incoming, threshold, prune=False)
+    assert scorer.stats["pruned_after_name"] > 0
+    assert scorer.stats["fully_scored"] < scorer.stats["candidates"]
+
+
+def test_precomputed_match_keys_give_identical_scores_and_blocks():
+    rng = random.Random(11)
+    raw = _random_patients(rng, 30)
+    keyed = [SimpleNamespace(**patient.dict()) for patient in raw]
+    for patient in keyed:
+        apply_match_keys(patient)
+    incoming = _random_patients(rng, 10)
+
+    assert (FuzzyScorer(keyed).score_matrix(incoming) == FuzzyScorer(raw).score_matrix(incoming)).all()
+    keys = ["dob", "name_soundex", "name_prefix", "phone_last4", "email_local"]
+    assert BlockingIndex(keyed, keys).blocks == BlockingIndex(raw, keys).blocks
+
+
+def test_parallel_matching_merges_to_serial_result():
+    rng = random.Random(5)
+    existing = _random_patients(rng, 80)
+    # Half the stored side carries precomputed keys, as after a partial backfill
+    existing[::2] = [SimpleNamespace(**patient.dict()) for patient in existing[::2]]
+    for patient in existing[::2]:
+        apply_match_keys(patient)
+    incoming = _random_patients(rng, 50)
+
+    for keys in (["dob", "name_soundex"], []):
+        serial = CandidateMatcher(existing, keys).match(incoming, threshold=90)
+        assert parallel_match_candidates(existing, incoming, keys, threshold=90, workers=3) == serial
+    assert any(best is not None for best, _, _ in serial)
+
+
+def test_match_pool_outlives_snapshot_versions(monkeypatch):
+    rng = random.Random(9)
+    existing = _random_patients(rng, 60)
+    incoming = _random_patients(rng, 30)
+    keys = ["dob", "name_soundex"]
+    serial = CandidateMatcher(existing, keys).match(incoming, threshold=90)
+    monkeypatch.setattr(patient_snapshot, "_ordered", existing)
+    monkeypatch.setattr(patient_snapshot, "version", 7)
+    try:
+        assert parallel_match_candidates(existing, incoming, keys, threshold=90, workers=2) == serial
+        pool, (version, path) = match_pool._pool, match_pool._published
+        assert version == 7 and os.path.isdir(path)
+        # Same version, another blocking strategy and fewer processes: nothing is rebuilt
+        assert parallel_match_candidates(existing, incoming[:1], [], threshold=90, workers=2) == \
+            CandidateMatcher(existing, []).match(incoming[:1], threshold=90)
+        assert match_pool._pool is pool and match_pool._published == (7, path)
+
+        # A refresh replaces the list and bumps the version: same workers, new snapshot
+        changed = existing[:40]
+        monkeypatch.setattr(patient_snapshot, "_ordered", changed)
+        monkeypatch.setattr(patient_snapshot, "version", 8)
+        assert parallel_match_candidates(changed, incoming, keys, threshold=90, workers=2) == \
+            CandidateMatcher(changed, keys).match(incoming, threshold=90)
+        assert match_pool._pool is pool
+        assert match_pool._published[0] == 8 and not os.path.exists(path)
+
+        # Lists that are not the snapshot are published for the call only
+        other = existing[20:]
+        assert parallel_match_candidates(other, incoming, keys, threshold=90, workers=2) == \
+            CandidateMatcher(other, keys).match(incoming, threshold=90)
+        assert match_pool._pool is pool and match_pool._published[0] == 8
+    finally:
+        match_pool.close()
+    assert match_pool._pool is None and match_pool._published is None
+
+
+def test_snapshot_records_share_columns_with_the_matcher():
+    rng = random.Random(21)
+    existing = _random_patients(rng, 50)
+    # Half the rows carry precomputed keys, as after a partial backfill
+    existing[::2] = [SimpleNamespace(**patient.dict()) for patient in existing[::2]]
+    for patient in existing[::2]:
+        apply_match_keys(patient)
+    incoming = _random_patients(rng, 20)
+    path = parallel_matcher.publish_snapshot(existing)
+    try:
+        records = parallel_matcher.SnapshotRecords(path)
+        assert len(records) == len(existing)
+        assert records[3].name == (existing[3].name or "") and records[3].dob == existing[3].dob
+        for keys in (["dob", "name_soundex", "phone_last4", "email_local"], []):
+            shared = records.matcher(keys)
+            assert shared.match(incoming, threshold=75) == CandidateMatcher(existing, keys).match(incoming, threshold=75)
+    finally:
+        shutil.rmtree(path)
+
+def _linkable(patient_id, name, dob, phone, cluster_id=None):
+    return SimpleNamespace(
+        id=patient_id, name=name, dob=dob, ssn=None, insurance_number=None,
+        address="1 Main St", email=None, phone=phone, cluster_id=cluster_id,
+    )
+
+
+def test_linker_clusters_duplicates_transitively():
+    records = [
+        _linkable(1, "Jonathan Smith", date(1980, 1, 1), "555-0101"),
+        _linkable(2, "Maria Garcia", date(1975, 5, 5), "555-0202"),
+        _linkable(3, "Jonathon Smith", date(1980, 1, 1), "555-0101"),
+        _linkable(4, "Jonathon Smyth", date(1980, 1, 1), "555-0101"),
+        _linkable(5, "Peter Parker", date(1990, 9, 9), "555-0303"),
+    ]
+    links, compared, _ = patient_linker._fuzzy_links(
+        records, list(range(len(records))), ["dob"], threshold=90, max_block=100, workers=1
+    )
+    assert (1, 3) in links and (3, 4) in links
+    assert all(2 not in pair and 5 not in pair for pair in links)
+    assert compared == 6  # only the three patients sharing a DOB are compared
+
+    updates = patient_linker._cluster_updates(records, links, full=True)
+    assert {u["id"]: u["cluster_id"] for u in updates} == {1: 1, 2: 2, 3: 1, 4: 1, 5: 5}
+
+    # Incremental runs keep existing clusters and merge new links into them
+    for record in records:
+        record.cluster_id = {1: 1, 2: 2, 3: 1, 4: 1, 5: 5}[record.id]
+    records.append(_linkable(6, "Pete Parker", date(1990, 9, 9), "555-0303"))
+    links, _, _ = patient_linker._fuzzy_links(records, [5], ["dob"], threshold=80, max_block=100, workers=1)
+    assert links == {(5, 6)}
+    assert patient_linker._cluster_updates(records, links, full=False) == [{"id": 6, "cluster_id": 5}]
+
+    # Oversized blocks are skipped instead of compared pairwise
+    _, compared, oversized = patient_linker._fuzzy_links(records, [0], ["dob"], threshold=90, max_block=2, workers=1)
+    assert compared == 0 and oversized == {"dob:1980-01-01"}
+
+
+def test_cluster_id_writes_keep_updated_at():
+    from sqlalchemy import Column, DateTime, Integer, MetaData, Table, create_engine, select
+
+    # Just the columns the statement touches; the full patients table needs PostgreSQL types
+    table = Table("patients", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("cluster_id", Integer), Column("updated_at", DateTime))
+    engine = create_engine("sqlite://")
+    table.create(engine)
+    edited = datetime(2024, 1, 1, 12, 0)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [{"id": 1, "updated_at": edited}, {"id": 2, "updated_at": edited}])
+        connection.execute(patient_linker._cluster_id_update(), [
+            {"patient_id": 1, "new_cluster_id": 1}, {"patient_id": 2, "new_cluster_id": 1},
+        ])
+        rows = connection.execute(select(table).order_by(table.c.id)).all()
+
+    assert [(row.cluster_id, row.updated_at) for row in rows] == [(1, edited), (1, edited)]
+
+    # Stored cluster ids win over the (possibly stale) snapshot records
+    records = [_linkable(1, "A", None, None), _linkable(2, "B", None, None), _linkable(3, "C", None, None)]
+    assert patient_linker._cluster_updates(records, {(2, 3)}, full=False, cluster_ids={1: 1, 2: 1}) == [
+        {"id": 3, "cluster_id": 1}
+    ]
+
+
+class FakeSession:
+    def __init__(self, fail_on=None):
+        self.calls, self.fail_on = [], fail_on
+
+    def _record(self, name, model, mappings):
+        if name == self.fail_on:
+            raise RuntimeError(f"{name} failed")
+        self.calls.append((name, model, list(mappings)))
+
+    def bulk_update_mappings(self, model, mappings):
+        self._record("update", model, mappings)
+
+    def commit(self):
+        if self.fail_on == "commit":
+            raise RuntimeError("commit failed")
+        self.calls.append(("commit",))
+
+    def rollback(self):
+        self.calls.append(("rollback",))
+
+
+def test_write_batch_flushes_in_one_transaction():
+    db = FakeSession()
+    batch = PatientWriteBatch(db)
+    stored = _stored_patient(1, "Alice Walker", None)
+    stored.dob, stored.ssn, stored.insurance_number = None, "1", None
+
+    batch.update(stored, {"dob": date(1980, 1, 1), "ssn": "2", "medical_conditions": ["asthma"]})
+    batch.update(stored, {"ssn": "3", "medical_conditions": []})
+    batch.flush()
+
+    (_, model, updates), commit = db.calls
+    assert model is Patient
+    # Two updates to the same patient collapse into one mapping, last write wins
+    assert len(updates) == 1 and updates[0]["ssn"] == "3" and updates[0]["name_key"] == "alice walker"
+    assert commit == ("commit",)
+    assert len(batch) == 0
+
+
+def test_write_batch_rolls_back_whole_batch_on_failure():
+    db = FakeSession(fail_on="commit")
+    batch = PatientWriteBatch(db)
+    stored = _stored_patient(1, "Alice Walker", None)
+    stored.dob, stored.ssn, stored.insurance_number = None, None, None
+    batch.update(stored, {"ssn": "2"})
+
+    with pytest.raises(RuntimeError):
+        batch.flush()
+    assert [call[0] for call in db.calls] == ["update", "rollback"]
+
+
+def test_match_job_streams_chunk_results_and_summary(monkeypatch):
+    chunks = []
+
+    def fake_process(chunk, db, blocking_keys=None, parallel=None):
+        chunks.append([p.name for p in chunk])
+        return {
+            "matched_patients": [{"incoming": {"name": p.name}} for p in chunk if p.name.startswith("m")],
+            "unmatched_patients": [{"name": p.name} for p in chunk if not p.name.startswith("m")],
+            "new_patients": [],
+            "summary": {"total": len(chunk), "matched": sum(p.name.startswith("m") for p in chunk), "blocking_keys": []},
+        }
+
+    monkeypatch.setattr(match_jobs, "process_fuzzy_match", fake_process)
+    closed = []
+    manager = match_jobs.MatchJobManager(lambda: SimpleNamespace(close=lambda: closed.append(1)), max_workers=1)
+
+    patients = [PatientData(name=name) for name in ["m1", "u1", "m2", "m3", "u2"]]
+    job = manager.submit(patients, chunk_size=2)
+    lines = list(job.follow())
+
+    assert chunks == [["m1", "u1"], ["m2", "m3"], ["u2"]]
+    assert len(closed) == 3
+    assert [line["type"] for line in lines] == ["matched", "unmatched", "matched", "matched", "unmatched", "summary"]
+    assert lines[-1]["status"] == "completed"
+    assert lines[-1]["summary"]["total"] == 5 and lines[-1]["summary"]["matched"] == 3
+    assert manager.get(job.id).progress()["progress"] == 1.0
+    manager.shutdown()
+
+
+class FakePatientsQuery:
+    """
+    Stands in for the snapshot's column query over a list of row dicts.
+    """
+
+    def __init__(self, table, log):
+        self.table = table
+        self.log = log
+        self.since = None
+
+    def filter(self, condition):
+        self.since = condition.right.value
+        return self
+
+    def order_by(self, column):
+        return self
+
+    def _rows(self):
+        rows = [r for r in sorted(self.table.values(), key=lambda r: r["id"])
+                if self.since is None or r["updated_at"] >= self.since]
+        self.log.append(("delta" if self.since else "full", len(rows)))
+        return [tuple(r.get(c) for c in SNAPSHOT_COLUMNS) for r in rows]
+
+    def yield_per(self, count):
+        return iter(self._rows())
+
+    def all(self):
+        return self._rows()
+
+
+def test_patient_snapshot_refreshes_incrementally(monkeypatch):
+    start = datetime(2024, 1, 1)
+    table = {i: {"id": i, "name": f"patient {i}", "updated_at": start + timedelta(minutes=i)} for i in range(1, 6)}
+    log = []
+    snapshot = PatientSnapshot()
+    monkeypatch.setattr(snapshot, "_query", lambda db: FakePatientsQuery(table, log))
+
+    first = snapshot.records(db=None)
+    assert [r.id for r in first] == [1, 2, 3, 4, 5] and log == [("full", 5)]
+    assert first[0].to_dict()["updated_at"] == "2024-01-01T00:01:00"
+
+    # Another writer updates one row and adds one; only rows from the watermark on
+    # are read (row 5 sits at the watermark)
+    table[2] = {**table[2], "name": "renamed", "updated_at": start + timedelta(hours=1)}
+    table[6] = {"id": 6, "name": "patient 6", "updated_at": start + timedelta(hours=1)}
+    second = snapshot.records(db=None)
+    assert log[-1] == ("delta", 3)
+    assert [r.name for r in second] == ["patient 1", "renamed", "patient 3", "patient 4", "patient 5", "patient 6"]
+    assert first[1].name == "patient 2"  # earlier readers keep their consistent view
+    assert snapshot.version == 2
+
+    snapshot.records(db=None)
+    assert snapshot.version == 2
+    stats = snapshot.stats()
+    assert stats["records"] == 6 and stats["full_reloads"] == 1 and stats["delta_refreshes"] == 2
+    assert stats["estimated_memory_bytes"] > 0
+
+
+@pytest.fixture
+def pg_session():
+    """
+    Session on TEST_DATABASE_URL inside a transaction that is rolled back afterwards.
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+    from database.models import Base
+
+    engine = create_engine(url)
+    connection = engine.connect()
+    transaction = connection.begin()
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    Base.metadata.create_all(bind=connection)
+    session = Session(bind=connection)
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
+
+
+def test_sql_candidate_retrieval_ranks_similar_patients(pg_session):
+    from sqlalchemy import text
+    from database.patient_repository import find_similar_patient_ids, get_patient_by_name
+
+    rows = [
+        Patient(name="Jonathan Smith", address="12 Main Street", dob=date(1980, 1, 1)),
+        Patient(name="Jonathon Smyth", address="12 Main St", dob=date(1981, 2, 2)),
+        Patient(name="Maria Garcia", address="9 Elm Road", dob=date(1980, 1, 1)),
+        Patient(name="Unrelated Person", address="77 Far Away", dob=date(1970, 7, 7)),
+    ]
+    pg_session.add_all(rows)
+    pg_session.flush()
+    ids = [row.id for row in rows]
+
+    found = find_similar_patient_ids(pg_session, PatientData(name="Jonathan Smith", address="12 Main Street"))
+    assert found[:2] == ids[:2]
+    assert ids[3] not in found
+
+    # DOB equality brings in candidates with dissimilar names, ranked after similar ones
+    found = find_similar_patient_ids(pg_session, PatientData(name="Jonathan Smith", dob=date(1980, 1, 1)))
+    assert found.index(ids[0]) < found.index(ids[2])
+    assert find_similar_patient_ids(pg_session, PatientData(name="Jonathan Smith"), limit=1) == [ids[0]]
+
+    assert get_patient_by_name(pg_session, "Maria Garcia").id == ids[2]
+    assert get_patient_by_name(pg_session, "maria garcia") is None
+
+    indexes = {row[0] for row in pg_session.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'patients'"))}
+    assert {"ix_patients_name", "ix_patients_dob", "ix_patients_name_trgm", "ix_patients_address_trgm"} <= indexes
+
+
+def test_link_patients_runs_incrementally_on_postgres(pg_session):
+    rows = [
+        Patient(name="Jonathan Smith", dob=date(1980, 1, 1), phone="555-0101", address="1 Main St"),
+        Patient(name="Jonathon Smith", dob=date(1980, 1, 1), phone="555-0101", address="1 Main St"),
+        Patient(name="Maria Garcia", dob=date(1975, 5, 5), phone="555-0202", address="9 Elm Rd"),
+    ]
+    pg_session.add_all(rows)
+    pg_session.flush()
+
+    edited = {row.id: row.updated_at for row in rows}
+    summary = patient_linker.link_patients(pg_session, full=True, use_embeddings=False, workers=1)
+    assert summary["full_run"] and summary["fuzzy_links"] == 1
+    # Linking is not an edit: the next incremental run must not see these rows as changed
+    assert {row.id: row.updated_at for row in rows} == edited
+    assert rows[1].cluster_id == rows[0].id and rows[2].cluster_id == rows[2].id
+
+    summary = patient_linker.link_patients(pg_session, use_embeddings=False, workers=1)
+    assert not summary["full_run"] and summary["rows_updated"] == 0